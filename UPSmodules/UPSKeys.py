@@ -57,6 +57,7 @@ class UpsType(UpsEnum):
     none = auto()
     apc_ap96xx = auto()
     eaton_pw = auto()
+    rfc1628 = auto()
 
 
 class UpsStatus(UpsEnum):
@@ -81,6 +82,7 @@ class MibGroup(UpsEnum):
     input = auto()
     static = auto()
     dynamic = auto()
+    health = auto()
 
 
 class TxtStyle(UpsEnum):
@@ -155,3 +157,5 @@ class MiB(UpsEnum):
     comms = auto()
     last_self_test_result = auto()
     last_self_test_date = auto()
+    input_phases = auto()
+    output_phases = auto()
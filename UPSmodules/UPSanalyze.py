@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+""" UPSanalyze  -  vectorized analysis of ups-mon psv logs
+
+    Logs are read in chunks of rows which are converted to NumPy arrays, so
+    memory use does not depend on the size of the log.  Report state is
+    accumulated per UPS across chunks, including outages which span chunk
+    boundaries.  Rotated and compressed log segments are read transparently.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import gzip
+import logging
+from operator import itemgetter
+from time import mktime
+from datetime import datetime
+from typing import Dict, List, Tuple, Set, Optional, Generator, Iterable, TextIO, Sequence
+try:
+    import numpy as np
+    NUMPY = True
+except ModuleNotFoundError as error:
+    print('numpy import error: {}'.format(error))
+    print('numpy is required for log analysis:  pip install numpy')
+    np = None
+    NUMPY = False
+from UPSmodules.env import UT_CONST
+from UPSmodules.UPSKeys import MiB, MarkUpCodes
+from UPSmodules.UPSlog import LogWriter, zstd
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+def open_log(file_name: str) -> TextIO:
+    """ Open a plain or compressed log segment for reading as text.
+
+    :param file_name: Name of the log segment.
+    :return: Text file object.
+    """
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode='rt', encoding='utf-8')
+    if file_name.endswith('.zst'):
+        if zstd is None:
+            raise OSError('Error: zstd is not supported by this Python version: [{}]'.format(file_name))
+        return zstd.open(file_name, mode='rt', encoding='utf-8')
+    return open(file_name, mode='r', encoding='utf-8')
+
+
+def expand_log_files(file_names: Iterable[str]) -> List[str]:
+    """ Expand each log file name into the list of its segments, in order.
+
+    :param file_names: Log file names as given by the user.
+    :return: List of segment file names.
+    """
+    result: List[str] = []
+    for file_name in file_names:
+        segments = LogWriter.segments(file_name)
+        if not segments and os.path.isfile(file_name):
+            segments = [file_name]
+        if not segments:
+            UT_CONST.process_message('Error: log file not found: [{}]'.format(file_name), verbose=True)
+        result.extend(segment for segment in segments if segment not in result)
+    return result
+
+
+class LogChunk:
+    """ Columns of a chunk of log rows as NumPy arrays.
+    """
+    numeric_columns: Tuple[MiB, ...] = (
+        MiB.time_on_battery, MiB.battery_runtime_remain, MiB.battery_capacity, MiB.output_load,
+        MiB.output_power, MiB.output_current, MiB.output_voltage, MiB.output_frequency,
+        MiB.input_voltage, MiB.input_frequency)
+    string_columns: Tuple[MiB, ...] = (MiB.last_self_test_result, MiB.last_self_test_date)
+    missing_values: Set[str] = {'---', 'None', '', 'No data', 'Invalid UPS'}
+
+    def __init__(self, times: 'np.ndarray', names: 'np.ndarray', values: Dict[MiB, 'np.ndarray'],
+                 strings: Dict[MiB, 'np.ndarray']):
+        self.times = times
+        self.names = names
+        self.values = values
+        self.strings = strings
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def select(self, mask: 'np.ndarray') -> 'LogChunk':
+        """ Return a new chunk with only the rows in mask.
+        """
+        return LogChunk(self.times[mask], self.names[mask],
+                        {name: column[mask] for name, column in self.values.items()},
+                        {name: column[mask] for name, column in self.strings.items()})
+
+    @staticmethod
+    def to_float(column: Sequence[str]) -> 'np.ndarray':
+        """ Convert a column of strings to floats with NaN for invalid entries.
+
+        :param column: List of strings.
+        :return: Float array.
+        """
+        try:
+            return np.array(column, dtype=np.float64)
+        except ValueError:
+            pass
+        missing = LogChunk.missing_values
+        try:
+            return np.array([value if value not in missing else 'nan' for value in column], dtype=np.float64)
+        except ValueError:
+            pass
+
+        def convert(value: str) -> float:
+            try:
+                return float(value)
+            except ValueError:
+                return np.nan
+        return np.fromiter((convert(value) for value in column), dtype=np.float64, count=len(column))
+
+
+class LogReader:
+    """ Streaming reader of ups-mon psv logs producing LogChunk objects.
+    """
+    _months: Dict[str, int] = {name: index for index, name in enumerate(
+        ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), start=1)}
+
+    def __init__(self, file_names: Iterable[str], chunk_size: int = 65536):
+        """
+        :param file_names: Log segment file names, in time order.
+        :param chunk_size: Maximum number of rows in each chunk.
+        """
+        self.file_names: List[str] = list(file_names)
+        self.chunk_size: int = chunk_size
+        self.rows: int = 0
+        self.bad_rows: int = 0
+        self._time_cache: Dict[str, float] = {}
+
+    def _parse_time(self, time_str: str) -> float:
+        """ Convert a log time string to epoch time.  Rows from the same cycle share the time
+            string, so only the most recent results are cached.  The C locale form of %c is
+            parsed directly since strptime is the most expensive part of reading a log.
+        """
+        epoch = self._time_cache.get(time_str)
+        if epoch is None:
+            if len(self._time_cache) > 1024: self._time_cache.clear()
+            try:
+                _, month, day, hms, year = time_str.split()
+                hour, minute, second = hms.split(':')
+                epoch = mktime((int(year), self._months[month], int(day),
+                                int(hour), int(minute), int(second), 0, 0, -1))
+            except (ValueError, KeyError):
+                try:
+                    epoch = datetime.strptime(time_str, LogWriter.TIME_FORMAT).timestamp()
+                except ValueError:
+                    epoch = np.nan
+            self._time_cache[time_str] = epoch
+        return epoch
+
+    def chunks(self) -> Generator[LogChunk, None, None]:
+        """ Read all log files, yielding chunks of rows.
+
+        :return: Generator of LogChunk objects.
+        """
+        for file_name in self.file_names:
+            LOGGER.debug('Analyzing log file: %s', file_name)
+            with open_log(file_name) as log_file:
+                header = log_file.readline().rstrip('\n').split('|')
+                if not header or header[0] != 'time' or 'display_name' not in header:
+                    UT_CONST.process_message('Error: not a ups-mon log file: [{}]'.format(file_name), verbose=True)
+                    continue
+                num_cols = len(header)
+                name_index = header.index('display_name')
+                indexes = {mib: header.index(mib.name) for mib in LogChunk.numeric_columns + LogChunk.string_columns
+                           if mib.name in header}
+                lines: List[List[str]] = []
+                for line in log_file:
+                    fields = line.rstrip('\n').split('|')
+                    if len(fields) != num_cols:
+                        self.bad_rows += 1
+                        continue
+                    lines.append(fields)
+                    if len(lines) >= self.chunk_size:
+                        yield self._make_chunk(lines, name_index, indexes)
+                        lines = []
+                if lines:
+                    yield self._make_chunk(lines, name_index, indexes)
+
+    def _make_chunk(self, lines: List[List[str]], name_index: int, indexes: Dict[MiB, int]) -> LogChunk:
+        """ Convert rows of fields into a LogChunk.
+        """
+        self.rows += len(lines)
+        mibs = list(indexes)
+        columns = list(zip(*map(itemgetter(0, name_index, *indexes.values()), lines)))
+        epochs = {time_str: self._parse_time(time_str) for time_str in dict.fromkeys(columns[0])}
+        times = np.fromiter(map(epochs.__getitem__, columns[0]), dtype=np.float64, count=len(lines))
+        values = {mib: LogChunk.to_float(column) for mib, column in zip(mibs, columns[2:])
+                  if mib not in LogChunk.string_columns}
+        strings = {mib: np.asarray(column) for mib, column in zip(mibs, columns[2:])
+                   if mib in LogChunk.string_columns}
+        for mib in LogChunk.numeric_columns:
+            if mib not in values:
+                values[mib] = np.full(len(lines), np.nan)
+        for mib in LogChunk.string_columns:
+            if mib not in strings:
+                strings[mib] = np.full(len(lines), '---')
+        return LogChunk(times, np.asarray(columns[1]), values, strings)
+
+
+class UpsLogStats:
+    """ Report statistics for a single UPS accumulated over log chunks.
+    """
+    load_bins: int = 10
+    outage_bins: Tuple[float, ...] = (0.0, 1.0, 5.0, 15.0, 30.0, 60.0, np.inf if NUMPY else float('inf'))
+    nominal_voltages: Tuple[float, ...] = (100.0, 120.0, 208.0, 230.0, 240.0)
+    nominal_frequencies: Tuple[float, ...] = (50.0, 60.0)
+    voltage_tolerance: float = 0.10
+    frequency_tolerance: float = 1.0
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self.samples: int = 0
+        self.first_time: float = np.inf
+        self.last_time: float = -np.inf
+        self.on_battery: bool = False
+        self.outage_start: float = np.nan
+        self.outage_max: float = 0.0
+        self.outages: List[Tuple[float, float]] = []
+        self.battery_samples: int = 0
+        self.peak_load: float = -np.inf
+        self.peak_load_time: float = np.nan
+        self.peak_power: float = -np.inf
+        self.runtime_sum = np.zeros(self.load_bins + 1)
+        self.runtime_count = np.zeros(self.load_bins + 1, dtype=np.int64)
+        self.nominal_voltage: Optional[float] = None
+        self.nominal_frequency: Optional[float] = None
+        self.excursions: Dict[str, Dict[str, float]] = {
+            'input_voltage': {'low': 0, 'high': 0, 'min': np.inf, 'max': -np.inf},
+            'input_frequency': {'low': 0, 'high': 0, 'min': np.inf, 'max': -np.inf}}
+
+    def update(self, chunk: LogChunk) -> None:
+        """ Accumulate statistics for the rows of this UPS in the chunk.
+
+        :param chunk: Chunk containing only rows for this UPS, in time order.
+        """
+        times = chunk.times
+        self.samples += len(chunk)
+        self.first_time = min(self.first_time, np.nanmin(times))
+        self.last_time = max(self.last_time, np.nanmax(times))
+        tob = chunk.values[MiB.time_on_battery]
+        load = chunk.values[MiB.output_load]
+        runtime = chunk.values[MiB.battery_runtime_remain]
+
+        # Outages, carrying the on battery state across chunks.
+        on_batt = np.nan_to_num(tob) > 0
+        self.battery_samples += int(np.count_nonzero(on_batt))
+        change = np.flatnonzero(np.diff(np.concatenate(([self.on_battery], on_batt))))
+        start = 0
+        for index in change:
+            if not self.on_battery:
+                self.outage_start = times[index]
+                self.outage_max = 0.0
+            else:
+                self._end_outage(tob[start:index])
+            start = index
+            self.on_battery = not self.on_battery
+        if self.on_battery:
+            segment = tob[start:]
+            if segment.size and not np.all(np.isnan(segment)):
+                self.outage_max = max(self.outage_max, float(np.nanmax(segment)))
+
+        # Peak load and power
+        if np.any(~np.isnan(load)):
+            index = int(np.nanargmax(load))
+            if load[index] > self.peak_load:
+                self.peak_load = float(load[index])
+                self.peak_load_time = times[index]
+        power = chunk.values[MiB.output_power]
+        if np.any(~np.isnan(power)):
+            self.peak_power = max(self.peak_power, float(np.nanmax(power)))
+
+        # Runtime remaining versus load in 10% load bins
+        valid = ~(np.isnan(load) | np.isnan(runtime))
+        bins = np.clip((load[valid] // (100 / self.load_bins)).astype(np.int64), 0, self.load_bins)
+        self.runtime_sum += np.bincount(bins, weights=runtime[valid], minlength=self.load_bins + 1)
+        self.runtime_count += np.bincount(bins, minlength=self.load_bins + 1)
+
+        # Input excursions while on line power
+        self._excursions('input_voltage', chunk.values[MiB.input_voltage][~on_batt],
+                         self.nominal_voltages, self.voltage_tolerance, relative=True)
+        self._excursions('input_frequency', chunk.values[MiB.input_frequency][~on_batt],
+                         self.nominal_frequencies, self.frequency_tolerance, relative=False)
+
+    def _end_outage(self, segment: 'np.ndarray') -> None:
+        """ Record the end of an outage.
+
+        :param segment: Time on battery values in this chunk for the ending outage.
+        """
+        if segment.size and not np.all(np.isnan(segment)):
+            self.outage_max = max(self.outage_max, float(np.nanmax(segment)))
+        self.outages.append((self.outage_start, self.outage_max))
+
+    def _excursions(self, name: str, values: 'np.ndarray', nominals: Tuple[float, ...],
+                    tolerance: float, relative: bool) -> None:
+        """ Count values outside of tolerance of the nominal value.  The nominal value is selected
+            from the first data as the closest standard value.
+        """
+        values = values[~np.isnan(values)]
+        values = values[values > 0]
+        if not values.size: return
+        nominal = self.nominal_voltage if name == 'input_voltage' else self.nominal_frequency
+        if nominal is None:
+            median = float(np.median(values))
+            nominal = min(nominals, key=lambda x: abs(x - median))
+            if name == 'input_voltage': self.nominal_voltage = nominal
+            else: self.nominal_frequency = nominal
+        band = nominal * tolerance if relative else tolerance
+        stats = self.excursions[name]
+        stats['low'] += int(np.count_nonzero(values < nominal - band))
+        stats['high'] += int(np.count_nonzero(values > nominal + band))
+        stats['min'] = min(stats['min'], float(values.min()))
+        stats['max'] = max(stats['max'], float(values.max()))
+
+    def finish(self) -> None:
+        """ Close an outage still in progress at the end of the log.
+        """
+        if self.on_battery:
+            self.outages.append((self.outage_start, self.outage_max))
+            self.on_battery = False
+
+    def outage_histogram(self) -> 'np.ndarray':
+        """ Count outages by duration in minutes using outage_bins.
+        """
+        durations = np.array([duration for _, duration in self.outages], dtype=np.float64)
+        return np.histogram(durations, bins=np.array(self.outage_bins))[0]
+
+
+class LogAnalyzer:
+    """ Analyze ups-mon logs and print a report for each UPS.
+    """
+    def __init__(self, file_names: Iterable[str], chunk_size: int = 65536):
+        self.reader: LogReader = LogReader(expand_log_files(file_names), chunk_size)
+        self.stats: Dict[str, UpsLogStats] = {}
+
+    def run(self) -> Dict[str, UpsLogStats]:
+        """ Read all logs and accumulate statistics for each UPS.
+
+        :return: Dictionary of UpsLogStats by UPS display name.
+        """
+        for chunk in self.reader.chunks():
+            names, inverse = np.unique(chunk.names, return_inverse=True)
+            for index, name in enumerate(names):
+                if name not in self.stats:
+                    self.stats[name] = UpsLogStats(str(name))
+                self.stats[name].update(chunk.select(inverse == index))
+        for stats in self.stats.values():
+            stats.finish()
+        return self.stats
+
+    def print_report(self) -> None:
+        """ Print the report for all UPSs.
+        """
+        if UT_CONST.no_markup:
+            color_code = reset_code = ''
+        else:
+            color_code: str = UT_CONST.mark_up_codes[MarkUpCodes.data]
+            reset_code: str = UT_CONST.mark_up_codes[MarkUpCodes.reset]
+
+        def time_str(epoch: float) -> str:
+            if not np.isfinite(epoch): return '---'
+            return datetime.fromtimestamp(epoch).astimezone().strftime(UT_CONST.TIME_FORMAT)
+
+        def item(label: str, value: object, indent: int = 3) -> None:
+            print('{}{}: {}{}{}'.format(' ' * indent, label, color_code, value, reset_code))
+
+        print('Analyzed {} rows from {} files, {} invalid rows skipped.\n'.format(
+            self.reader.rows, len(self.reader.file_names), self.reader.bad_rows))
+        for name, stats in sorted(self.stats.items()):
+            print(name)
+            item('Samples', stats.samples)
+            item('First Sample', time_str(stats.first_time))
+            item('Last Sample', time_str(stats.last_time))
+            durations = [duration for _, duration in stats.outages]
+            item('Outages', len(stats.outages))
+            if durations:
+                item('Total Time on Battery (min)', round(sum(durations), 2))
+                item('Longest Outage (min)', round(max(durations), 2))
+                item('Mean Outage (min)', round(sum(durations) / len(durations), 2))
+                print('   Outage Duration Distribution (min):')
+                bins = stats.outage_bins
+                for index, count in enumerate(stats.outage_histogram()):
+                    label = '>= {:g}'.format(bins[index]) if not np.isfinite(bins[index + 1]) else \
+                        '{:g} - {:g}'.format(bins[index], bins[index + 1])
+                    item(label, count, indent=6)
+            item('Peak Load (%)', '{:g} at {}'.format(stats.peak_load, time_str(stats.peak_load_time))
+                 if np.isfinite(stats.peak_load) else '---')
+            item('Peak Power (W)', '{:g}'.format(stats.peak_power) if np.isfinite(stats.peak_power) else '---')
+            print('   Mean Runtime Remaining (min) by Load (%):')
+            bin_width = 100 // stats.load_bins
+            for index in np.flatnonzero(stats.runtime_count):
+                item('{:3d} - {:3d}'.format(index * bin_width, (index + 1) * bin_width),
+                     round(stats.runtime_sum[index] / stats.runtime_count[index], 2), indent=6)
+            for exc_name, label, nominal in (('input_voltage', 'Input Voltage', stats.nominal_voltage),
+                                             ('input_frequency', 'Input Frequency', stats.nominal_frequency)):
+                exc = stats.excursions[exc_name]
+                if nominal is None: continue
+                item('{} Excursions (nominal {:g})'.format(label, nominal),
+                     'low: {}, high: {}, range: {:g} - {:g}'.format(exc['low'], exc['high'], exc['min'], exc['max']))
+            print('')
+
+
+class BatteryHealth:
+    """ Estimate battery capacity fade for each UPS from the on battery episodes in ups-mon logs.
+
+        For each episode, the rate of decrease of battery capacity is fit by least squares and
+        normalized to 100% load.  As a battery loses capacity, the normalized rate increases.
+        Fade is the increase of recent episodes compared to the earliest episodes, with no episode
+        in both, and the trend
+        is the least squares slope of the normalized rate over time.  All fits are computed for
+        all episodes of all UPSs at once.
+    """
+    min_samples: int = 3
+    min_capacity_drop: float = 2.0
+    min_load: float = 5.0
+    baseline_episodes: int = 3
+    fade_warn: float = 20.0
+    fade_crit: float = 40.0
+    failed_tests: Set[str] = {'Failed', 'Failure/Warning'}
+    # Only failed self tests within this many seconds of the latest self test flag a battery as Fading.
+    self_test_window: float = 90 * 86400.0
+
+    def __init__(self, file_names: Iterable[str], chunk_size: int = 65536):
+        self.reader: LogReader = LogReader(expand_log_files(file_names), chunk_size)
+        self.ups_names: List[str] = []
+        self.self_tests: Dict[str, List[Tuple[float, str, str]]] = {}
+        self.results: Dict[str, Dict[str, object]] = {}
+        self._state: Dict[str, Dict[str, object]] = {}
+        self._num_episodes: int = 0
+        self._samples: List[Tuple['np.ndarray', ...]] = []
+
+    def _collect(self, name: str, chunk: LogChunk) -> None:
+        """ Collect on battery samples and self test results from rows of a single UPS.
+
+        :param name: UPS display name.
+        :param chunk: Chunk containing only rows for this UPS, in time order.
+        """
+        if name not in self._state:
+            self._state[name] = {'index': len(self.ups_names), 'on': False, 'episode': -1, 'test': None}
+            self.ups_names.append(name)
+            self.self_tests[name] = []
+        state = self._state[name]
+
+        on_batt = np.nan_to_num(chunk.values[MiB.time_on_battery]) > 0
+        starts = on_batt & ~np.concatenate(([state['on']], on_batt[:-1]))
+        new_count = np.cumsum(starts)
+        episodes = np.where(new_count == 0, state['episode'], self._num_episodes - 1 + new_count)
+        self._num_episodes += int(new_count[-1])
+        state['on'] = bool(on_batt[-1])
+        state['episode'] = int(episodes[-1])
+        if np.any(on_batt):
+            self._samples.append((np.full(int(np.count_nonzero(on_batt)), state['index']), episodes[on_batt],
+                                  chunk.times[on_batt], chunk.values[MiB.battery_capacity][on_batt],
+                                  chunk.values[MiB.output_load][on_batt]))
+
+        # A change of self test date or result indicates a new self test.
+        dates = chunk.strings[MiB.last_self_test_date]
+        results = chunk.strings[MiB.last_self_test_result]
+        valid = ~np.isin(results, list(LogChunk.missing_values))
+        if not np.any(valid): return
+        tests = np.char.add(np.char.add(dates[valid].astype(str), '|'), results[valid].astype(str))
+        changed = tests != np.concatenate(([state['test']], tests[:-1]))
+        times = chunk.times[valid]
+        for index in np.flatnonzero(changed):
+            date, result = str(tests[index]).split('|', 1)
+            self.self_tests[name].append((float(times[index]), date, result))
+        state['test'] = tests[-1]
+
+    def run(self) -> Dict[str, Dict[str, object]]:
+        """ Read all logs, fit all episodes, and calculate fade for each UPS.
+
+        :return: Dictionary of results by UPS display name.
+        """
+        for chunk in self.reader.chunks():
+            names, inverse = np.unique(chunk.names, return_inverse=True)
+            for index, name in enumerate(names):
+                self._collect(str(name), chunk.select(inverse == index))
+        for name in self.ups_names:
+            self.results[name] = {'episodes': 0, 'valid_episodes': 0, 'baseline_rate': np.nan,
+                                  'recent_rate': np.nan, 'fade': np.nan, 'trend': np.nan,
+                                  'full_load_runtime': np.nan, 'status': 'No Data'}
+        if self._samples:
+            self._fit(*(np.concatenate(column) for column in zip(*self._samples)))
+        for name in self.ups_names:
+            self._set_status(name)
+        return self.results
+
+    def _fit(self, ups_index: 'np.ndarray', episodes: 'np.ndarray', times: 'np.ndarray',
+             capacity: 'np.ndarray', load: 'np.ndarray') -> None:
+        """ Fit the discharge rate of all episodes and the trend of all UPSs.
+        """
+        valid = ~(np.isnan(times) | np.isnan(capacity) | np.isnan(load))
+        ups_index, episodes, times, capacity, load = (x[valid] for x in (ups_index, episodes, times, capacity, load))
+        num = self._num_episodes
+        minutes = times / 60.0
+
+        # Least squares slope of capacity versus time for each episode.
+        count = np.bincount(episodes, minlength=num)
+        safe_count = np.maximum(count, 1)
+        mean_t = np.bincount(episodes, weights=minutes, minlength=num) / safe_count
+        mean_c = np.bincount(episodes, weights=capacity, minlength=num) / safe_count
+        mean_load = np.bincount(episodes, weights=load, minlength=num) / safe_count
+        d_t = minutes - mean_t[episodes]
+        var_t = np.bincount(episodes, weights=d_t * d_t, minlength=num)
+        cov = np.bincount(episodes, weights=d_t * (capacity - mean_c[episodes]), minlength=num)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rate = -cov / var_t
+            normalized = rate / mean_load * 100.0
+
+        order = np.argsort(episodes, kind='stable')
+        present, first = np.unique(episodes[order], return_index=True)
+        drop = np.full(num, 0.0)
+        drop[present] = np.maximum.reduceat(capacity[order], first) - np.minimum.reduceat(capacity[order], first)
+        start = np.full(num, np.nan)
+        start[present] = np.minimum.reduceat(times[order], first)
+        owner = np.full(num, -1)
+        owner[present] = ups_index[order][first]
+
+        good = (count >= self.min_samples) & (drop >= self.min_capacity_drop) & \
+            (mean_load >= self.min_load) & (rate > 0) & np.isfinite(normalized)
+
+        # Trend of normalized rate over time, in days, for each UPS.
+        num_ups = len(self.ups_names)
+        g_owner, g_start, g_rate = owner[good], start[good] / 86400.0, normalized[good]
+        order = np.lexsort((g_start, g_owner))
+        g_owner, g_start, g_rate = g_owner[order], g_start[order], g_rate[order]
+        n_ups = np.bincount(g_owner, minlength=num_ups)
+        safe_n = np.maximum(n_ups, 1)
+        mean_s = np.bincount(g_owner, weights=g_start, minlength=num_ups) / safe_n
+        mean_r = np.bincount(g_owner, weights=g_rate, minlength=num_ups) / safe_n
+        d_s = g_start - mean_s[g_owner]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            trend = np.bincount(g_owner, weights=d_s * (g_rate - mean_r[g_owner]), minlength=num_ups) / \
+                np.bincount(g_owner, weights=d_s * d_s, minlength=num_ups)
+
+        for index, name in enumerate(self.ups_names):
+            result = self.results[name]
+            result['episodes'] = int(np.count_nonzero(owner == index))
+            result['valid_episodes'] = int(n_ups[index])
+            if not n_ups[index]: continue
+            rates = g_rate[g_owner == index]
+            # Baseline and recent windows do not overlap, so fade is zero only if the rates are the same.
+            window = max(min(self.baseline_episodes, len(rates) // 2), 1)
+            baseline = float(np.median(rates[:window]))
+            recent = float(np.median(rates[-window:]))
+            result['baseline_rate'] = baseline
+            result['recent_rate'] = recent
+            result['full_load_runtime'] = 100.0 / recent
+            if n_ups[index] > self.baseline_episodes:
+                result['fade'] = (1.0 - baseline / recent) * 100.0
+                # Trend as percent of baseline rate per 30 days
+                result['trend'] = float(trend[index]) * 30.0 / baseline * 100.0
+
+    def _set_status(self, name: str) -> None:
+        """ Set the health status of a UPS based on fade and self test results.
+        """
+        result = self.results[name]
+        tests = self.self_tests[name]
+        result['self_tests'] = len(tests)
+        result['last_self_test'] = tests[-1][2] if tests else '---'
+        result['failed_self_tests'] = sum(1 for test in tests if test[2] in self.failed_tests)
+        recent_failed = sum(1 for test in tests if test[2] in self.failed_tests and
+                            test[0] >= tests[-1][0] - self.self_test_window)
+        fade = result['fade']
+        if result['last_self_test'] in self.failed_tests or (np.isfinite(fade) and fade >= self.fade_crit):
+            result['status'] = 'Replace Battery'
+        elif recent_failed or (np.isfinite(fade) and fade >= self.fade_warn):
+            result['status'] = 'Fading'
+        elif result['valid_episodes'] > self.baseline_episodes:
+            result['status'] = 'OK'
+        elif result['valid_episodes']:
+            result['status'] = 'Insufficient Data'
+
+    def print_report(self) -> None:
+        """ Print battery health results for all UPSs.
+        """
+        if UT_CONST.no_markup:
+            color_codes = {'data': '', 'ok': '', 'warn': '', 'crit': ''}
+            reset_code = ''
+        else:
+            color_codes = {'data': UT_CONST.mark_up_codes[MarkUpCodes.data],
+                           'ok': UT_CONST.mark_up_codes[MarkUpCodes.ok],
+                           'warn': UT_CONST.mark_up_codes[MarkUpCodes.warn],
+                           'crit': UT_CONST.mark_up_codes[MarkUpCodes.crit]}
+            reset_code = UT_CONST.mark_up_codes[MarkUpCodes.reset]
+
+        def item(label: str, value: object, style: str = 'data') -> None:
+            if isinstance(value, float):
+                value = '{:.3g}'.format(value) if np.isfinite(value) else '---'
+            print('   {}: {}{}{}'.format(label, color_codes[style], value, reset_code))
+
+        print('Analyzed {} rows from {} files, {} invalid rows skipped.\n'.format(
+            self.reader.rows, len(self.reader.file_names), self.reader.bad_rows))
+        status_style = {'Replace Battery': 'crit', 'Fading': 'warn', 'OK': 'ok'}
+        for name in sorted(self.results):
+            result = self.results[name]
+            print(name)
+            item('Battery Health', result['status'], status_style.get(result['status'], 'data'))
+            item('On Battery Episodes (used/total)', '{}/{}'.format(result['valid_episodes'], result['episodes']))
+            item('Baseline Discharge Rate (%/min at full load)', result['baseline_rate'])
+            item('Recent Discharge Rate (%/min at full load)', result['recent_rate'])
+            item('Estimated Full Load Runtime (min)', result['full_load_runtime'])
+            item('Capacity Fade (%)', result['fade'])
+            item('Discharge Rate Trend (% per 30 days)', result['trend'])
+            item('Self Tests (failed/total)', '{}/{}'.format(result['failed_self_tests'], result['self_tests']))
+            item('Last Self Test Result', result['last_self_test'])
+            print('')
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+""" UPSboinc  -  asynchronous BOINC GUI RPC client for ups-daemon actions
+
+    Suspends, resumes, or quits BOINC on any number of hosts concurrently by
+    talking the BOINC GUI RPC protocol directly, XML messages terminated by
+    0x03 on TCP port 31416, instead of starting a shell and boinccmd processes
+    for each project.  Authentication uses the nonce exchange of the protocol:
+    the client sends auth1, receives a nonce, and answers with the MD5 hash of
+    the nonce followed by the password from gui_rpc_auth.cfg.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import re
+import asyncio
+import hashlib
+import logging
+from time import monotonic
+from xml.sax.saxutils import escape, unescape
+from typing import Dict, List, Tuple, Optional, Iterable
+
+LOGGER = logging.getLogger('ups-utils')
+
+DEFAULT_PORT = 31416
+END_OF_MESSAGE = b'\x03'
+BOINC_ACTIONS: Tuple[str, ...] = ('suspend', 'resume', 'quit')
+
+
+class BoincRpcError(Exception):
+    """ Error reply, authentication failure, or protocol error from a BOINC client.
+    """
+
+
+def parse_host(host: str) -> Tuple[str, int]:
+    """ Split a host specification into host and port.
+
+    :param host: Host as HOST[:PORT], IPv6 addresses in brackets.
+    :return: Tuple of host name and port.
+    """
+    host = host.strip()
+    if host.startswith('['):
+        name, _, port = host[1:].partition(']')
+        port = port.lstrip(':')
+    elif host.count(':') == 1:
+        name, _, port = host.partition(':')
+    else:
+        name, port = host, ''
+    return name, int(port) if port else DEFAULT_PORT
+
+
+def read_password(password_file: Optional[str]) -> str:
+    """ Read the GUI RPC password from a gui_rpc_auth.cfg file.
+
+    :param password_file: Path of the file, or None for no password.
+    :return: The password, empty if none.
+    :raises OSError: If the file can not be read.
+    """
+    if not password_file: return ''
+    with open(password_file, 'r', encoding='utf-8') as auth_file:
+        return auth_file.readline().strip()
+
+
+class BoincClient:
+    """ Connection to the GUI RPC port of one BOINC client.
+    """
+    def __init__(self, host: str = 'localhost', password: str = '', timeout: float = 5.0):
+        """
+        :param host: Host as HOST[:PORT].
+        :param password: GUI RPC password.
+        :param timeout: Timeout in seconds for connecting and for each reply.
+        """
+        self.host: str = host
+        self.address: Tuple[str, int] = parse_host(host)
+        self.password: str = password
+        self.timeout: float = timeout
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+
+    def __repr__(self) -> str:
+        return 'BoincClient: {}:{}'.format(*self.address)
+
+    async def connect(self) -> None:
+        """ Open the connection and authorize.
+
+        :raises BoincRpcError: If authorization fails.
+        :raises OSError: If the host can not be reached.
+        """
+        self._reader, self._writer = await asyncio.wait_for(asyncio.open_connection(*self.address), self.timeout)
+        reply = await self.rpc('<auth1/>')
+        nonce = re.search(r'<nonce>(.*?)</nonce>', reply, re.DOTALL)
+        if not nonce:
+            raise BoincRpcError('no nonce in auth1 reply')
+        nonce_hash = hashlib.md5((nonce.group(1) + self.password).encode('utf-8')).hexdigest()
+        reply = await self.rpc('<auth2>\n<nonce_hash>{}</nonce_hash>\n</auth2>'.format(nonce_hash))
+        if '<authorized/>' not in reply:
+            raise BoincRpcError('unauthorized, check GUI RPC password')
+
+    async def close(self) -> None:
+        """ Close the connection.
+        """
+        if self._writer:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._reader = self._writer = None
+
+    async def rpc(self, request: str) -> str:
+        """ Send one request and wait for the reply.
+
+        :param request: Request XML, without the boinc_gui_rpc_request element.
+        :return: Reply XML.
+        :raises BoincRpcError: If the reply is an error.
+        """
+        self._writer.write('<boinc_gui_rpc_request>\n{}\n</boinc_gui_rpc_request>\n'.format(request).encode('utf-8') +
+                           END_OF_MESSAGE)
+        await self._writer.drain()
+        reply = await asyncio.wait_for(self._reader.readuntil(END_OF_MESSAGE), self.timeout)
+        reply = reply[:-1].decode('utf-8', errors='replace')
+        error = re.search(r'<error>(.*?)</error>', reply, re.DOTALL)
+        if error:
+            raise BoincRpcError(error.group(1).strip())
+        return reply
+
+    async def project_urls(self) -> List[str]:
+        """ Get the master URLs of all attached projects.
+
+        :return: List of project URLs.
+        """
+        reply = await self.rpc('<get_project_status/>')
+        return [unescape(url.strip()) for url in re.findall(r'<master_url>(.*?)</master_url>', reply, re.DOTALL)]
+
+    async def project_op(self, operation: str, urls: Iterable[str]) -> None:
+        """ Apply a project operation, such as suspend or resume, to the given projects.
+
+        :param operation: Project operation name.
+        :param urls: Project master URLs.
+        """
+        for url in urls:
+            await self.rpc('<project_{0}>\n<project_url>{1}</project_url>\n</project_{0}>'.format(
+                operation, escape(url)))
+
+    async def action(self, action: str) -> str:
+        """ Connect, apply an action to all projects, and close.  Quit suspends all projects
+            before the BOINC client is asked to exit, as quitBOINC.sh does.
+
+        :param action: One of BOINC_ACTIONS.
+        :return: Result message.
+        """
+        if action not in BOINC_ACTIONS:
+            raise ValueError('Error: invalid BOINC action [{}]'.format(action))
+        try:
+            await self.connect()
+            urls = await self.project_urls()
+            await self.project_op('resume' if action == 'resume' else 'suspend', urls)
+            if action == 'quit':
+                await self.rpc('<quit/>')
+            return '{} {} projects'.format(action, len(urls))
+        finally:
+            await self.close()
+
+
+class BoincHosts:
+    """ BOINC clients on a set of hosts, acted on concurrently.
+    """
+    def __init__(self, hosts: Iterable[str], password: str = '', timeout: float = 5.0):
+        """
+        :param hosts: Hosts as HOST[:PORT].
+        :param password: GUI RPC password shared by all hosts.
+        :param timeout: Timeout in seconds for each step of each host.
+        """
+        self.clients: List[BoincClient] = [BoincClient(host, password, timeout) for host in hosts]
+
+    def __repr__(self) -> str:
+        return 'BoincHosts: {}'.format(', '.join(client.host for client in self.clients))
+
+    async def _action(self, action: str) -> Dict[str, Tuple[bool, str]]:
+        results = await asyncio.gather(*(client.action(action) for client in self.clients), return_exceptions=True)
+        status: Dict[str, Tuple[bool, str]] = {}
+        for client, result in zip(self.clients, results):
+            if isinstance(result, (OSError, BoincRpcError, asyncio.TimeoutError, asyncio.IncompleteReadError)):
+                status[client.host] = (False, '{}: {}'.format(type(result).__name__, result))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                status[client.host] = (True, result)
+        return status
+
+    def run(self, action: str) -> Dict[str, Tuple[bool, str]]:
+        """ Apply an action on all hosts concurrently and wait for all to complete.
+
+        :param action: One of BOINC_ACTIONS.
+        :return: Dictionary of success and message by host.
+        """
+        start_time = monotonic()
+        status = asyncio.run(self._action(action))
+        LOGGER.debug('BOINC %s on %s hosts in %.3fs: %s', action, len(self.clients), monotonic() - start_time, status)
+        return status
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+""" UPSbreaker  -  circuit breaker for snmp communication with each UPS
+
+    Each UPS has a breaker fed by the outcome of every snmp request.  While
+    closed, requests are sent normally.  After consecutive transport failures,
+    such as snmpget timeouts, the breaker opens: the remaining requests of the
+    cycle are skipped and the UPS is reported as unresponsive, so one dead
+    network card no longer costs the full snmp timeout for every MiB of every
+    cycle.  After a backoff delay the breaker is half-open and one cheap probe
+    request is allowed.  If it succeeds the breaker closes and reading resumes,
+    otherwise the backoff is doubled, up to a maximum, and the breaker opens
+    again.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import random
+import logging
+import threading
+from enum import auto
+from time import monotonic
+from typing import Optional
+from UPSmodules.UPSKeys import UpsEnum
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+class BreakerState(UpsEnum):
+    """ Enum object to define states of the communication circuit breaker.
+    """
+    closed = auto()
+    open = auto()
+    half_open = auto()
+
+
+class CircuitBreaker:
+    """ Health state of the communication with one UPS.
+    """
+    def __init__(self, name: str = 'ups', failure_threshold: int = 2, backoff: float = 10.0,
+                 max_backoff: float = 600.0):
+        """
+        :param name: Name of the UPS, used in messages.
+        :param failure_threshold: Consecutive failures which open the breaker.
+        :param backoff: Delay in seconds before the first probe of an open breaker.
+        :param max_backoff: Maximum delay in seconds between probes.
+        """
+        self.name: str = name
+        self.failure_threshold: int = failure_threshold
+        self.base_backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        self.state: BreakerState = BreakerState.closed
+        self.failures: int = 0
+        self.backoff: float = backoff
+        self.next_probe: float = 0.0
+        self.opened: int = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        if self.state == BreakerState.open:
+            return 'CircuitBreaker {}: open, probe in {:.0f}s'.format(self.name, max(self.next_probe - monotonic(), 0.0))
+        return 'CircuitBreaker {}: {}'.format(self.name, self.state.name)
+
+    def is_closed(self) -> bool:
+        """ Return flag indicating the UPS is responding normally. """
+        return self.state == BreakerState.closed
+
+    def probe_due(self, now: Optional[float] = None) -> bool:
+        """ Return flag indicating the breaker is open and its probe is due. """
+        return self.state == BreakerState.open and (monotonic() if now is None else now) >= self.next_probe
+
+    def allow(self, now: Optional[float] = None, force: bool = False) -> bool:
+        """ Check if a request may be sent.  An open breaker becomes half-open when its probe
+            is due, and only that one probe request is allowed until its outcome is recorded.
+
+        :param now: Monotonic time, defaults to now.
+        :param force: If True, an open breaker is probed even if its probe is not yet due.
+        :return: True if the request should be sent.
+        """
+        with self.lock:
+            if self.state == BreakerState.closed: return True
+            if self.state == BreakerState.half_open: return False
+            if not force and (monotonic() if now is None else now) < self.next_probe: return False
+            self.state = BreakerState.half_open
+            LOGGER.debug('%s: probing', self)
+            return True
+
+    def record(self, success: bool, now: Optional[float] = None) -> bool:
+        """ Record the outcome of a request.
+
+        :param success: True if the UPS answered, even with an error reply.
+        :param now: Monotonic time, defaults to now.
+        :return: True if the state changed.
+        """
+        with self.lock:
+            previous = self.state
+            if success:
+                self.failures = 0
+                self.backoff = self.base_backoff
+                self.state = BreakerState.closed
+            else:
+                self.failures += 1
+                if self.state == BreakerState.half_open:
+                    self.backoff = min(self.backoff * 2.0, self.max_backoff)
+                    self._open(now)
+                elif self.state == BreakerState.closed and self.failures >= self.failure_threshold:
+                    self._open(now)
+            if self.state != previous:
+                LOGGER.debug('%s: %s -> %s', self, previous.name, self.state.name)
+            return self.state != previous
+
+    def trip(self, now: Optional[float] = None) -> None:
+        """ Open the breaker immediately, for a UPS found unresponsive.
+
+        :param now: Monotonic time, defaults to now.
+        """
+        with self.lock:
+            self.failures = max(self.failures, self.failure_threshold)
+            self._open(now)
+
+    def _open(self, now: Optional[float]) -> None:
+        """ Open the breaker and schedule the next probe.  Jitter keeps the probes of
+            UPSs that failed together from staying in step.
+        """
+        if self.state == BreakerState.closed: self.opened += 1
+        self.state = BreakerState.open
+        self.next_probe = (monotonic() if now is None else now) + self.backoff * random.uniform(0.9, 1.1)
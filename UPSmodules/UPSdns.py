@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+""" UPSdns  -  cached resolution of the FQDN management addresses of UPSs
+
+    A UPS configured by FQDN would otherwise have its name resolved again by
+    every snmpget and ping, costing a resolver round trip, or a resolver
+    timeout of several seconds, per request.  Each name is resolved once and
+    the address is cached for the cache TTL.  When the TTL expires, the
+    cached address is still used while the name is resolved again in a
+    background thread, so a slow or failing resolver never blocks a poll.  If
+    the resolver fails, the last good address is kept until it succeeds.
+    Only the first resolution of a name waits for the resolver.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import socket
+import logging
+import ipaddress
+import threading
+from time import monotonic
+from typing import Dict, Optional
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+def is_ip_address(host: str) -> bool:
+    """ Check if the host is an IP address literal, which needs no resolution.
+    """
+    try:
+        ipaddress.ip_address(host.strip('[]'))
+        return True
+    except ValueError:
+        return False
+
+
+def snmp_target(address: str) -> str:
+    """ Get the net-snmp agent argument for an address, with the transport prefix for IPv6.
+
+    :param address: IP address.
+    :return: Agent argument for snmpget.
+    """
+    address = address.strip('[]')
+    return 'udp6:[{}]'.format(address) if ':' in address else address
+
+
+class CacheEntry:
+    """ Resolved address of one name and the time it expires.
+    """
+    def __init__(self):
+        self.address: Optional[str] = None
+        self.expires: float = 0.0
+        self.refreshing: bool = False
+        self.failures: int = 0
+
+    def __repr__(self) -> str:
+        return 'CacheEntry: {} expires in {:.0f}s'.format(self.address, self.expires - monotonic())
+
+
+class DnsCache:
+    """ Cache of resolved names with stale-while-revalidate re-resolution.
+    """
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 30.0):
+        """
+        :param ttl: Time in seconds a resolved address is used before it is resolved again.
+        :param negative_ttl: Time in seconds before a name which failed to resolve is tried again.
+        """
+        self.ttl: float = ttl
+        self.negative_ttl: float = negative_ttl
+        self._entries: Dict[str, CacheEntry] = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return 'DnsCache: {} names, ttl {}s'.format(len(self._entries), self.ttl)
+
+    def resolve(self, host: str) -> Optional[str]:
+        """ Get the address of a host from the cache, resolving it if not yet cached.  An expired
+            address is returned at once and resolved again in the background.
+
+        :param host: IP address or FQDN.
+        :return: IP address, or None if the name has never resolved.
+        """
+        if not host or is_ip_address(host): return host
+        with self.lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                entry = self._entries[host] = CacheEntry()
+                entry.refreshing = True
+                first = True
+            else:
+                first = False
+                if monotonic() >= entry.expires and not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=self._refresh, args=(host, entry), daemon=True,
+                                     name='dns-{}'.format(host)).start()
+        if first: self._refresh(host, entry)
+        return entry.address
+
+    def _refresh(self, host: str, entry: CacheEntry) -> None:
+        """ Resolve a name and update its entry, keeping the previous address on failure.
+        """
+        try:
+            infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_UDP)
+            # Prefer IPv4 as net-snmp does for names.
+            infos.sort(key=lambda info: 0 if info[0] == socket.AF_INET else 1)
+            address = infos[0][4][0]
+        except (OSError, IndexError) as error:
+            with self.lock:
+                entry.failures += 1
+                entry.expires = monotonic() + self.negative_ttl
+                entry.refreshing = False
+            LOGGER.debug('Error resolving %s, keeping %s: %s', host, entry.address, error)
+            return
+        with self.lock:
+            if address != entry.address:
+                LOGGER.debug('Resolved %s: %s -> %s', host, entry.address, address)
+            entry.address = address
+            entry.failures = 0
+            entry.expires = monotonic() + self.ttl
+            entry.refreshing = False
+
+
+DNS_CACHE = DnsCache()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+""" UPSevents  -  correlation of UPS power transitions across the fleet
+
+    Each poll of the service samples all UPSs within a short time window.  The
+    correlator compares each sample with the previous one and groups the
+    transitions to and from battery power by the feed of each UPS, defined by
+    the feed key in ups-config.json.  Transitions of the same kind on the same
+    feed within the correlation window make one event.  If at least min_upss
+    UPSs are involved, it is a site event and the configured group action is
+    run once, instead of each UPS being handled as a separate alert.  An event
+    is closed early once every responsive UPS of the feed has transitioned.
+    A feed is in a site outage from its site on_battery event until none of
+    its UPSs is on battery, which the daemon uses to suspend or shut down
+    without waiting for its own thresholds.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import logging
+import threading
+from time import time
+from collections import Counter
+from typing import Dict, List, Tuple, Optional, Iterable, NamedTuple, Any
+from UPSmodules.env import UT_CONST
+from UPSmodules.UPSKeys import MiB
+
+LOGGER = logging.getLogger('ups-utils')
+
+EVENT_KINDS: Tuple[str, ...] = ('on_battery', 'on_line')
+SITE_OUTAGE_ACTIONS: Tuple[str, ...] = ('none', 'suspend', 'shutdown')
+DEFAULT_FEED = 'default'
+
+
+class FleetEvent(NamedTuple):
+    """ Transitions of the same kind on one feed within the correlation window.
+    """
+    feed: str
+    kind: str
+    upss: Tuple[str, ...]
+    feed_size: int
+    start: float
+    end: float
+    reasons: Tuple[str, ...]
+    site: bool
+
+
+def on_battery(prm: Any) -> Optional[bool]:
+    """ Determine if a UPS is on battery from its system status and time on battery.
+
+    :param prm: UpsItem parameters.
+    :return: True if on battery, False if on line power, None if unknown.
+    """
+    flags = set(str(prm.get(MiB.system_status) or '').split('-'))
+    if flags & {'OnBattery', 'Battery'}: return True
+    if flags & {'OnLine', 'Line'}: return False
+    try:
+        return float(prm.get(MiB.time_on_battery)) > 0.0
+    except (TypeError, ValueError):
+        return None
+
+
+class EventCorrelator:
+    """ Group power transitions of all UPSs by feed within a time window.
+    """
+    def __init__(self, window: float = 30.0, min_upss: int = 2, actions: Optional[Dict[str, str]] = None,
+                 timeout: float = 30.0):
+        """
+        :param window: Correlation window in seconds.
+        :param min_upss: Minimum number of UPSs in an event for it to be a site event.
+        :param actions: Command or tcp://HOST:PORT run for site events, by event kind.  Commands may
+            contain {feed}, {event}, and {upss}.
+        :param timeout: Timeout in seconds of actions.
+        """
+        self.window: float = window
+        self.min_upss: int = min_upss
+        self.actions: Dict[str, str] = {}
+        self.timeout: float = timeout
+        self.configure(window, min_upss, actions, timeout)
+        self._states: Dict[str, bool] = {}
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self.events: List[FleetEvent] = []
+        # Site on_battery events by feed, replaced as a whole so the daemon loop can read it.
+        self.site_outages: Dict[str, FleetEvent] = {}
+
+    def __repr__(self) -> str:
+        return 'EventCorrelator: window {}s, site event at {} UPSs'.format(self.window, self.min_upss)
+
+    def configure(self, window: float, min_upss: int, actions: Optional[Dict[str, str]], timeout: float) -> None:
+        """ Set the parameters, keeping the UPS states, pending events, and site outages.  Used when
+            the daemon configuration is refreshed, as the service keeps feeding this correlator.
+
+        :param window: Correlation window in seconds.
+        :param min_upss: Minimum number of UPSs in an event for it to be a site event.
+        :param actions: Command or tcp://HOST:PORT run for site events, by event kind.
+        :param timeout: Timeout in seconds of actions.
+        """
+        self.window = window
+        self.min_upss = min_upss
+        self.actions = {kind: action for kind, action in (actions or {}).items() if action}
+        self.timeout = timeout
+
+    def observe(self, upss: Iterable[Any], timestamp: Optional[float] = None) -> List[FleetEvent]:
+        """ Compare a fleet sample with the previous one and close any complete events.
+
+        :param upss: Iterable of UpsItem objects.
+        :param timestamp: Time of the sample, defaults to now.
+        :return: Events closed by this sample.
+        """
+        now = time() if timestamp is None else timestamp
+        feeds: Dict[str, List[str]] = {}
+        for ups in upss:
+            prm = ups.prm
+            if not prm.get('responsive'): continue
+            feed = prm.get('feed') or DEFAULT_FEED
+            feeds.setdefault(feed, []).append(prm.display_name)
+            state = on_battery(prm)
+            if state is None: continue
+            previous = self._states.get(prm.display_name)
+            self._states[prm.display_name] = state
+            if previous is None or previous == state: continue
+            kind = EVENT_KINDS[0] if state else EVENT_KINDS[1]
+            # A UPS which returned before its event closed is no longer part of it.
+            self._pending.get((feed, EVENT_KINDS[1] if state else EVENT_KINDS[0]), {}).get('upss', {}).pop(
+                prm.display_name, None)
+            pending = self._pending.setdefault((feed, kind), {'start': now, 'end': now, 'upss': {}})
+            pending['end'] = now
+            pending['upss'][prm.display_name] = str(prm.get(MiB.reason_for_last_transfer) or '')
+        closed = []
+        for (feed, kind), pending in list(self._pending.items()):
+            if not pending['upss']:
+                del self._pending[(feed, kind)]
+                continue
+            members = feeds.get(feed, [])
+            if now - pending['start'] < self.window and not set(members) <= set(pending['upss']): continue
+            del self._pending[(feed, kind)]
+            reasons = Counter(reason for reason in pending['upss'].values() if reason not in {'', '---', 'No data'})
+            closed.append(FleetEvent(feed, kind, tuple(pending['upss']), len(members), pending['start'], pending['end'],
+                                     tuple(reason for reason, _ in reasons.most_common()),
+                                     len(pending['upss']) >= self.min_upss))
+        self.events.extend(closed)
+        outages = {feed: event for feed, event in self.site_outages.items()
+                   if any(self._states.get(name) for name in feeds.get(feed, []))}
+        outages.update({event.feed: event for event in closed if event.site and event.kind == EVENT_KINDS[0]})
+        if outages != self.site_outages:
+            self.site_outages = outages
+        return closed
+
+    def site_outage(self, feed: Optional[str]) -> Optional[FleetEvent]:
+        """ Get the site on_battery event of a feed, if it is still on battery.
+
+        :param feed: Feed of a UPS, None for the default feed.
+        :return: The site event, or None if the feed is not in a site outage.
+        """
+        return self.site_outages.get(feed or DEFAULT_FEED)
+
+    def update(self, upss: Iterable[Any], stats: Dict[str, float]) -> None:
+        """ Observe the latest poll of the service, report closed events, and run site event actions.
+
+        :param upss: Iterable of UpsItem objects.
+        :param stats: Poll statistics of the service.
+        """
+        for event in self.observe(upss, stats.get('poll_time') or None):
+            message = '[{}] {} event: feed {} {} {}/{} UPSs in {:.1f}s [{}]{}'.format(
+                UT_CONST.now(ltz=UT_CONST.use_ltz, as_string=True), 'Site' if event.site else 'UPS', event.feed,
+                event.kind, len(event.upss), event.feed_size, event.end - event.start, ', '.join(event.upss),
+                ' reason: {}'.format(', '.join(event.reasons)) if event.reasons else '')
+            print(message)
+            LOGGER.debug(message)
+            if event.site and event.kind in self.actions:
+                threading.Thread(target=self._run_action, args=(event,), daemon=True).start()
+
+    def _run_action(self, event: FleetEvent) -> None:
+        """ Run the action of a site event.
+        """
+        # Imported here, so the correlator does not load asyncio until an action runs.
+        from UPSmodules.UPSshutdown import ShutdownPlan, parse_target
+        action = self.actions[event.kind]
+        if not action.startswith('tcp://'):
+            action = action.replace('{feed}', event.feed).replace('{event}', event.kind).replace(
+                '{upss}', ','.join(event.upss))
+        target = parse_target('{}-{}'.format(event.feed, event.kind), '0, {}, {}'.format(self.timeout, action))
+        for result in ShutdownPlan([target], event.feed, event.kind.upper()).run():
+            message = 'Site event action {}: {} in {:.2f}s {}'.format(
+                result.name, 'acknowledged' if result.acknowledged else 'FAILED', result.seconds, result.message)
+            if result.acknowledged:
+                LOGGER.debug(message)
+            else:
+                UT_CONST.process_message(message, verbose=True)
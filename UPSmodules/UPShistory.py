@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+""" UPShistory  -  fixed capacity in-memory history of UPS readings
+
+    Each UpsItem owns an UpsHistory object which records the numeric dynamic
+    MiB values each time they are read.  Storage is preallocated when the
+    object is created, so memory use is bounded by the configured capacity
+    and appending a sample never allocates.  The daemon fits the samples of
+    its UPS to the runtime prediction while on battery.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import math
+import logging
+from array import array
+from time import monotonic
+from typing import Dict, List, Tuple, Optional, Mapping, Any
+from UPSmodules.UPSKeys import MiB
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+Segment = Tuple[memoryview, memoryview]
+
+
+class UpsHistory:
+    """ Ring buffers of (monotonic timestamp, value) for the numeric metrics of a single UPS.
+
+        All metrics of a UPS are read in the same cycle, so they share a single timestamp
+        array.  Values are stored as single precision floats with NaN marking a missing
+        reading.  Memory use is capacity * (8 + 4 * number of metrics) bytes.
+    """
+    history_mibs: Tuple[MiB, ...] = (
+        MiB.ups_env_temp, MiB.battery_capacity, MiB.time_on_battery, MiB.battery_runtime_remain,
+        MiB.input_voltage, MiB.input_frequency, MiB.output_voltage, MiB.output_frequency,
+        MiB.output_load, MiB.output_current, MiB.output_power)
+
+    # 24 hours at a 10s read interval
+    default_capacity: int = 8640
+
+    def __init__(self, capacity: int = default_capacity):
+        """ Preallocate all storage for the history.
+
+        :param capacity: Number of samples retained for each metric.  Zero disables history.
+        """
+        self.capacity: int = max(int(capacity), 0)
+        self._times: array = array('d', bytes(8 * self.capacity))
+        self._values: Dict[MiB, array] = {mib: array('f', [math.nan]) * self.capacity
+                                          for mib in self.history_mibs}
+        self._head: int = 0
+        self._count: int = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __repr__(self) -> str:
+        return 'UpsHistory: {}/{} samples, {} bytes'.format(self._count, self.capacity, self.nbytes())
+
+    @classmethod
+    def capacity_for(cls, hours: float, interval: float) -> int:
+        """ Calculate the number of samples needed to span the given time at the given read interval.
+
+        :param hours: Time span of the history in hours.
+        :param interval: Read interval in seconds.
+        :return: Capacity in number of samples.
+        """
+        if interval <= 0: return 0
+        return int(math.ceil(hours * 3600 / interval))
+
+    def nbytes(self) -> int:
+        """ Total memory used by the preallocated buffers.
+
+        :return: Size in bytes.
+        """
+        return self._times.itemsize * len(self._times) + \
+            sum(values.itemsize * len(values) for values in self._values.values())
+
+    @staticmethod
+    def _to_float(value: Any) -> float:
+        """ Convert a MiB reading to a float, using NaN for non-numeric readings.
+
+        :param value: Value as read from UPS.
+        :return: Value as float
+        """
+        if value is None: return math.nan
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return math.nan
+
+    def append(self, readings: Mapping[Any, Any], timestamp: Optional[float] = None) -> None:
+        """ Append one sample of all metrics.  Metrics missing in readings are recorded as NaN.
+
+        :param readings: Mapping of MiB to value, typically UpsItem.prm.
+        :param timestamp: Monotonic timestamp of the reading, defaults to now.
+        """
+        if not self.capacity: return
+        index = self._head
+        self._times[index] = monotonic() if timestamp is None else timestamp
+        for mib, values in self._values.items():
+            values[index] = self._to_float(readings.get(mib))
+        self._head = (index + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def _start_index(self, seconds: Optional[float]) -> int:
+        """ Return the offset from the oldest sample of the first sample within the window.
+
+        :param seconds: Window size in seconds measured back from latest sample or None for all.
+        :return: Offset of first sample in window.
+        """
+        if seconds is None or not self._count: return 0
+        oldest = (self._head - self._count) % self.capacity
+        limit = self._times[(self._head - 1) % self.capacity] - seconds
+        low, high = 0, self._count
+        while low < high:
+            mid = (low + high) // 2
+            if self._times[(oldest + mid) % self.capacity] < limit:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def window(self, mib: MiB, seconds: Optional[float] = None) -> List[Segment]:
+        """ Get zero-copy views of the samples of a metric in chronological order.  Since the
+            data may wrap around the end of the buffer, it is returned as one or two segments.
+
+        :param mib: Target metric.
+        :param seconds: Only include samples within this many seconds of the latest sample.
+        :return: List of (timestamps, values) memoryview pairs.
+        """
+        if mib not in self._values:
+            raise KeyError('KeyError: no history for: {}'.format(mib))
+        if not self._count: return []
+        times = memoryview(self._times)
+        values = memoryview(self._values[mib])
+        offset = self._start_index(seconds)
+        start = (self._head - self._count + offset) % self.capacity
+        end = self._head if self._head else self.capacity
+        if start < end:
+            return [(times[start:end], values[start:end])]
+        segments = [(times[start:], values[start:])]
+        if self._head:
+            segments.append((times[:self._head], values[:self._head]))
+        return segments
+
+    def series(self, mib: MiB, seconds: Optional[float] = None) -> Tuple[List[float], List[float]]:
+        """ Get copies of the valid samples of a metric in chronological order.
+
+        :param mib: Target metric.
+        :param seconds: Only include samples within this many seconds of the latest sample.
+        :return: Tuple of timestamp list and value list.
+        """
+        times: List[float] = []
+        values: List[float] = []
+        for seg_times, seg_values in self.window(mib, seconds):
+            for timestamp, value in zip(seg_times, seg_values):
+                if math.isnan(value): continue
+                times.append(timestamp)
+                values.append(value)
+        return times, values
+
+    def latest(self, mib: MiB) -> Optional[Tuple[float, float]]:
+        """ Get the most recent sample of a metric.
+
+        :param mib: Target metric.
+        :return: Tuple of timestamp and value or None if no samples.
+        """
+        if not self._count: return None
+        index = (self._head - 1) % self.capacity
+        return self._times[index], self._values[mib][index]
+
+    def samples_since(self, timestamp: Optional[float], *mibs: MiB) -> List[Tuple[float, ...]]:
+        """ Get the samples of several metrics taken after the given time in chronological order.
+            Samples with a missing value for any of the metrics are skipped.
+
+        :param timestamp: Monotonic timestamp of the last sample already processed or None for all.
+        :param mibs: Target metrics.
+        :return: List of tuples of timestamp followed by the value of each metric.
+        """
+        for mib in mibs:
+            if mib not in self._values:
+                raise KeyError('KeyError: no history for: {}'.format(mib))
+        head, count = self._head, self._count
+        columns = [self._values[mib] for mib in mibs]
+        samples: List[Tuple[float, ...]] = []
+        for offset in range(1, count + 1):
+            index = (head - offset) % self.capacity
+            sample_time = self._times[index]
+            if timestamp is not None and sample_time <= timestamp: break
+            values = tuple(column[index] for column in columns)
+            if any(math.isnan(value) for value in values): continue
+            samples.append((sample_time, *values))
+        samples.reverse()
+        return samples
+
+    def slope(self, mib: MiB, seconds: Optional[float] = None) -> Optional[float]:
+        """ Least squares slope of a metric over the given window.
+
+        :param mib: Target metric.
+        :param seconds: Only include samples within this many seconds of the latest sample.
+        :return: Rate of change per minute or None if fewer than 2 valid samples.
+        """
+        times, values = self.series(mib, seconds)
+        num = len(times)
+        if num < 2: return None
+        mean_t = sum(times) / num
+        mean_v = sum(values) / num
+        var_t = sum((timestamp - mean_t) ** 2 for timestamp in times)
+        if not var_t: return None
+        cov = sum((timestamp - mean_t) * (value - mean_v) for timestamp, value in zip(times, values))
+        return cov / var_t * 60.0
+
+    def clear(self) -> None:
+        """ Discard all samples without releasing storage.
+        """
+        self._head = 0
+        self._count = 0
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+""" UPSlog  -  buffered, rotating psv log writer for ups-mon
+
+    Rows are formatted in a single pass and collected in memory, then written
+    in one system call every flush interval.  The log is split into segments
+    by size and/or age, each beginning with the header line so it can be read
+    on its own.  Closed segments can be compressed in a background thread.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import re
+import glob
+import gzip
+import shutil
+import logging
+import threading
+from time import monotonic
+from datetime import datetime
+from typing import List, Tuple, Union, Optional, Callable, Iterable
+from UPSmodules.UPSKeys import MiB
+
+try:
+    from compression import zstd
+    ZSTD = True
+except ImportError:
+    zstd = None
+    ZSTD = False
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+def compressors() -> Tuple[str, ...]:
+    """ Get the names of the available compression methods.
+
+    :return: Tuple of compression names.
+    """
+    return ('none', 'gzip', 'zstd') if ZSTD else ('none', 'gzip')
+
+
+class LogWriter:
+    """ Buffered writer of the ups-mon psv log with rotation and optional compression.
+    """
+    TIME_FORMAT: str = '%c'
+    _extensions = {'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, file_name: str, columns: Iterable[Union[str, MiB]], flush_interval: float = 10.0,
+                 max_bytes: int = 0, rotate_interval: float = 0.0, compress: str = 'none', keep: int = 0):
+        """ Open the first log segment and write the header.
+
+        :param file_name: Name of the first segment.  Later segments add a sequence number.
+        :param columns: Parameter names written after the time column of each row.
+        :param flush_interval: Seconds between writes of buffered rows to the file.  Zero writes every row.
+        :param max_bytes: Start a new segment when the current one reaches this size.  Zero for no limit.
+        :param rotate_interval: Start a new segment after this many seconds.  Zero for no limit.
+        :param compress: Compression method for closed segments, one of compressors().
+        :param keep: Number of closed segments to keep, oldest removed first.  Zero keeps all.
+        """
+        if compress not in compressors():
+            raise ValueError('Error: invalid compression [{}], must be one of {}'.format(compress, compressors()))
+        self.file_name: str = file_name
+        self.columns: Tuple[Union[str, MiB], ...] = tuple(columns)
+        self.header: str = '|'.join(['time'] + [str(column) for column in self.columns]) + '\n'
+        self.flush_interval: float = flush_interval
+        self.max_bytes: int = max_bytes
+        self.rotate_interval: float = rotate_interval
+        self.compress: str = compress
+        self.keep: int = keep
+
+        base, self._ext = os.path.splitext(file_name)
+        self._base: str = base
+        self._sequence: int = 0
+        self._buffer: List[str] = []
+        self._segment_bytes: int = 0
+        self._segment_start: float = monotonic()
+        self._last_flush: float = monotonic()
+        self._closed_segments: List[str] = []
+        self._threads: List[threading.Thread] = []
+        self.segment_name: str = file_name
+        self._file = self._open_segment()
+
+    def __repr__(self) -> str:
+        return 'LogWriter: {} segment {} ({} bytes)'.format(self.file_name, self._sequence, self._segment_bytes)
+
+    def _open_segment(self):
+        """ Open a new segment and write the header.
+
+        :return: The file object.
+        """
+        if self._sequence:
+            self.segment_name = '{}.{:03d}{}'.format(self._base, self._sequence, self._ext)
+        file_ptr = open(self.segment_name, mode='w', encoding='utf-8')
+        file_ptr.write(self.header)
+        file_ptr.flush()
+        self._segment_bytes = len(self.header.encode('utf-8'))
+        self._segment_start = monotonic()
+        LOGGER.debug('Opened log segment: %s', self.segment_name)
+        return file_ptr
+
+    def write(self, rows: Iterable[Iterable[object]], time_str: Optional[str] = None) -> None:
+        """ Buffer one row per item in rows, each prefixed by the common time string.
+
+        :param rows: Iterable of iterables of values in column order.
+        :param time_str: Time string for the rows, defaults to local time now.
+        """
+        if time_str is None:
+            time_str = datetime.now().astimezone().strftime(self.TIME_FORMAT).strip()
+        for row in rows:
+            line = '{}|{}\n'.format(time_str, '|'.join([str(value) for value in row]))
+            self._buffer.append(line)
+            self._segment_bytes += len(line.encode('utf-8'))
+        now = monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self.flush()
+        if (self.max_bytes and self._segment_bytes >= self.max_bytes) or \
+                (self.rotate_interval and now - self._segment_start >= self.rotate_interval):
+            self.rotate()
+
+    def write_ups_list(self, ups_list: Iterable, time_str: Optional[str] = None) -> None:
+        """ Buffer one row for each UPS in the list.
+
+        :param ups_list: Iterable of UpsItem objects.
+        :param time_str: Time string for the rows, defaults to local time now.
+        """
+        columns = self.columns
+        self.write(([ups[column] for column in columns] for ups in ups_list), time_str)
+
+    def flush(self) -> None:
+        """ Write all buffered rows to the current segment.
+        """
+        if self._buffer:
+            self._file.write(''.join(self._buffer))
+            self._buffer.clear()
+        self._file.flush()
+        self._last_flush = monotonic()
+
+    def rotate(self) -> None:
+        """ Close the current segment and start a new one.
+        """
+        self.flush()
+        self._file.close()
+        self._close_segment(self.segment_name)
+        self._sequence += 1
+        self._file = self._open_segment()
+
+    def _close_segment(self, segment_name: str) -> None:
+        """ Compress the closed segment in the background and enforce segment retention.
+
+        :param segment_name: Name of the closed segment.
+        """
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        if self.compress != 'none':
+            compressed_name = segment_name + self._extensions[self.compress]
+            thread = threading.Thread(target=self._compress_file, daemon=True,
+                                      args=[segment_name, compressed_name, self._opener()])
+            thread.start()
+            self._threads.append(thread)
+            segment_name = compressed_name
+        self._closed_segments.append(segment_name)
+        if self.keep:
+            while len(self._closed_segments) > self.keep:
+                old_segment = self._closed_segments.pop(0)
+                for thread in self._threads:
+                    thread.join()
+                try:
+                    os.remove(old_segment)
+                    LOGGER.debug('Removed log segment: %s', old_segment)
+                except FileNotFoundError:
+                    pass
+
+    def _opener(self) -> Callable:
+        """ Get the open function for the selected compression.
+        """
+        return zstd.open if self.compress == 'zstd' else gzip.open
+
+    @staticmethod
+    def _compress_file(source: str, target: str, opener: Callable) -> None:
+        """ Compress source into target and remove the source.
+
+        :param source: Name of the file to compress.
+        :param target: Name of the compressed file.
+        :param opener: Function used to open the compressed file for writing.
+        """
+        try:
+            with open(source, 'rb') as src_file, opener(target, 'wb') as tgt_file:
+                shutil.copyfileobj(src_file, tgt_file, 1024 * 1024)
+            os.remove(source)
+        except OSError as error:
+            LOGGER.debug('Error compressing log segment %s: %s', source, error)
+
+    def close(self) -> None:
+        """ Flush buffered rows, close the current segment and wait for compression to complete.
+        """
+        if self._file.closed: return
+        self.flush()
+        self._file.close()
+        for thread in self._threads:
+            thread.join()
+
+    @staticmethod
+    def segments(file_name: str) -> List[str]:
+        """ Get the names of all segments, plain or compressed, for the given log file in order.
+
+        :param file_name: Name of the first segment.
+        :return: List of segment file names.
+        """
+        base, ext = os.path.splitext(file_name)
+        pattern = re.compile(r'^{}(\.(\d{{3,}}))?{}(\.gz|\.zst)?$'.format(re.escape(base), re.escape(ext)))
+        found = []
+        for name in glob.glob('{}*'.format(glob.escape(base))):
+            match = pattern.match(name)
+            if match:
+                found.append((int(match.group(2) or 0), name))
+        return [name for _, name in sorted(found)]
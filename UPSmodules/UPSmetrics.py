@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+""" UPSmetrics  -  Prometheus and OpenMetrics exporter for the poller service
+
+    The exposition text for all UPSs is rendered once after each poll by the
+    service and the same bytes are returned to every scrape until the next
+    poll, so scrapes never cause snmp traffic.  Both the Prometheus text format
+    and, when requested by the Accept header, the OpenMetrics text format are
+    served at /metrics.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import socket
+import logging
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Tuple, Optional, Iterable, Any
+from UPSmodules.UPSKeys import MiB
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Numeric MiBs exported as gauges: metric name, scale to base unit, help text
+GAUGE_MIBS: Dict[MiB, Tuple[str, float, str]] = {
+    MiB.ups_env_temp: ('ups_environment_temperature_celsius', 1.0, 'UPS environment temperature'),
+    MiB.battery_capacity: ('ups_battery_capacity_percent', 1.0, 'Percentage of total battery capacity'),
+    MiB.time_on_battery: ('ups_time_on_battery_seconds', 60.0, 'Time on battery'),
+    MiB.battery_runtime_remain: ('ups_battery_runtime_remaining_seconds', 60.0, 'Battery runtime remaining'),
+    MiB.input_voltage: ('ups_input_voltage_volts', 1.0, 'Input voltage'),
+    MiB.input_frequency: ('ups_input_frequency_hertz', 1.0, 'Input frequency'),
+    MiB.output_voltage: ('ups_output_voltage_volts', 1.0, 'Output voltage'),
+    MiB.output_frequency: ('ups_output_frequency_hertz', 1.0, 'Output frequency'),
+    MiB.output_load: ('ups_output_load_percent', 1.0, 'Output load as percentage of capacity'),
+    MiB.output_current: ('ups_output_current_amperes', 1.0, 'Output current'),
+    MiB.output_power: ('ups_output_power_watts', 1.0, 'Output power')}
+
+# Per-phase table columns exported as gauges with a phase label: metric name, help text
+PHASE_GAUGES: Dict[Tuple[MiB, str], Tuple[str, str]] = {
+    (MiB.input_phases, 'voltage'): ('ups_input_phase_voltage_volts', 'Input voltage of each phase'),
+    (MiB.input_phases, 'frequency'): ('ups_input_phase_frequency_hertz', 'Input frequency of each phase'),
+    (MiB.input_phases, 'current'): ('ups_input_phase_current_amperes', 'Input current of each phase'),
+    (MiB.input_phases, 'power'): ('ups_input_phase_power_watts', 'Input power of each phase'),
+    (MiB.output_phases, 'voltage'): ('ups_output_phase_voltage_volts', 'Output voltage of each phase'),
+    (MiB.output_phases, 'frequency'): ('ups_output_phase_frequency_hertz', 'Output frequency of each phase'),
+    (MiB.output_phases, 'current'): ('ups_output_phase_current_amperes', 'Output current of each phase'),
+    (MiB.output_phases, 'power'): ('ups_output_phase_power_watts', 'Output power of each phase'),
+    (MiB.output_phases, 'load'): ('ups_output_phase_load_percent', 'Output load of each phase as percentage of capacity')}
+
+# String MiBs exported as state sets with one series per reported state
+STATE_MIBS: Dict[MiB, Tuple[str, str]] = {
+    MiB.system_status: ('ups_system_status', 'UPS system status flags'),
+    MiB.battery_status: ('ups_battery_status', 'Battery status')}
+
+FLAG_NAMES: Tuple[str, ...] = ('valid', 'compatible', 'accessible', 'responsive', 'daemon')
+
+
+def escape_label(value: Any) -> str:
+    """ Escape a label value for the text exposition formats.
+
+    :param value: Label value.
+    :return: Escaped string.
+    """
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class MetricFamily:
+    """ A metric family with its samples, serialized in either text format.
+    """
+    def __init__(self, name: str, metric_type: str, help_text: str):
+        self.name: str = name
+        self.metric_type: str = metric_type
+        self.help_text: str = help_text
+        self.samples: List[Tuple[str, str, float]] = []
+
+    def add(self, labels: Dict[str, Any], value: float, suffix: str = '') -> None:
+        """ Add a sample.
+
+        :param labels: Label names and values.
+        :param value: Sample value.
+        :param suffix: Sample name suffix, such as _total, _sum, or _count.
+        """
+        label_str = ','.join('{}="{}"'.format(key, escape_label(val)) for key, val in labels.items())
+        self.samples.append((suffix, '{{{}}}'.format(label_str) if label_str else '', value))
+
+    def render(self, openmetrics: bool = False) -> str:
+        """ Serialize the family.
+
+        :param openmetrics: Use OpenMetrics conventions if True, else Prometheus text format.
+        :return: Text lines of the family.
+        """
+        name = self.name
+        if self.metric_type == 'counter' and not openmetrics:
+            name = self.name + '_total'
+        lines = ['# HELP {} {}'.format(name, self.help_text), '# TYPE {} {}'.format(name, self.metric_type)]
+        for suffix, labels, value in self.samples:
+            if self.metric_type == 'counter': suffix = '_total'
+            lines.append('{}{}{} {}'.format(self.name, suffix, labels, format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value: float) -> str:
+    """ Format a sample value.
+    """
+    if value != value: return 'NaN'
+    if isinstance(value, bool): return '1' if value else '0'
+    if float(value).is_integer(): return str(int(value))
+    return repr(float(value))
+
+
+def _to_float(value: Any) -> Optional[float]:
+    if value is None or isinstance(value, bool): return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def collect(upss: Iterable[Any], stats: Dict[str, float]) -> List[MetricFamily]:
+    """ Build all metric families from the latest values of the UPSs and poll statistics.
+
+    :param upss: Iterable of UpsItem objects.
+    :param stats: Poll statistics of the service.
+    :return: List of metric families.
+    """
+    info = MetricFamily('ups_info', 'gauge', 'UPS identification, always 1')
+    flags = MetricFamily('ups_flag', 'gauge', 'UPS status flag, 1 if set')
+    gauges = {mib: MetricFamily(name, 'gauge', help_text) for mib, (name, _, help_text) in GAUGE_MIBS.items()}
+    states = {mib: MetricFamily(name, 'gauge', help_text) for mib, (name, help_text) in STATE_MIBS.items()}
+    phases = {key: MetricFamily(name, 'gauge', help_text) for key, (name, help_text) in PHASE_GAUGES.items()}
+    read_seconds = MetricFamily('ups_read_duration_seconds', 'gauge', 'Duration of the latest read of the UPS')
+    read_errors = MetricFamily('ups_read_errors', 'counter', 'Invalid responses from the UPS')
+    srtt = MetricFamily('ups_snmp_srtt_seconds', 'gauge', 'Smoothed round trip time of snmp requests on each path')
+    rto = MetricFamily('ups_snmp_timeout_seconds', 'gauge', 'Adaptive timeout of snmp requests on each path')
+    path_up = MetricFamily('ups_path_up', 'gauge', 'Path to the UPS management address responding, 1 if closed')
+    hedged = MetricFamily('ups_path_hedged_requests', 'counter', 'Requests also sent on the path after a slow reply')
+    wins = MetricFamily('ups_path_answered_requests', 'counter', 'Requests answered first on the path')
+    for ups in upss:
+        prm = ups.prm
+        ups_label = {'ups': prm.display_name}
+        ups_type = prm.get('ups_type')
+        info.add({**ups_label, 'ip': prm.get('ups_IP'), 'type': getattr(ups_type, 'name', ups_type),
+                  'model': prm.get(MiB.ups_model) or '', 'nmc_model': prm.get('ups_nmc_model') or ''}, 1)
+        for flag in FLAG_NAMES:
+            flags.add({**ups_label, 'flag': flag}, bool(prm.get(flag)))
+        read_seconds.add(ups_label, getattr(ups, 'read_seconds', 0.0))
+        read_errors.add(ups_label, getattr(ups, 'read_errors', 0))
+        for path in getattr(ups, 'paths', ()):
+            path_label = {**ups_label, 'address': path.address}
+            path_up.add(path_label, path.breaker.is_closed())
+            hedged.add(path_label, path.hedged)
+            wins.add(path_label, path.wins)
+            if path.rto.srtt is not None:
+                srtt.add(path_label, path.rto.srtt)
+                rto.add(path_label, path.rto.rto)
+        if not prm.get('responsive'): continue
+        for mib, family in gauges.items():
+            value = _to_float(prm.get(mib))
+            if value is not None:
+                family.add(ups_label, value * GAUGE_MIBS[mib][1])
+        for mib in (MiB.input_phases, MiB.output_phases):
+            table = prm.get(mib)
+            if not isinstance(table, dict): continue
+            for phase, values in sorted(table.items(), key=lambda item: int(item[0])):
+                for column, value in values.items():
+                    value = _to_float(value)
+                    if value is not None and (mib, column) in phases:
+                        phases[(mib, column)].add({**ups_label, 'phase': phase}, value)
+        for mib, family in states.items():
+            value = prm.get(mib)
+            if value in {None, '', '---', 'No data', 'Invalid UPS'}: continue
+            for state in (str(value).split('-') if mib == MiB.system_status else (str(value),)):
+                family.add({**ups_label, 'state': state}, 1)
+
+    polls = MetricFamily('ups_service_polls', 'counter', 'Poll cycles completed by the service')
+    polls.add({}, stats.get('polls', 0))
+    poll_errors = MetricFamily('ups_service_poll_errors', 'counter', 'Poll cycles which failed')
+    poll_errors.add({}, stats.get('poll_errors', 0))
+    duration = MetricFamily('ups_service_poll_duration_seconds', 'gauge', 'Duration of the latest poll cycle')
+    duration.add({}, stats.get('poll_seconds', 0.0))
+    last_poll = MetricFamily('ups_service_last_poll_timestamp_seconds', 'gauge', 'Time of the latest poll cycle')
+    last_poll.add({}, stats.get('poll_time', 0.0))
+    return [info, flags, *gauges.values(), *phases.values(), *states.values(), read_seconds, read_errors, srtt, rto, path_up, hedged, wins,
+            polls, poll_errors, duration, last_poll]
+
+
+def render(families: Iterable[MetricFamily]) -> Tuple[bytes, bytes]:
+    """ Serialize metric families in both text formats.
+
+    :param families: Metric families.
+    :return: Tuple of Prometheus and OpenMetrics exposition bytes.
+    """
+    families = list(families)
+    prometheus = ''.join(family.render() for family in families)
+    openmetrics = ''.join(family.render(openmetrics=True) for family in families) + '# EOF\n'
+    return prometheus.encode('utf-8'), openmetrics.encode('utf-8')
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    """ Serve the pre-rendered exposition text.
+    """
+    server: '_MetricsServer'
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """ Respond to GET requests.
+        """
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            prometheus, openmetrics = self.server.exporter.exposition
+            if 'application/openmetrics-text' in self.headers.get('Accept', ''):
+                body, content_type = openmetrics, OPENMETRICS_TYPE
+            else:
+                body, content_type = prometheus, PROMETHEUS_TYPE
+            self.send_response(200)
+        elif path == '/':
+            body = b'<html><body><a href="/metrics">ups-utils metrics</a></body></html>\n'
+            content_type = 'text/html; charset=utf-8'
+            self.send_response(200)
+        else:
+            body, content_type = b'Not Found\n', 'text/plain; charset=utf-8'
+            self.send_response(404)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+        LOGGER.debug('metrics %s - %s', self.address_string(), format % args)
+
+
+class _MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], exporter: 'MetricsExporter'):
+        self.exporter = exporter
+        # The socket family follows the host, so IPv6 addresses such as [::1] can be bound.
+        self.address_family = socket.getaddrinfo(address[0], address[1], type=socket.SOCK_STREAM,
+                                                 flags=socket.AI_PASSIVE)[0][0]
+        super().__init__(address, _MetricsHandler)
+
+
+class MetricsExporter:
+    """ HTTP server of the metrics exposition text, updated by the poller service after each poll.
+    """
+    def __init__(self, address: str = '127.0.0.1:9163'):
+        """
+        :param address: Listen address as [HOST:]PORT.  The default host is localhost.
+        """
+        host, _, port = address.rpartition(':')
+        self.address: Tuple[str, int] = (host.strip('[]') or '127.0.0.1', int(port))
+        self.exposition: Tuple[bytes, bytes] = render([])
+        self._server: Optional[_MetricsServer] = None
+
+    def __repr__(self) -> str:
+        host, port = self.address
+        return 'MetricsExporter: http://{}:{}/metrics'.format('[{}]'.format(host) if ':' in host else host, port)
+
+    def update(self, upss: Iterable[Any], stats: Dict[str, float]) -> None:
+        """ Render the exposition text for the latest values.
+
+        :param upss: Iterable of UpsItem objects.
+        :param stats: Poll statistics of the service.
+        """
+        self.exposition = render(collect(upss, stats))
+
+    def start(self) -> None:
+        """ Start serving in a background thread.
+
+        :raises OSError: If the address can not be bound.
+        """
+        self._server = _MetricsServer(self.address, self)
+        self.address = self._server.server_address[:2]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        LOGGER.debug('Started %s', self)
+
+    def stop(self) -> None:
+        """ Stop serving.
+        """
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
@@ -34,17 +34,34 @@ import sys
 import re
 import shlex
 import shutil
-from time import sleep
+from time import sleep, time, monotonic
 from datetime import datetime
 import json
 import subprocess
+import threading
 import logging
-import pprint
-import configparser
-from typing import Tuple, List, Union, Dict, Generator, Set, Optional
+from typing import Tuple, List, Union, Dict, Generator, Set, Optional, Any, TYPE_CHECKING
 from uuid import uuid4
-from UPSmodules.env import UT_CONST
+from UPSmodules.env import UT_CONST, check_file
 from UPSmodules.UPSKeys import UpsType, UpsStatus, MibGroup, TxtStyle, MarkUpCodes, MiB
+from UPSmodules.UPShistory import UpsHistory
+from UPSmodules.UPSstore import TimeSeriesStore
+from UPSmodules.UPSservice import ServiceClient, SERVICE_LIST_KEYS
+from UPSmodules.UPSevents import EventCorrelator, EVENT_KINDS, SITE_OUTAGE_ACTIONS
+from UPSmodules.UPSbreaker import CircuitBreaker, BreakerState
+from UPSmodules.UPSpath import NmcPath, address_list, hedged_request
+from UPSmodules.UPSdns import DNS_CACHE
+from UPSmodules.UPSrate import token_bucket
+from UPSmodules.UPSwatch import FileWatcher
+from UPSmodules.UPSsnmpv3 import UsmCredentials, discover_engine
+from UPSmodules.UPSprofiles import ProfileMap, PROFILES, TypeCache, AUTO_TYPE, SYS_DESCR_OID, SYS_OBJECT_ID_OID, \
+    UPS_MIB_PROBE_OID, match_vendor, numeric_oid
+if TYPE_CHECKING:
+    # Daemon only modules, imported when their config sections are read.  The BOINC RPC and
+    # shutdown modules import asyncio, which is not needed by ups-ls and ups-mon.
+    from UPSmodules.UPSboinc import BoincHosts
+    from UPSmodules.UPSshutdown import ShutdownPlan, TargetResult
+    from UPSmodules.UPSshed import LoadShedder
 
 
 LOGGER = logging.getLogger('ups-utils')
@@ -73,7 +90,9 @@ class ObjDict(dict):
 class UpsItem:
     """ Object to represent a UPS """
     _json_keys: Set[str] = {'ups_IP', 'display_name', 'ups_type', 'daemon',
-                            'snmp_community', 'uuid', 'ups_model', 'ups_nmc_model'}
+                            'snmp_community', 'uuid', 'ups_model', 'ups_nmc_model', 'feed',
+                            'snmp_rate', 'snmp_burst', 'snmp_version', 'snmp_user', 'snmp_auth_protocol',
+                            'snmp_auth_password', 'snmp_priv_protocol', 'snmp_priv_password'}
 
     param_labels: Dict[Union[str, MiB], str] = {
         'display_name': 'UPS Name',
@@ -87,6 +106,7 @@ class UpsItem:
         'accessible': 'Accessible',
         'responsive': 'Responsive',
         'daemon': 'Daemon',
+        'comm_state': 'Comm Breaker',
         'sep2':                '#',
         MiB.ups_name: 'UPS Real Name',
         MiB.ups_info: 'General UPS Information',
@@ -114,30 +134,44 @@ class UpsItem:
         'sep5':                '#',
         MiB.input_voltage: 'Input Voltage (V)',
         MiB.input_frequency: 'Input Frequency (Hz)',
+        MiB.input_phases: 'Input Phases',
         'sep6':                '#',
         MiB.output_voltage: 'Output Voltage (V)',
         MiB.output_frequency: 'Output Frequency (Hz)',
         MiB.output_load: 'Output Load as % of Capacity',
         MiB.output_power: 'Output Power (W)',
-        MiB.output_current: 'Output Current (A)'}
+        MiB.output_current: 'Output Current (A)',
+        MiB.output_phases: 'Output Phases'}
 
     ordered_table_items: Tuple[Union[str, MiB], ...] = (
         'display_name', MiB.ups_name, 'ups_IP', MiB.ups_model, 'ups_type', 'ups_nmc_model', MiB.ups_location,
-        'daemon', MiB.ups_env_temp, MiB.input_voltage, MiB.input_frequency, MiB.output_voltage,
+        'daemon', 'comm_state', MiB.ups_env_temp, MiB.input_voltage, MiB.input_frequency, MiB.output_voltage,
         MiB.output_frequency, MiB.output_current, MiB.output_power, MiB.output_load,
         MiB.battery_capacity, MiB.time_on_battery, MiB.battery_runtime_remain, MiB.system_status,
         MiB.battery_status)
     _short_list: Set[Union[str, MiB]] = {'ups_IP', 'display_name', MiB.ups_model, 'responsive', 'daemon'}
-    table_list: Set[Union[str, MiB]] = {'display_name', 'ups_IP', 'ups_type', MiB.ups_model, 'ups_nmc_model', 'daemon'}
+    table_list: Set[Union[str, MiB]] = {'display_name', 'ups_IP', 'ups_type', MiB.ups_model, 'ups_nmc_model', 'daemon',
+                                        'comm_state'}
     mark_up_codes = UT_CONST.mark_up_codes
 
-    def __init__(self, json_details: dict):
+    def __init__(self, json_details: dict, history_capacity: int = UpsHistory.default_capacity,
+                 service: Optional[ServiceClient] = None):
         """ Initialize a UPS object
 
         :param json_details: A dictionary containing configuration details from json file.
+        :param history_capacity: Number of samples of each metric to keep in history.
+        :param service: Read values from this poller service client instead of the UPS.
         """
         # UPS list from ups-config.json for monitor and ls utils.
         self.skip_list: List[Union[str, MiB]] = []
+        # Definition from ups-config.json, compared on reload to find the UPSs which changed.
+        self.definition: Dict[str, Any] = {key: value for key, value in json_details.items() if key != 'uuid'}
+        # The type is detected, as ups_type is auto or omitted in ups-config.json.
+        self.auto_type: bool = True
+        self.history: UpsHistory = UpsHistory(history_capacity)
+        # Poll statistics: duration of the latest read and count of invalid responses
+        self.read_seconds: float = 0.0
+        self.read_errors: int = 0
         self.prm: ObjDict = ObjDict({
             'uuid': None,
             'ups_IP': None,
@@ -146,6 +180,16 @@ class UpsItem:
             'ups_model': None,
             'ups_nmc_model': None,
             'snmp_community': None,
+            'feed': None,
+            'snmp_rate': None,
+            'snmp_burst': None,
+            'snmp_version': None,
+            'snmp_user': None,
+            'snmp_auth_protocol': None,
+            'snmp_auth_password': None,
+            'snmp_priv_protocol': None,
+            'snmp_priv_password': None,
+            'comm_state': BreakerState.closed.name,
             UpsStatus.daemon.name: False,
             UpsStatus.valid.name: False,
             UpsStatus.compatible.name: False,
@@ -155,12 +199,15 @@ class UpsItem:
             self.prm.update({cmd: None})
 
         self.initialize_cls_table_list()
-        # Load initial data from json dict.
+        # Load initial data from json dict.  The service also provides the status of the UPS.
+        valid_keys = self._json_keys.union(SERVICE_LIST_KEYS) if service else self._json_keys
         for item_name, item_value in json_details.items():
-            if item_name not in self._json_keys:
+            if item_name not in valid_keys:
                 LOGGER.debug('%s: Invalid key [%s] ignored', UT_CONST.ups_json_file, item_name)
                 continue
             if item_name == 'ups_type':
+                if item_value in {AUTO_TYPE, None, ''}: continue
+                self.auto_type = False
                 if re.search(UT_CONST.PATTERNS['APC96'], item_value): item_value = 'apc_ap96xx'
                 if item_value in UpsType.list():
                     self.prm['valid'] = True
@@ -178,26 +225,56 @@ class UpsItem:
         if self.prm['ups_type'] in UpsType.list():
             self.prm['compatible'] = True
 
-        # Check accessibility
-        self.ups_comm: UpsComm = UpsComm(self)
-        if self.ups_comm.is_valid_ip_fqdn(self.prm['ups_IP']):
-            self.prm['valid'] = self.prm['valid'] and True
-        if self.ups_comm.check_ip_access(self.prm['ups_IP']):
-            self.prm['accessible'] = True
-        if self.ups_comm.check_snmp_response(self):
-            self.prm['responsive'] = True
-
-        mib_cmd_group = UpsType.apc_ap96xx \
-            if re.search(UT_CONST.PATTERNS['APC'], self.prm['ups_type'].name) \
-            else UpsType.eaton_pw
-        self.prm['mib_commands'] = self.ups_comm.all_mib_cmds[mib_cmd_group]
+        # Check accessibility.  Each management address of the UPS is a separate path.
+        addresses = address_list(self.prm['ups_IP'])
+        try:
+            token_bucket(self.prm['snmp_rate'], self.prm['snmp_burst'])
+        except (TypeError, ValueError) as error:
+            UT_CONST.process_message('Invalid snmp_rate or snmp_burst for {} in [{}], using defaults: {}'.format(
+                self.prm['display_name'], UT_CONST.ups_json_file, error), verbose=True)
+            self.prm['snmp_rate'] = self.prm['snmp_burst'] = None
+        try:
+            self.usm: Optional[UsmCredentials] = UsmCredentials.from_prm(self.prm)
+        except ValueError as error:
+            UT_CONST.process_message('Invalid SNMPv3 parameters for {} in [{}]: {}'.format(
+                self.prm['display_name'], UT_CONST.ups_json_file, error), verbose=True)
+            self.usm = None
+            self.prm['valid'] = False
+        # Each management card has its own rate limit.
+        self.paths: List[NmcPath] = [NmcPath(address, self.prm['display_name'],
+                                             token_bucket(self.prm['snmp_rate'], self.prm['snmp_burst']))
+                                     for address in addresses]
+        if addresses:
+            self.prm['ups_IP'] = ', '.join(addresses)
+        if service:
+            self.ups_comm: Union[UpsComm, ServiceComm] = ServiceComm(self, service)
+        else:
+            self.ups_comm: Union[UpsComm, ServiceComm] = UpsComm(self)
+            if addresses and all(self.ups_comm.is_valid_ip_fqdn(address) for address in addresses):
+                self.prm['valid'] = self.prm['valid'] and True
+            # Ping the resolved address, as the snmp agent argument has a transport prefix.
+            if any(self.ups_comm.check_ip_access(DNS_CACHE.resolve(path.address)) for path in self.paths):
+                self.prm['accessible'] = True
+            if self.ups_comm.check_snmp_response(self):
+                self.prm['responsive'] = True
+            if self.prm['ups_type'] is None:
+                self.ups_comm.set_ups_type(self, self.ups_comm.detect_ups_type(self) if self.prm['responsive']
+                                           else self.ups_comm.type_cache.get(self.prm['ups_IP']) or UpsType.none)
+        self.breaker: CircuitBreaker = CircuitBreaker(self.prm['display_name'])
+        if not service and not self.prm['responsive']:
+            # Probe with backoff, so the UPS is read again once it recovers.
+            self.breaker.trip()
+            self.prm['comm_state'] = self.breaker.state.name
+
+        self.prm['mib_commands'] = self.ups_comm.mib_commands
+        self.prm['mib_tables'] = self.ups_comm.mib_tables
         self.daemon = None
 
     @classmethod
     def initialize_cls_table_list(cls) -> None:
-        """ Initialize the class data table_list.
+        """ Initialize the class data table_list.  Per-phase tables are too wide for the monitor table.
         """
-        cls.table_list = cls.table_list.union(UpsComm.all_mib_cmd_names[MibGroup.monitor])
+        cls.table_list = cls.table_list.union(UpsComm.all_mib_cmd_names[MibGroup.monitor]).difference(UpsComm.table_mibs)
 
     def __getitem__(self, param_name: str) -> any:
         try:
@@ -212,6 +289,7 @@ class UpsItem:
         return '{} - {} - {}'.format(self['uuid'], self['display_name'], self['ups_IP'])
 
     def __str__(self) -> str:
+        import pprint
         return re.sub(r'\'', '\"', pprint.pformat(self.prm, indent=2, width=120))
 
     def mib_command_names(self, cmd_group: Optional[MibGroup] = None) -> Generator[str, None, None]:
@@ -222,15 +300,18 @@ class UpsItem:
         """
         if not cmd_group:
             cmd_group = MibGroup.all
-        if cmd_group == MibGroup.all:
-            if self.prm.ups_type == UpsType.apc_ap96xx:
-                cmd_group = MibGroup.all_apc
-            else:
-                cmd_group = MibGroup.all_eaton
         for cmd_name in self.ups_comm.mib_commands:
             if cmd_name in UpsComm.all_mib_cmd_names[cmd_group]:
                 yield cmd_name
 
+    def rate_delay(self, requests: int) -> float:
+        """ Get the time the rate limit of the primary management card needs to send the given requests.
+
+        :param requests: Number of requests.
+        :return: Time in seconds.
+        """
+        return self.paths[0].bucket.delay(requests) if self.paths else 0.0
+
     def get_ups_parameter_value(self, param_name: str) -> Optional[str]:
         """ Get ups parameter value for parameter name from target UPS or active UPS if not specified
 
@@ -284,8 +365,13 @@ class UpsItem:
         return self.ups_comm.send_snmp_command(cmd_mib, self, display)
 
     def read_ups_list_items(self, cmd_group: MibGroup, display: bool = False) -> bool:
-        """ Read data for a group of commands from UpsComm object """
-        return self.ups_comm.read_ups_list_items(cmd_group, self, display=display)
+        """ Read data for a group of commands from UpsComm object and record dynamic values in history """
+        start_time = monotonic()
+        result = self.ups_comm.read_ups_list_items(cmd_group, self, display=display)
+        self.read_seconds = monotonic() - start_time
+        if cmd_group in (MibGroup.dynamic, MibGroup.monitor, MibGroup.all):
+            self.history.append(self.prm)
+        return result
 
     def print_snmp_commands(self) -> None:
         """ Print all mib command details for this UPS """
@@ -321,6 +407,8 @@ class UpsItem:
             if not UT_CONST.no_markup: color_code = self.mark_up_codes[MarkUpCodes.data]
             if param_name == MiB.ups_info:
                 text = UT_CONST.wrap(self.prm[param_name], indent=len(param_label)+len(pre)+1)
+            elif param_name in UpsComm.table_mibs:
+                text = UpsComm.phase_text(self.prm[param_name])
             else:
                 text = self.prm[param_name]
             print('{}{}: {}{}{}'.format(pre, param_label, color_code, text, color_reset))
@@ -332,19 +420,26 @@ class UpsDaemon:
     # Configuration details
     _daemon_paths: Tuple[str, ...] = ('boinc_home', 'ups_utils_script_path')
     _daemon_scripts: Tuple[str, ...] = ('suspend_script', 'resume_script', 'shutdown_script', 'cancel_shutdown_script')
-    _daemon_param_names: Tuple[str, ...] = ('read_interval', 'threshold_env_temp', 'threshold_battery_time_rem',
-                                            'threshold_time_on_battery', 'threshold_battery_load',
-                                            'threshold_battery_capacity')
+    _daemon_param_names: Tuple[str, ...] = ('read_interval', 'history', 'runtime_prediction', 'threshold_env_temp',
+                                            'threshold_battery_time_rem', 'threshold_time_on_battery',
+                                            'threshold_battery_load', 'threshold_battery_capacity')
     daemon_items_dict: Dict[str, tuple] = {
         'DaemonPaths': _daemon_paths,
         'DaemonScripts': _daemon_scripts,
         'DaemonParameters': _daemon_param_names}
     config_name_list: List[str] = ['DaemonPaths', 'DaemonScripts', 'DaemonParameters']
+    # Optional section, BOINC actions of scripts replaced by GUI RPC to the listed hosts.
+    _boinc_rpc_items: Tuple[str, ...] = ('hosts', 'password_file')
+    _fleet_event_items: Tuple[str, ...] = ('window', 'min_upss', 'timeout', 'site_outage') + EVENT_KINDS
+    _boinc_script_actions: Dict[str, str] = {'suspend_script': 'suspend', 'resume_script': 'resume',
+                                             'shutdown_script': 'quit'}
 
     daemon_param_defaults: Dict[str, Union[str, Dict[str, int]]] = {
         'ups_utils_script_path': os.path.expanduser('~/.local/bin/'),
         # Low limit
         'read_interval': {'monitor': 10, 'daemon': 30, 'limit': 10, 'limit_type': 'low'},
+        'history': {'hours': 24, 'interval': 10, 'limit': 0, 'limit_type': 'low'},
+        'runtime_prediction': {'time_constant': 120, 'sigma': 2, 'limit': 0, 'limit_type': 'low'},
         'threshold_battery_time_rem': {'crit': 5, 'warn': 10, 'limit': 4, 'limit_type': 'low'},
         'threshold_battery_capacity': {'crit': 10, 'warn': 50, 'limit': 5, 'limit_type': 'low'},
         # High limit
@@ -352,12 +447,12 @@ class UpsDaemon:
         'threshold_battery_load': {'crit': 90, 'warn': 80, 'limit': 95, 'limit_type': 'high'},
         'threshold_time_on_battery': {'crit': 5, 'warn': 3, 'limit': 90, 'limit_type': 'high'},
     }
-    daemon_param_dict: Dict[str, str] = {
-        'mib_ups_env_temp': 'threshold_env_temp',
-        'mib_time_on_battery': 'threshold_time_on_battery',
-        'mib_battery_runtime_remain': 'threshold_battery_time_rem',
-        'mib_output_load': 'threshold_battery_load',
-        'mib_battery_capacity': 'threshold_battery_capacity'}
+    daemon_param_dict: Dict[MiB, str] = {
+        MiB.ups_env_temp: 'threshold_env_temp',
+        MiB.time_on_battery: 'threshold_time_on_battery',
+        MiB.battery_runtime_remain: 'threshold_battery_time_rem',
+        MiB.output_load: 'threshold_battery_load',
+        MiB.battery_capacity: 'threshold_battery_capacity'}
 
     # Set params to defaults
     daemon_params: Dict[str, Union[str, dict, None]] = {
@@ -365,24 +460,38 @@ class UpsDaemon:
         'suspend_script': None, 'resume_script': None,
         'shutdown_script': None, 'cancel_shutdown_script': None,
         'read_interval': daemon_param_defaults['read_interval'].copy(),
+        'history': daemon_param_defaults['history'].copy(),
+        'runtime_prediction': daemon_param_defaults['runtime_prediction'].copy(),
         'threshold_env_temp': daemon_param_defaults['threshold_env_temp'].copy(),
         'threshold_battery_time_rem': daemon_param_defaults['threshold_battery_time_rem'].copy(),
         'threshold_time_on_battery': daemon_param_defaults['threshold_time_on_battery'].copy(),
         'threshold_battery_load': daemon_param_defaults['threshold_battery_load'].copy(),
-        'threshold_battery_capacity': daemon_param_defaults['threshold_battery_capacity'].copy()}
+        'threshold_battery_capacity': daemon_param_defaults['threshold_battery_capacity'].copy(),
+        'boinc_rpc': {'hosts': [], 'password_file': None},
+        'shutdown_targets': [],
+        'shedding_tiers': [],
+        'fleet_events': {}}
 
     def __init__(self):
         self.config: Optional[dict] = None
         self.daemon_ups: Optional[UpsItem] = None
+        self.boinc_hosts: Optional['BoincHosts'] = None
+        self.shutdown_plan: Optional['ShutdownPlan'] = None
+        # The plan of the latest shutdown and the thread running it.
+        self._shutdown_run: Optional['ShutdownPlan'] = None
+        self._shutdown_thread: Optional[threading.Thread] = None
+        self.load_shedder: Optional['LoadShedder'] = None
+        self.event_correlator: Optional[EventCorrelator] = None
         self.daemon_params: Dict[str, Dict[str, Union[str, int]]]
 
         if self.read_daemon_config():
             self.set_daemon_parameters()
 
     def __str__(self) -> str:
+        import pprint
         return re.sub(r'\'', '\"', pprint.pformat(self.daemon_params, indent=2, width=120))
 
-    def daemon_format(self, command_name: str, value: Union[int, float, str],
+    def daemon_format(self, command_name: MiB, value: Union[int, float, str],
                       gui_text_style: bool = False) -> Union[str, TxtStyle, None]:
         """
 
@@ -423,6 +532,8 @@ class UpsDaemon:
             print('Error ups-utils.ini filename not set.')
             return False
 
+        # Only the daemon configuration needs configparser, so it is imported here.
+        import configparser
         self.config = configparser.ConfigParser()
         try:
             self.config.read(UT_CONST.ups_config_ini)
@@ -502,6 +613,12 @@ class UpsDaemon:
                         if c_item == 'read_interval':
                             self.daemon_params[c_item]['monitor'] = params[0]
                             self.daemon_params[c_item]['daemon'] = params[1]
+                        elif c_item == 'history':
+                            self.daemon_params[c_item]['hours'] = params[0]
+                            self.daemon_params[c_item]['interval'] = params[1]
+                        elif c_item == 'runtime_prediction':
+                            self.daemon_params[c_item]['time_constant'] = params[0]
+                            self.daemon_params[c_item]['sigma'] = params[1]
                         else:
                             self.daemon_params[c_item]['crit'] = params[0]
                             self.daemon_params[c_item]['warn'] = params[1]
@@ -523,6 +640,13 @@ class UpsDaemon:
 
         if self.daemon_params['boinc_home']:
             os.environ['BOINC_HOME'] = self.daemon_params['boinc_home']
+        if 'BoincRPC' in self.config:
+            read_status = self.set_boinc_rpc(self.config['BoincRPC']) and read_status
+        if 'ShutdownTargets' in self.config:
+            read_status = self.set_shutdown_plan(self.config['ShutdownTargets']) and read_status
+        read_status = self.set_load_shedder() and read_status
+        if 'FleetEvents' in self.config:
+            read_status = self.set_event_correlator(self.config['FleetEvents']) and read_status
 
         # Check Daemon Parameter Values
         for parameter_name in self._daemon_param_names:
@@ -534,6 +658,15 @@ class UpsDaemon:
                                                parameter_name, sub_parameter_name,
                                                self.daemon_params[parameter_name][sub_parameter_name]), verbose=True)
                         self.daemon_params[parameter_name] = self.daemon_param_defaults[parameter_name].copy()
+            elif parameter_name in ('history', 'runtime_prediction'):
+                sub_parameter_names = ('hours', 'interval') if parameter_name == 'history' else ('time_constant', 'sigma')
+                for sub_parameter_name in sub_parameter_names:
+                    if self.daemon_params[parameter_name][sub_parameter_name] < \
+                            self.daemon_params[parameter_name]['limit']:
+                        UT_CONST.process_message('Warning invalid {}-{} value [{}], using defaults'.format(
+                                               parameter_name, sub_parameter_name,
+                                               self.daemon_params[parameter_name][sub_parameter_name]), verbose=True)
+                        self.daemon_params[parameter_name] = self.daemon_param_defaults[parameter_name].copy()
             else:
                 reset = False
                 if self.daemon_param_defaults[parameter_name]['limit_type'] == 'high':
@@ -565,6 +698,198 @@ class UpsDaemon:
                           self.daemon_params[parameter_name]['limit']))
         return read_status
 
+    def set_boinc_rpc(self, config: Dict[str, str]) -> bool:
+        """ Set the BOINC GUI RPC hosts from the optional BoincRPC config section.  The password
+            file defaults to gui_rpc_auth.cfg in boinc_home.
+
+        :param config: The BoincRPC config section.
+        :return:  True on success
+        """
+        from UPSmodules.UPSboinc import BoincHosts, parse_host, read_password
+        for item_name in config:
+            if item_name not in self._boinc_rpc_items:
+                UT_CONST.process_message('Config [BoincRPC] invalid item [{}]'.format(item_name))
+        hosts = [host for host in re.split(r'[\s,]+', config.get('hosts', '')) if host]
+        password_file = os.path.expanduser(config.get('password_file', ''))
+        if not password_file and self.daemon_params['boinc_home']:
+            password_file = os.path.join(self.daemon_params['boinc_home'], 'gui_rpc_auth.cfg')
+            if not os.path.isfile(password_file): password_file = ''
+        if not hosts: return True
+        try:
+            password = read_password(password_file)
+            for host in hosts: parse_host(host)
+        except (OSError, ValueError) as error:
+            UT_CONST.process_message('Config [BoincRPC] error: {}, using scripts for BOINC actions'.format(error),
+                                     verbose=True)
+            return False
+        self.daemon_params['boinc_rpc'] = {'hosts': hosts, 'password_file': password_file or None}
+        self.boinc_hosts = BoincHosts(hosts, password)
+        return True
+
+    def set_shutdown_plan(self, config: Dict[str, str]) -> bool:
+        """ Set the shutdown waves of protected hosts from the optional ShutdownTargets config section.
+
+        :param config: The ShutdownTargets config section.
+        :return:  True on success
+        """
+        from UPSmodules.UPSshutdown import ShutdownPlan, parse_target
+        targets = []
+        for target_name, target_value in config.items():
+            try:
+                targets.append(parse_target(target_name, target_value))
+            except ValueError as error:
+                UT_CONST.process_message('Config [ShutdownTargets] item [{}] invalid value [{}]: {}'.format(
+                    target_name, target_value, error), verbose=True)
+                return False
+        self.daemon_params['shutdown_targets'] = targets
+        if targets:
+            self.shutdown_plan = ShutdownPlan(targets)
+        return True
+
+    def set_load_shedder(self) -> bool:
+        """ Set the load shedding tiers from the optional SheddingTier config sections.
+
+        :return:  True on success
+        """
+        from UPSmodules.UPSshed import LoadShedder, parse_tier, SECTION_PREFIX as SHED_SECTION_PREFIX
+        tiers = []
+        for section_name in self.config.sections():
+            if not section_name.startswith(SHED_SECTION_PREFIX): continue
+            try:
+                tiers.append(parse_tier(section_name, self.config[section_name]))
+            except (ValueError, KeyError) as error:
+                UT_CONST.process_message('Config [{}] invalid, tier not used: {}'.format(section_name, error),
+                                         verbose=True)
+                return False
+        self.daemon_params['shedding_tiers'] = tiers
+        if tiers:
+            self.load_shedder = LoadShedder(tiers)
+        return True
+
+    def set_event_correlator(self, config: Dict[str, str]) -> bool:
+        """ Set the fleet event correlator from the optional FleetEvents config section.
+
+        :param config: The FleetEvents config section.
+        :return:  True on success
+        """
+        from UPSmodules.UPSshutdown import parse_target
+        for item_name in config:
+            if item_name not in self._fleet_event_items:
+                UT_CONST.process_message('Config [FleetEvents] invalid item [{}]'.format(item_name))
+        try:
+            params = {'window': float(config.get('window', 30)), 'min_upss': int(config.get('min_upss', 2)),
+                      'timeout': float(config.get('timeout', 30))}
+            if params['window'] <= 0 or params['min_upss'] < 1 or params['timeout'] <= 0:
+                raise ValueError('window and timeout must be > 0 and min_upss >= 1')
+            params['site_outage'] = config.get('site_outage', 'suspend').strip().lower()
+            if params['site_outage'] not in SITE_OUTAGE_ACTIONS:
+                raise ValueError('site_outage must be one of {}'.format(', '.join(SITE_OUTAGE_ACTIONS)))
+            actions = {kind: config.get(kind, '').strip() for kind in EVENT_KINDS}
+            for kind, action in actions.items():
+                if action: parse_target(kind, '0, 1, {}'.format(action))
+        except ValueError as error:
+            UT_CONST.process_message('Config [FleetEvents] invalid: {}'.format(error), verbose=True)
+            return False
+        self.daemon_params['fleet_events'] = {**params, **actions}
+        self.event_correlator = EventCorrelator(params['window'], params['min_upss'], actions, params['timeout'])
+        return True
+
+    def site_outage_action(self, feed: Optional[str]) -> Optional[str]:
+        """ Get the daemon action for a site outage of the feed of the daemon UPS.
+
+        :param feed: Feed of the daemon UPS.
+        :return: suspend or shutdown if the feed is in a site outage, else None.
+        """
+        if not self.event_correlator or not self.event_correlator.site_outage(feed): return None
+        action = self.daemon_params['fleet_events'].get('site_outage')
+        return action if action in SITE_OUTAGE_ACTIONS[1:] else None
+
+    def adopt(self, previous: Optional['UpsDaemon']) -> None:
+        """ Keep the running state of the daemon replaced by this one when the configuration
+            is refreshed, so a shutdown in progress can still be cancelled.
+
+        :param previous: The daemon replaced by this one.
+        """
+        if not previous: return
+        if self.load_shedder:
+            self.load_shedder.adopt(previous.load_shedder)
+        self._shutdown_run = previous._shutdown_run
+        self._shutdown_thread = previous._shutdown_thread
+        if previous.event_correlator:
+            # The service listeners hold the first correlator, so it is kept with the new parameters.
+            if self.event_correlator:
+                correlator = self.event_correlator
+                previous.event_correlator.configure(correlator.window, correlator.min_upss, correlator.actions,
+                                                    correlator.timeout)
+                self.event_correlator = previous.event_correlator
+            else:
+                previous.event_correlator.configure(previous.event_correlator.window,
+                                                    previous.event_correlator.min_upss, {},
+                                                    previous.event_correlator.timeout)
+        elif self.event_correlator:
+            UT_CONST.process_message('[FleetEvents] added: restart ups-daemon to correlate fleet events',
+                                     verbose=True)
+
+    def shutdown_targets(self, plan: Optional['ShutdownPlan'] = None) -> int:
+        """ Shut down all protected hosts in waves and report the outcome of each target as
+            its wave completes.  Waves not started when the plan is cancelled are skipped.
+
+        :param plan: The plan to run, defaults to the configured plan.
+        :return: Number of targets which did not acknowledge.
+        """
+        plan = plan or self.shutdown_plan
+        if self.daemon_ups:
+            plan.ups_name = re.sub(r'\s+', '_', self.daemon_ups.prm.display_name)
+
+        def report(result: 'TargetResult') -> None:
+            message = 'Shutdown wave {} target {}: {} in {:.2f}s {}'.format(
+                result.wave, result.name, 'acknowledged' if result.acknowledged else 'FAILED',
+                result.seconds, result.message).strip()
+            if result.acknowledged:
+                print(message)
+                LOGGER.debug(message)
+            else:
+                UT_CONST.process_message(message, verbose=True)
+        return sum(1 for result in plan.run(report) if not result.acknowledged)
+
+    def start_shutdown(self) -> Tuple[int, str]:
+        """ Start the shutdown of protected hosts in a background thread, followed by the local
+            shutdown script, so the daemon keeps reading the UPS and can cancel the shutdown.
+
+        :return: Tuple of 0 and message.
+        """
+        if self._shutdown_thread and self._shutdown_thread.is_alive() and not self._shutdown_run.cancelled.is_set():
+            return 0, 'Shutdown already in progress'
+        # Each shutdown runs its own copy of the plan, so a cancelled one still completing its
+        # last wave neither delays this one nor runs the shutdown script.
+        plan = self._shutdown_run = self.shutdown_plan.new_run()
+
+        def run_shutdown() -> None:
+            self.shutdown_targets(plan)
+            if plan.cancelled.is_set():
+                UT_CONST.process_message('Shutdown cancelled, shutdown_script not executed', verbose=True)
+                return
+            self.run_script('shutdown_script')
+        self._shutdown_thread = threading.Thread(target=run_shutdown, name='ups-shutdown', daemon=True)
+        self._shutdown_thread.start()
+        return 0, 'Shutdown of {} protected hosts started'.format(len(self.shutdown_plan.targets))
+
+    def boinc_action(self, script_name: str) -> Tuple[int, str]:
+        """ Apply the BOINC action of a daemon script on all BOINC RPC hosts concurrently.
+
+        :param script_name: Name of the daemon script replaced by the action.
+        :return: Tuple of number of failed hosts and message.
+        """
+        action = self._boinc_script_actions[script_name]
+        status = self.boinc_hosts.run(action)
+        failed = [host for host, (success, _) in status.items() if not success]
+        message = '; '.join('{}: {}'.format(host, result) for host, (_, result) in status.items())
+        LOGGER.debug('BOINC %s: %s', action, message)
+        if failed:
+            UT_CONST.process_message('BOINC {} failed on {}: {}'.format(action, ', '.join(failed), message),
+                                     verbose=True)
+        return len(failed), message
+
     @classmethod
     def print_daemon_parameters(cls) -> None:
         """ Print all daemon parameters.
@@ -579,6 +904,15 @@ class UpsDaemon:
             print('    {}: {}{}{}'.format(param_name, color_code, param_value, reset_code))
         print('')
 
+    @classmethod
+    def history_capacity(cls) -> int:
+        """ Get the number of history samples to be kept for each UPS metric.
+
+        :return: Capacity of UPS history
+        """
+        history = cls.daemon_params['history']
+        return UpsHistory.capacity_for(history['hours'], history['interval'])
+
     def execute_script(self, script_name: str) -> Tuple[int, str]:
         """ Execute script defined in the daemon parameters
 
@@ -587,6 +921,23 @@ class UpsDaemon:
         """
         if script_name not in self._daemon_scripts:
             raise AttributeError('Error: {} no valid script name: [{}]'.format(script_name, self._daemon_scripts))
+        if self.boinc_hosts and script_name in self._boinc_script_actions:
+            # BOINC is suspended or resumed directly.  For shutdown, BOINC is quit before the script runs.
+            result = self.boinc_action(script_name)
+            if script_name != 'shutdown_script': return result
+        if self.shutdown_plan and script_name == 'shutdown_script':
+            # Protected hosts are shut down before the local shutdown script runs.
+            return self.start_shutdown()
+        if self._shutdown_run and script_name == 'cancel_shutdown_script':
+            self._shutdown_run.cancel()
+        return self.run_script(script_name)
+
+    def run_script(self, script_name: str) -> Tuple[int, str]:
+        """ Run the script of a daemon parameter and wait for it to complete.
+
+        :param: script_name: name of script to be executed
+        :return:  Tuple of return code and output
+        """
         if not self.daemon_params[script_name]:
             message = 'No {} defined'.format(script_name)
             UT_CONST.process_message('No {} defined'.format(script_name))
@@ -610,11 +961,38 @@ class UpsDaemon:
 
 class UpsList:
     """ Object to represent a list of UPSs """
-    def __init__(self, daemon: bool = True, empty: bool = False):
+    # Seconds between reads of battery health items along with dynamic items.
+    health_interval: int = 3600
+    # Maximum number of UPSs read concurrently.
+    max_read_workers: int = 32
+
+    def __init__(self, daemon: bool = True, empty: bool = False, service: Optional[str] = None):
+        """
+        :param daemon: Read the daemon configuration if True.
+        :param empty: Create an empty list if True.
+        :param service: Socket path of a poller service, empty for the default path.  If given, UPSs and
+            their values are read from the service instead of ups-config.json and the UPSs.
+        """
         self.update_time: datetime = UT_CONST.now()
+        self.health_time: float = 0.0
+        # Watcher of ups-config.json, if the UPS list is reloaded when the file changes.
+        self.config_watcher: Optional[FileWatcher] = None
+        # concurrent.futures.ThreadPoolExecutor, created on the first concurrent read and replaced
+        # by a larger one when the list grows.
+        self._executor: Optional[Any] = None
+        self._read_workers: int = 0
         self.list: Dict[str, UpsItem] = {}
         self.daemon: Optional[UpsDaemon] = UpsDaemon() if daemon else None
-        if not empty:
+        self.store: Optional[TimeSeriesStore] = None
+        self.service: Optional[ServiceClient] = ServiceClient(service or None) if service is not None else None
+        if self.service and not empty:
+            if not self.read_service_list():
+                UT_CONST.process_message('Fatal: Could not read UPS list from service [{}].'.format(
+                    self.service.socket_path), verbose=True)
+                sys.exit(-1)
+            if self.get_daemon_ups():
+                self.get_daemon_ups().daemon = self.daemon
+        elif not empty:
             if not self.read_ups_json():
                 UT_CONST.process_message('Fatal: Could not read [{}] file.'.format(UT_CONST.config_files['json']))
                 sys.exit(-1)
@@ -622,16 +1000,21 @@ class UpsList:
                 self.get_daemon_ups().daemon = self.daemon
 
     def read_set_daemon(self) -> None:
-        """ Used to refresh the daemon configuration parameters by rereading file.
+        """ Used to refresh the daemon configuration parameters by rereading file.  Only called from
+            the main loop of a utility, between reads, so a poll thread never sees a partial refresh.
         """
+        previous_daemon = self.daemon
         self.daemon: Optional[UpsDaemon] = UpsDaemon()
-        self.get_daemon_ups().daemon = self.daemon
+        self.daemon.adopt(previous_daemon)
+        if self.get_daemon_ups():
+            self.get_daemon_ups().daemon = self.daemon
         print('daemon refreshed')
         if UT_CONST.verbose:
             self.print_daemon_parameters()
         UT_CONST.refresh_daemon = False
 
     def __repr__(self) -> str:
+        import pprint
         return re.sub(r'\'', '\"', pprint.pformat(self.list, indent=2, width=120))
 
     def __str__(self) -> str:
@@ -778,47 +1161,207 @@ class UpsList:
         :param display: Flag to indicate if parameters should be displayed as read.
         :return:  dict of results from the reading of all commands from all UPSs.
         """
-        if UT_CONST.refresh_daemon:
-            self.read_set_daemon()
-        for ups in self.upss():
-            if not errups:
-                if not ups.prm.responsive:
-                    continue
+        self.check_ups_json()
+        read_health = cmd_group in (MibGroup.dynamic, MibGroup.monitor) and \
+            time() - self.health_time >= self.health_interval
+        if read_health:
+            self.health_time = time()
+        # UPSs with an open breaker are included, so they are probed and read again once they recover.
+        upss = [ups for ups in self.upss() if errups or ups.prm.responsive or not ups.breaker.is_closed()]
+
+        def read_ups(ups: UpsItem) -> None:
             ups.read_ups_list_items(cmd_group, display=display)
+            if read_health:
+                ups.read_ups_list_items(MibGroup.health, display=display)
+
+        if display or len(upss) < 2:
+            for ups in upss:
+                read_ups(ups)
+        else:
+            # Read all UPSs concurrently, so the fleet is sampled within a short time window.  UPSs
+            # held longest by their rate limits are started first, so they do not extend the cycle.
+            request_count = len(UpsComm.all_mib_cmd_names[cmd_group])
+            upss.sort(key=lambda ups: ups.rate_delay(request_count), reverse=True)
+            workers = min(len(upss), self.max_read_workers)
+            if workers > self._read_workers:
+                from concurrent.futures import ThreadPoolExecutor
+                if self._executor:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ups-read')
+                self._read_workers = workers
+            for future in [self._executor.submit(read_ups, ups) for ups in upss]:
+                future.result()
+        if self.store and cmd_group in (MibGroup.dynamic, MibGroup.monitor, MibGroup.all):
+            self.record_store()
         return True
 
-    def read_ups_json(self) -> bool:
-        """ Reads the ups-config.json file which contains parameters for UPSs to be used by utility.
-            Build of list of UpsItems representing each of the UPSs defined in the json file.
+    def close(self) -> None:
+        """ Stop the threads used for concurrent reads.
+        """
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._read_workers = 0
 
-        :return: boolean True if no problems reading list
+    def open_store(self, store_path: str) -> None:
+        """ Open the on-disk time series store where readings will be recorded.
+
+        :param store_path: Root directory of the store.
+        """
+        self.store = TimeSeriesStore(store_path)
+        LOGGER.debug('Opened %s', self.store)
+
+    def record_store(self) -> None:
+        """ Record the latest readings of all responsive UPSs in the time series store.
+        """
+        timestamp = time()
+        for ups in self.upss():
+            if not ups.prm.responsive: continue
+            self.store.record(ups.prm.display_name, ups.prm, timestamp)
+
+    @staticmethod
+    def load_ups_json() -> Optional[Dict[str, Dict[str, Any]]]:
+        """ Load the UPS definitions from the ups-config.json file.
+
+        :return: Dictionary of UPS definitions, or None if the file could not be read.
         """
         if not UT_CONST.ups_json_file:
             print('Error: {} file not defined: {}'.format('ups-config.json', UT_CONST.config_files['json']))
-            return False
+            return None
         if not os.path.isfile(UT_CONST.ups_json_file):
             print('Error: {} file not found: {}'.format(os.path.basename(UT_CONST.ups_json_file),
                                                         UT_CONST.ups_json_file))
-            return False
+            return None
         try:
             with open(UT_CONST.ups_json_file, mode='r', encoding='utf-8') as ups_list_file:
                 ups_items = json.load(ups_list_file)
         except FileNotFoundError as error:
             UT_CONST.process_message("Error: File not found error for [{}]: {}".format(
                 UT_CONST.ups_json_file, error), verbose=True)
-            return False
+            return None
         except PermissionError as error:
             UT_CONST.process_message("Error: File permission error for [{}]: {}".format(
                 UT_CONST.ups_json_file, error), verbose=True)
-            return False
+            return None
         except json.decoder.JSONDecodeError as error:
             UT_CONST.process_message("Error: File format error for [{}]:\n       {}".format(
                 UT_CONST.ups_json_file, error), verbose=True)
-            return False
+            return None
+        if not isinstance(ups_items, dict) or not all(isinstance(item, dict) for item in ups_items.values()):
+            UT_CONST.process_message('Error: File format error for [{}]: not an object of UPS objects'.format(
+                UT_CONST.ups_json_file), verbose=True)
+            return None
+        return ups_items
+
+    def read_ups_json(self) -> bool:
+        """ Reads the ups-config.json file which contains parameters for UPSs to be used by utility.
+            Build of list of UpsItems representing each of the UPSs defined in the json file.
+
+        :return: boolean True if no problems reading list
+        """
+        ups_items = self.load_ups_json()
+        if ups_items is None: return False
+        history_capacity = UpsDaemon.history_capacity()
         for ups_dict in ups_items.values():
             uuid = uuid4().hex
             ups_dict['uuid'] = uuid
-            self.list[uuid] = UpsItem(ups_dict)
+            self.list[uuid] = UpsItem(ups_dict, history_capacity)
+        return True
+
+    def watch_ups_json(self) -> None:
+        """ Reload the UPS list when ups-config.json changes.  The file is checked at the
+            start of each read of all UPSs.
+        """
+        if UT_CONST.ups_json_file and not self.service:
+            self.config_watcher = FileWatcher(UT_CONST.ups_json_file)
+            LOGGER.debug('Watching %s', self.config_watcher)
+
+    def check_ups_json(self) -> bool:
+        """ Reload ups-config.json if it changed since it was last read.  Called from the thread
+            which reads the UPSs, between reads.
+
+        :return: True if a change was applied.
+        """
+        if not self.config_watcher or not self.config_watcher.changed(): return False
+        if not check_file(UT_CONST.ups_json_file): return False
+        return self.reload_ups_json()
+
+    def reload_ups_json(self) -> bool:
+        """ Apply the UPS definitions of ups-config.json to the list.  UPSs are matched by
+            display_name, and only added UPSs and UPSs with a changed definition are created.
+            Unchanged UPSs are kept with their history, paths, and caches.  A changed UPS keeps
+            its uuid, and its history if its addresses are unchanged.  The new list replaces the
+            old one in a single assignment, so other threads see either the old or the new list.
+            An invalid file leaves the list unchanged.
+
+        :return: True if a change was applied.
+        """
+        ups_items = self.load_ups_json()
+        if ups_items is None:
+            UT_CONST.process_message('Error: {} not reloaded, keeping the current UPS list'.format(
+                UT_CONST.ups_json_file), verbose=True)
+            return False
+        definitions = list(ups_items.values())
+        names = [definition.get('display_name') for definition in definitions]
+        num_daemon = sum(1 for definition in definitions if definition.get('daemon'))
+        error = None
+        if None in names or len(set(names)) != len(names):
+            error = 'each UPS needs a unique display_name'
+        elif num_daemon > 1:
+            error = 'more than one daemon UPS defined'
+        elif self.get_daemon_ups() and not num_daemon:
+            error = 'no daemon UPS defined'
+        if error:
+            UT_CONST.process_message('Error: {} not reloaded, {}'.format(UT_CONST.ups_json_file, error),
+                                     verbose=True)
+            return False
+
+        current = {ups.prm.display_name: ups for ups in self.upss()}
+        history_capacity = UpsDaemon.history_capacity()
+        new_list: Dict[str, UpsItem] = {}
+        added: List[str] = []
+        updated: List[str] = []
+        for definition in definitions:
+            name = definition['display_name']
+            ups = current.get(name)
+            if ups and ups.definition == definition:
+                new_list[ups.prm.uuid] = ups
+                continue
+            new_ups = UpsItem({**definition, 'uuid': ups.prm.uuid if ups else uuid4().hex}, history_capacity)
+            if ups:
+                if new_ups.prm.ups_IP == ups.prm.ups_IP: new_ups.history = ups.history
+                updated.append(name)
+            else:
+                added.append(name)
+            new_list[new_ups.prm.uuid] = new_ups
+        removed = [name for name in current if name not in names]
+        if not (added or updated or removed):
+            LOGGER.debug('%s: no UPS definitions changed', UT_CONST.ups_json_file)
+            return False
+
+        for ups in new_list.values():
+            if ups.prm.daemon: ups.daemon = self.daemon
+        self.list = new_list
+        print('[{}] Reloaded {}: added {}, updated {}, removed {}'.format(
+            UT_CONST.now(ltz=UT_CONST.use_ltz, as_string=True), os.path.basename(UT_CONST.ups_json_file),
+            ', '.join(added) or 'none', ', '.join(updated) or 'none', ', '.join(removed) or 'none'))
+        return True
+
+    def read_service_list(self) -> bool:
+        """ Build the list of UpsItems from the UPSs known to the poller service.
+
+        :return: boolean True if no problems reading list
+        """
+        try:
+            ups_items = self.service.ups_details()
+        except (OSError, ValueError) as error:
+            UT_CONST.process_message('Error: UPS service [{}]: {}'.format(self.service.socket_path, error),
+                                     verbose=True)
+            return False
+        history_capacity = UpsDaemon.history_capacity()
+        for ups_dict in ups_items:
+            ups_item = UpsItem(ups_dict, history_capacity, service=self.service)
+            self.list[ups_item.prm.uuid] = ups_item
         return True
 
     # Methods to get, check, and list UPSs
@@ -881,215 +1424,39 @@ class UpsComm:
                               'HotStandby', 'EPO', 'LoadAlarmViolation', 'BypassPhaseFault',
                               'UPSinternalComFail', 'EffBoosterMode', 'Off', 'Standby', 'Minor/EnvAlarm')}
 
-    all_mib_cmds: Dict[UpsType, Dict[MiB, Dict[str, Union[str, Dict[str, str], None]]]] = {
-        # MiBs for APC UPS with AP96xx NMC
+    # MiB profiles of each UPS type, built on first use
+    all_mib_cmds: ProfileMap = PROFILES
+
+    # Per-phase tables read with one snmpbulkwalk each: table entry OID and column number: (name, scale)
+    # RFC 1628 UPS-MIB upsInputTable and upsOutputTable, also supported by AP96xx NMCs
+    _rfc1628_tables: Dict[MiB, Dict[str, Union[str, Dict[int, Tuple[str, float]]]]] = {
+        MiB.input_phases: {'iso': 'iso.3.6.1.2.1.33.1.3.3.1',
+                           'name': 'Input Phase Table',
+                           'columns': {2: ('frequency', 0.1), 3: ('voltage', 1.0),
+                                       4: ('current', 0.1), 5: ('power', 1.0)}},
+        MiB.output_phases: {'iso': 'iso.3.6.1.2.1.33.1.4.4.1',
+                            'name': 'Output Phase Table',
+                            'columns': {2: ('voltage', 1.0), 3: ('current', 0.1),
+                                        4: ('power', 1.0), 5: ('load', 1.0)}}}
+    all_mib_tables: Dict[UpsType, Dict[MiB, Dict[str, Union[str, Dict[int, Tuple[str, float]]]]]] = {
         UpsType.none: {},
-        UpsType.apc_ap96xx: {
-            MiB.ups_info: {'iso': 'iso.3.6.1.2.1.1.1.0',
-                           'name': 'General UPS Information',
-                           'decode': None},
-            MiB.bios_serial_number: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.3.0',
-                                     'name': 'UPS BIOS Serial Number',
-                                     'decode': None},
-            MiB.firmware_revision: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.1.0',
-                                    'name': 'UPS Firmware Revision',
-                                    'decode': None},
-            MiB.ups_type: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.1.1.0',
-                           'name': 'UPS Model Type',
-                           'decode': None},
-            MiB.ups_model: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.5.0',
-                            'name': 'UPS Model Number',
-                            'decode': None},
-            MiB.ups_contact: {'iso': 'iso.3.6.1.2.1.1.4.0',
-                              'name': 'UPS Contact',
-                              'decode': None},
-            MiB.ups_env_temp: {'iso': 'iso.3.6.1.4.1.318.1.1.25.1.2.1.6.1.1',
-                               'name': 'UPS Environment Temp',
-                               'decode': None},
-            MiB.ups_location: {'iso': 'iso.3.6.1.2.1.1.6.0',
-                               'name': 'UPS Location',
-                               'decode': None},
-            MiB.ups_uptime: {'iso': 'iso.3.6.1.2.1.1.3.0',
-                             'name': 'UPS Up Time',
-                             'decode': None},
-            MiB.ups_manufacture_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.2.0',
-                                       'name': 'UPS Manufacture Date',
-                                       'decode': None},
-            MiB.ups_name: {'iso': 'iso.3.6.1.2.1.33.1.1.5.0',
-                           'name': 'UPS Name',
-                           'decode': None},
-            MiB.battery_capacity: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.1.0',
-                                   'name': 'Percentage of Total Capacity',
-                                   'decode': None},
-            MiB.battery_temperature: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.2.0',
-                                      'name': 'Battery Temperature in C',
-                                      'decode': None},
-            MiB.system_status: {'iso': 'iso.3.6.1.4.1.318.1.1.1.11.1.1.0',
-                                'name': 'UPS System Status',
-                                'decode': None},
-            MiB.battery_status: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.1.1.0',
-                                 'name': 'Battery Status',
-                                 'decode': {'1': 'Unknown',
-                                            '2': 'Battery Normal',
-                                            '3': 'Battery Low',
-                                            '4': 'Battery in Fault Condition'}},
-            MiB.time_on_battery: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.1.2.0',
-                                  'name': 'Time on Battery',
-                                  'decode': None},
-            MiB.battery_runtime_remain: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.3.0',
-                                         'name': 'Runtime Remaining',
-                                         'decode': None},
-            MiB.battery_replace: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.4.0',
-                                  'name': 'Battery Replacement',
-                                  'decode': {'1': 'OK',
-                                             '2': 'Replacement Required'}},
-            MiB.input_voltage: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.1.0',
-                                'name': 'Input Voltage',
-                                'decode': None},
-            MiB.input_frequency: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.4.0',
-                                  'name': 'Input Frequency Hz',
-                                  'decode': None},
-            MiB.reason_for_last_transfer: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.5.0',
-                                           'name': 'Last Transfer Event',
-                                           'decode': {'1': 'No Transfer',
-                                                      '2': 'High Line Voltage',
-                                                      '3': 'Brownout',
-                                                      '4': 'Loss of Main Power',
-                                                      '5': 'Small Temp Power Drop',
-                                                      '6': 'Large Temp Power Drop',
-                                                      '7': 'Small Spike',
-                                                      '8': 'Large Spike',
-                                                      '9': 'UPS Self Test',
-                                                      '10': 'Excessive Input V Fluctuation'}},
-            MiB.output_voltage: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.1.0',
-                                 'name': 'Output Voltage',
-                                 'decode': None},
-            MiB.output_frequency: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.2.0',
-                                   'name': 'Output Frequency Hz',
-                                   'decode': None},
-            MiB.output_load: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.3.0',
-                              'name': 'Output Load as % of Capacity',
-                              'decode': None},
-            MiB.output_power: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.8.0',
-                               'name': 'Output Power in W',
-                               'decode': None},
-            MiB.output_current: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.4.0',
-                                 'name': 'Output Current in Amps',
-                                 'decode': None},
-            MiB.comms: {'iso': 'iso.3.6.1.4.1.318.1.1.1.8.1.0',
-                        'name': 'Communicating with UPS Device',
-                        'decode': {'1': 'Communication OK',
-                                   '2': 'Communication Error'}},
-            MiB.last_self_test_result: {'iso': 'iso.3.6.1.4.1.318.1.1.1.7.2.3.0',
-                                        'name': 'Last Self Test Results',
-                                        'decode': {'1': 'OK',
-                                                   '2': 'Failed',
-                                                   '3': 'Invalid',
-                                                   '4': 'In Progress'}},
-            MiB.last_self_test_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.7.2.4.0',
-                                      'name': 'Date of Last Self Test',
-                                      'decode': None}},
-        # MiBs for Eaton UPS with PowerWalker NMC
+        UpsType.apc_ap96xx: _rfc1628_tables,
+        UpsType.rfc1628: _rfc1628_tables,
         UpsType.eaton_pw: {
-            MiB.ups_info: {'iso': 'iso.3.6.1.2.1.1.1.0',
-                           'name': 'General UPS Information',
-                           'decode': None},
-            MiB.ups_manufacturer: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.1.0',
-                                   'name': 'UPS Manufacturer',
-                                   'decode': None},
-            MiB.firmware_revision: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.6.0',
-                                    'name': 'UPS Firmware Revision',
-                                    'decode': None},
-            MiB.ups_type: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.2.0',
-                           'name': 'UPS Model Type',
-                           'decode': None},
-            MiB.ups_contact: {'iso': 'iso.3.6.1.2.1.1.4.0',
-                              'name': 'UPS Contact',
-                              'decode': None},
-            MiB.ups_location: {'iso': 'iso.3.6.1.2.1.1.6.0',
-                               'name': 'UPS Location',
-                               'decode': None},
-            MiB.ups_uptime: {'iso': 'iso.3.6.1.2.1.1.3.0',
-                             'name': 'System Up Time',
-                             'decode': None},
-            MiB.ups_manufacture_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.2.0',
-                                       'name': 'UPS Manufacture Date',
-                                       'decode': None},
-            MiB.ups_name: {'iso': 'iso.3.6.1.2.1.33.1.1.5.0',
-                           'name': 'UPS Name',
-                           'decode': None},
-            MiB.battery_capacity: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.4.0',
-                                   'name': 'Percentage of Total Capacity',
-                                   'decode': None},
-            MiB.system_temperature: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.2.0',
-                                     'name': 'System Temperature in C',
-                                     'decode': None},
-            MiB.system_status: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.1.0',
-                                'name': 'UPS System Status',
-                                'decode': {'1': 'Power On',
-                                           '2': 'Standby',
-                                           '3': 'Bypass',
-                                           '4': 'Line',
-                                           '5': 'Battery',
-                                           '6': 'Battery Test',
-                                           '7': 'Fault',
-                                           '8': 'Converter',
-                                           '9': 'ECO',
-                                           '10': 'Shutdown',
-                                           '11': 'On Booster',
-                                           '12': 'On Reducer',
-                                           '13': 'Other'}},
-            MiB.battery_status: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.1.0',
-                                 'name': 'Battery Status',
-                                 'decode': {'1': 'Unknown',
-                                            '2': 'Battery Normal',
-                                            '3': 'Battery Low',
-                                            '4': 'Battery Depleted',
-                                            '5': 'Battery Discharging',
-                                            '6': 'Battery Failure'}},
-            MiB.time_on_battery: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.2.0',
-                                  'name': 'Time on Battery',
-                                  'decode': None},
-            MiB.battery_runtime_remain: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.3.0',
-                                         'name': 'Runtime Remaining',
-                                         'decode': None},
-            MiB.input_voltage: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.16.1.3.1',
-                                'name': 'Input Voltage V',
-                                'decode': None},
-            MiB.input_frequency: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.16.1.2.1',
-                                  'name': 'Input Frequency Hz',
-                                  'decode': None},
-            MiB.output_voltage: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.3.1',
-                                 'name': 'Output Voltage',
-                                 'decode': None},
-            MiB.output_frequency: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.2.1',
-                                   'name': 'Output Frequency Hz',
-                                   'decode': None},
-            MiB.output_load: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.7.1',
-                              'name': 'Output Load as % of Capacity',
-                              'decode': None},
-            MiB.output_current: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.4.1',
-                                 'name': 'Output Current in Amps',
-                                 'decode': None},
-            MiB.output_power: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.5.1',
-                               'name': 'Output Power in W',
-                               'decode': None},
-            MiB.last_self_test_result: {'iso': 'iso.3.6.1.4.1.935.10.1.1.7.3.0',
-                                        'name': 'Last Self Test Results',
-                                        'decode': {'1': 'Idle',
-                                                   '2': 'Processing',
-                                                   '3': 'No Failure',
-                                                   '4': 'Failure/Warning',
-                                                   '5': 'Not Possible',
-                                                   '6': 'Test Cancel'}},
-            MiB.last_self_test_date: {'iso': 'iso.3.6.1.4.1.935.10.1.1.7.4.0',
-                                      'name': 'Date of Last Self Test',
-                                      'decode': None}}}
+            MiB.input_phases: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.16.1',
+                               'name': 'Input Phase Table',
+                               'columns': {2: ('frequency', 0.1), 3: ('voltage', 0.1)}},
+            MiB.output_phases: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1',
+                                'name': 'Output Phase Table',
+                                'columns': {2: ('frequency', 0.1), 3: ('voltage', 0.1), 4: ('current', 0.1),
+                                            5: ('power', 1.0), 7: ('load', 1.0)}}}}
+    table_mibs: Set[MiB] = {MiB.input_phases, MiB.output_phases}
+    # Variables returned by each GETBULK request, enough for a three phase table in one round trip.
+    bulk_repetitions: int = 50
 
     _valid_type_keys = [x.name for x in all_mib_cmds]
     # UPS MiB Commands lists
-    _mib_all_apc_ap96xx: Set[str] = set(all_mib_cmds[UpsType.apc_ap96xx].keys())
-    _mib_all_eaton_pw: Set[str] = set(all_mib_cmds[UpsType.eaton_pw].keys())
+    _mib_all: Set[MiB] = set(MiB)
     _mib_statmon: Set[MiB] = {MiB.ups_name, MiB.ups_type, MiB.ups_location, MiB.ups_info, MiB.ups_model}
     _mib_static: Set[MiB] = {MiB.ups_name, MiB.ups_info, MiB.bios_serial_number, MiB.firmware_revision,
                              MiB.ups_type, MiB.ups_location, MiB.ups_uptime}
@@ -1097,43 +1464,128 @@ class UpsComm:
                               MiB.battery_runtime_remain, MiB.input_voltage, MiB.input_frequency,
                               MiB.output_voltage, MiB.output_frequency, MiB.output_load,
                               MiB.output_current, MiB.output_power, MiB.system_status,
-                              MiB.battery_status}
+                              MiB.battery_status, MiB.reason_for_last_transfer, MiB.input_phases,
+                              MiB.output_phases}
     _mib_output: Set[MiB] = {MiB.output_voltage, MiB.output_frequency, MiB.output_load,
-                             MiB.output_current, MiB.output_power, MiB.ups_model}
-    _mib_input: Set[MiB] = {MiB.input_voltage, MiB.input_frequency, MiB.ups_model}
+                             MiB.output_current, MiB.output_power, MiB.ups_model, MiB.output_phases}
+    _mib_input: Set[MiB] = {MiB.input_voltage, MiB.input_frequency, MiB.ups_model, MiB.input_phases}
+    _mib_health: Set[MiB] = {MiB.last_self_test_result, MiB.last_self_test_date, MiB.battery_replace}
     all_mib_cmd_names: Dict[MibGroup, Set[MiB]] = {
-        MibGroup.all:       _mib_all_apc_ap96xx,   # I choose all to be apc since eaton is a subset of apc.
-        MibGroup.all_apc:   _mib_all_apc_ap96xx,
-        MibGroup.all_eaton: _mib_all_eaton_pw,
+        MibGroup.all:       _mib_all,   # MiBs not in the profile of a UPS are reported as No data.
+        MibGroup.all_apc:   _mib_all,
+        MibGroup.all_eaton: _mib_all,
         MibGroup.monitor:   _mib_dynamic.union(_mib_statmon),
         MibGroup.output:    _mib_output,
         MibGroup.input:     _mib_input,
         MibGroup.static:    _mib_static,
-        MibGroup.dynamic:   _mib_dynamic}
+        MibGroup.dynamic:   _mib_dynamic,
+        MibGroup.health:    _mib_health}
     # MIB Command Lists
 
-    # Check if snmp tools are installed
-    _snmp_command: str = shutil.which('snmpget')
-    if not _snmp_command:
-        UT_CONST.process_message('Missing dependency: `sudo apt install snmp`', log_flag=True, verbose=True)
-        sys.exit(-1)
+    # snmp tools are found by find_snmp_tools when the first UpsComm is created, not at import.
+    _snmp_command: Optional[str] = None
+    _snmp_walk_command: Optional[str] = None
+    type_cache: TypeCache = TypeCache()
+    # Seconds between detections of the type of a responsive UPS whose type was not detected.
+    type_detect_interval: float = 300.0
 
     def __init__(self, ups_item: UpsItem):
         """
         Initialize mechanism to communicate with UPS via SNMP V2.
         """
+        self.find_snmp_tools()
         self.snmp_command = self._snmp_command
+        self.snmp_walk_command = self._snmp_walk_command
         self.daemon: bool = ups_item.prm.daemon
+        self.detect_time: float = 0.0
         self.ups_type = ups_item.prm['ups_type']
         if ups_item.prm['ups_type'] in UpsType.list():
             self.ups_type = ups_item.prm['ups_type'] = UpsType[ups_item.prm['ups_type']]
+        self.mib_commands: Dict[MiB, Dict[str, Union[str, Dict[str, str], None]]] = {}
+        self.mib_tables: Dict[MiB, Dict[str, Union[str, Dict[int, Tuple[str, float]]]]] = {}
+        if self.ups_type is None:
+            # Type is detected once the UPS is found responsive.
+            return
         try:
             self.mib_commands = self.all_mib_cmds[self.ups_type]
+            self.mib_tables = self.all_mib_tables.get(self.ups_type, {})
         except KeyError:
             print('Invalid entry in [{}].  Value {} not in {}'.format(
                   UT_CONST.ups_json_file, ups_item.prm['ups_type'], self._valid_type_keys))
             ups_item.valid = False
 
+    @classmethod
+    def find_snmp_tools(cls) -> None:
+        """ Find the snmp tools once, exiting if they are not installed.
+        """
+        if cls._snmp_command: return
+        cls._snmp_command = shutil.which('snmpget')
+        if not cls._snmp_command:
+            UT_CONST.process_message('Missing dependency: `sudo apt install snmp`', log_flag=True, verbose=True)
+            sys.exit(-1)
+        cls._snmp_walk_command = shutil.which('snmpbulkwalk')
+
+    def detect_ups_type(self, ups: UpsItem) -> UpsType:
+        """ Detect the type of the UPS from its sysObjectID and sysDescr, using the cached type
+            from a previous detection if available.
+
+        :param ups:  The target ups item
+        :return:  The detected UpsType, UpsType.none if not supported
+        """
+        cached_type = self.type_cache.get(ups.prm['ups_IP'])
+        if cached_type:
+            LOGGER.debug('%s type %s from %s', ups.prm.display_name, cached_type, self.type_cache)
+            return cached_type
+        sys_object_id = self.snmp_value(self.snmp_get(ups, SYS_OBJECT_ID_OID))
+        sys_descr = self.snmp_value(self.snmp_get(ups, SYS_DESCR_OID))
+        ups_type = match_vendor(sys_object_id, sys_descr)
+        if not ups_type and self.snmp_value(self.snmp_get(ups, UPS_MIB_PROBE_OID)) is not None:
+            ups_type = UpsType.rfc1628
+        if not ups_type:
+            UT_CONST.process_message('UPS {} type not detected: sysObjectID [{}], sysDescr [{}]'.format(
+                ups.prm.display_name, sys_object_id, sys_descr), verbose=True)
+            return UpsType.none
+        LOGGER.debug('%s detected type %s from sysObjectID [%s]', ups.prm.display_name, ups_type, sys_object_id)
+        self.type_cache.put(ups.prm['ups_IP'], ups_type, numeric_oid(sys_object_id))
+        return ups_type
+
+    def redetect_ups_type(self, ups: UpsItem) -> None:
+        """ Detect the type of a UPS with an auto type, which was not detected when the UPS was
+            added while unresponsive, and set it if found.
+
+        :param ups:  The target ups item
+        """
+        self.detect_time = time()
+        ups_type = self.detect_ups_type(ups)
+        if ups_type in (UpsType.none, ups.prm['ups_type']): return
+        self.set_ups_type(ups, ups_type)
+        ups.skip_list.clear()
+        UT_CONST.process_message('[{}] UPS {} type detected: {}'.format(
+            UT_CONST.now(ltz=UT_CONST.use_ltz, as_string=True), ups.prm.display_name, ups_type.name), verbose=True)
+
+    def set_ups_type(self, ups: UpsItem, ups_type: UpsType) -> None:
+        """ Set the type of the UPS and the MiB profile used to read it.
+
+        :param ups:  The target ups item
+        :param ups_type:  The UpsType of the UPS.
+        """
+        self.ups_type = ups.prm['ups_type'] = ups_type
+        self.mib_commands = ups.prm['mib_commands'] = self.all_mib_cmds[ups_type]
+        self.mib_tables = ups.prm['mib_tables'] = self.all_mib_tables.get(ups_type, {})
+        ups.prm['valid'] = ups.prm['compatible'] = ups_type != UpsType.none
+
+    @staticmethod
+    def snmp_value(snmp_output: Optional[List[str]]) -> Optional[str]:
+        """ Get the value from the output of a snmpget request.
+
+        :param snmp_output:  The output lines of snmpget.
+        :return:  The value, or None if there is no value.
+        """
+        for line in snmp_output or []:
+            if re.match(UT_CONST.PATTERNS['SNMP_VALUE'], line):
+                return re.sub(r'\"', '', line.split('=', 1)[1].split(':', 1)[1]).strip()
+        return None
+
     @staticmethod
     def is_valid_ip_fqdn(test_value: str) -> bool:
         """ Check if given string is a valid IP address of FQDN.
@@ -1161,23 +1613,92 @@ class UpsComm:
             if not self.is_valid_ip_fqdn(ip_fqdn): return False
         return not bool(os.system('ping -c 1 {} > /dev/null'.format(ip_fqdn)))
 
-    def check_snmp_response(self, ups: UpsItem) -> bool:
+    def check_snmp_response(self, ups: UpsItem, probe: bool = False) -> bool:
         """ Check if the IP address for the target UPS, responds to snmp command.
 
         :param ups:  The target ups dictionary from list or None.
+        :param probe:  If True, send a single request without retries on every path.
         :return:  True if the given IP address responds, else False
         """
-        cmd_str = '{} -v2c -c {} {} {}'.format(self.snmp_command, ups.prm['snmp_community'],
-                                               ups.prm['ups_IP'], 'iso.3.6.1.2.1.1.1.0')
+        snmp_output = self.snmp_get(ups, 'iso.3.6.1.2.1.1.1.0', probe=probe)
+        LOGGER.debug(snmp_output)
+        return snmp_output is not None
 
-        try:
-            snmp_output = subprocess.check_output(shlex.split(cmd_str), shell=False,
-                                                  stderr=subprocess.DEVNULL).decode().split('\n')
-            LOGGER.debug(snmp_output)
-        except subprocess.CalledProcessError as err:
-            LOGGER.debug('%s execution error: %s', cmd_str, err)
-            return False
-        return True
+    def snmp_get(self, ups: UpsItem, oid: str, probe: bool = False) -> Optional[List[str]]:
+        """ Send a snmpget request for one OID, hedged over the paths of the UPS.  Timeout and
+            retries of each path adapt to its measured round trip time.
+
+        :param ups:  The target ups item
+        :param oid:  The OID to get.
+        :param probe:  If True, send a single request without retries and probe open paths.
+        :return:  The output lines of the first path to answer, or None if no path answered.
+        """
+        return self.snmp_request(self.snmp_command, ups, oid, probe=probe)
+
+    def snmp_walk(self, ups: UpsItem, oid: str) -> Optional[List[str]]:
+        """ Read a subtree with GETBULK requests, hedged over the paths of the UPS.  A table of
+            up to bulk_repetitions variables is read in one round trip.
+
+        :param ups:  The target ups item
+        :param oid:  The OID of the subtree.
+        :return:  The output lines with numeric OIDs, or None if no path answered.
+        """
+        if not self.snmp_walk_command: return None
+        return self.snmp_request(self.snmp_walk_command, ups, oid,
+                                 options='-On -Cr{}'.format(self.bulk_repetitions))
+
+    @staticmethod
+    def security_args(ups: UpsItem, path: NmcPath) -> List[str]:
+        """ Get the net-snmp security options for a request on a path of the UPS.  For SNMPv3, the
+            engine of the card is discovered once, so requests need no discovery round trip.
+
+        :param ups:  The target ups item
+        :param path:  The path of the request.
+        :return:  List of options.
+        """
+        if not ups.usm:
+            return ['-v2c', '-c', str(ups.prm['snmp_community'])]
+        if path.engine is None or path.engine.stale:
+            engine = discover_engine(DNS_CACHE.resolve(path.address), timeout=path.rto.rto)
+            if engine:
+                path.engine = engine
+        return ups.usm.args(path.engine)
+
+    @staticmethod
+    def security_env(ups: UpsItem, path: NmcPath) -> Optional[Dict[str, str]]:
+        """ Get the environment of a request on a path of the UPS.  For SNMPv3, net-snmp reads the
+            passwords or keys from a private config file, so they are not on the command line.
+
+        :param ups:  The target ups item
+        :param path:  The path of the request, with its engine discovered by security_args.
+        :return:  The environment, or None to inherit it.
+        :raises OSError: If the config file can not be written.
+        """
+        config_path = ups.usm.config_path(path.engine) if ups.usm else None
+        return {**os.environ, 'SNMPCONFPATH': config_path} if config_path else None
+
+    @staticmethod
+    def snmp_request(tool: str, ups: UpsItem, oid: str, probe: bool = False, options: str = '') -> Optional[List[str]]:
+        """ Run a net-snmp tool for one OID on the paths of the UPS.
+
+        :param tool:  Path of the net-snmp tool.
+        :param ups:  The target ups item
+        :param oid:  The OID argument.
+        :param probe:  If True, send a single request without retries and probe open paths.
+        :param options:  Additional options of the tool.
+        :return:  The output lines of the first path to answer, or None if no path answered.
+        """
+        def command(path: NmcPath) -> Tuple[List[str], float, Optional[Dict[str, str]]]:
+            timeout, retries = path.rto.request_params()
+            args = [tool, *UpsComm.security_args(ups, path), '-t', '{:.3f}'.format(timeout),
+                    '-r', str(0 if probe else retries), *shlex.split(options), path.target(), oid]
+            return args, timeout, UpsComm.security_env(ups, path)
+
+        result = hedged_request(ups.paths, command, force=probe)
+        if not result:
+            LOGGER.debug('No response to [%s] from %s: %s', oid, ups.prm.display_name, ups.paths)
+            return None
+        return result[1].split('\n')
 
     def read_ups_list_items(self, cmd_group: MibGroup, ups: UpsItem, display: bool = False) -> bool:
         """ Read the specified list of monitor mib commands for specified UPS.
@@ -1187,12 +1708,40 @@ class UpsComm:
         :param display: Flag to indicate if parameters should be displayed as read.
         :return:  True on success
         """
+        if not ups.breaker.is_closed():
+            # Open breaker: send one cheap probe when it is due, otherwise skip the UPS this cycle.
+            if ups.breaker.allow():
+                self.record_response(ups, self.check_snmp_response(ups, probe=True))
+            if not ups.breaker.is_closed():
+                self.clear_values(cmd_group, ups)
+                return False
+        if ups.auto_type and ups.prm['ups_type'] == UpsType.none and \
+                time() - self.detect_time > self.type_detect_interval:
+            self.redetect_ups_type(ups)
         for cmd in UpsComm.all_mib_cmd_names[cmd_group]:
             if cmd in ups.skip_list: continue
-            ups.prm[cmd] = self.send_snmp_command(cmd, ups, display=display)
-            if ups.prm[cmd] in {None, '', 'none'}:
-                ups.skip_list.append(cmd)
+            if cmd in self.table_mibs:
+                value = self.read_snmp_table(cmd, ups, display=display)
+            else:
+                value = self.send_snmp_command(cmd, ups, display=display)
+            if not ups.breaker.is_closed():
+                # The UPS stopped responding, so skip its remaining MiBs this cycle.
+                self.clear_values(cmd_group, ups)
+                return False
+            if value is None and ups.breaker.failures:
+                # No response, not an invalid response, so the MiB is read again next cycle.
+                ups.prm[cmd] = None
+                continue
+            ups.prm[cmd] = value
+            if ups.prm[cmd] in (None, '', 'none'):
+                ups.read_errors += 1
                 ups.prm[cmd] = '---'
+                # The daemon acts on the dynamic values of its UPS, so they are read again next cycle.
+                if ups.prm.daemon and cmd in self._mib_dynamic:
+                    UT_CONST.process_message('UPS {} invalid response: {}'.format(
+                        ups['display_name'], cmd), verbose=False)
+                    continue
+                ups.skip_list.append(cmd)
                 UT_CONST.process_message('UPS {} invalid response: Skipping: {}'.format(
                     ups['display_name'], cmd), verbose=False)
             if cmd == MiB.ups_info:
@@ -1205,12 +1754,12 @@ class UpsComm:
                 else:
                     ups.prm['ups_nmc_model'] = ups.ups_type().name
         # Since PowerWalker NMC is not intended for 110V UPSs, the following correction to output current is needed.
-        if ups.prm.ups_type == UpsType.eaton_pw:
+        if ups.prm.ups_type == UpsType.eaton_pw and MiB.output_current in UpsComm.all_mib_cmd_names[cmd_group]:
             try:
                 # Correct PowerWalker NMC current from 230V
                 ups.prm[MiB.output_current] = round((230 / ups.prm[MiB.output_voltage]) *
                                                     ups.prm[MiB.output_current], 1)
-            except (KeyError, ZeroDivisionError):
+            except (KeyError, TypeError, ZeroDivisionError):
                 return False
         return True
 
@@ -1223,21 +1772,19 @@ class UpsComm:
         :param display: If true the results will be printed
         :return:  The results from the read, could be str, int or tuple
         """
-        if not ups.is_responsive():
-            return 'Invalid UPS'
         snmp_mib_commands = ups.prm.mib_commands
         if command_mib not in snmp_mib_commands:
             return 'No data'
+        if not ups.breaker.allow():
+            return None
         cmd_mib = snmp_mib_commands[command_mib]['iso']
-        cmd_str = '{} -v2c -c {} {} {}'.format(self.snmp_command, ups.prm['snmp_community'],
-                                               ups.prm['ups_IP'], cmd_mib)
-        try:
-            snmp_output = subprocess.check_output(shlex.split(cmd_str), shell=False,
-                                                  stderr=subprocess.DEVNULL).decode().split('\n')
-        except subprocess.CalledProcessError:
+        snmp_output = self.snmp_get(ups, cmd_mib)
+        if snmp_output is None:
             LOGGER.debug('Error executing snmp %s command [%s] to %s at %s.',
                          command_mib, cmd_mib, ups.prm.display_name, ups.ups_ip())
+            self.record_response(ups, False)
             return None
+        self.record_response(ups, True)
 
         value: Union[str, int, float, None] = None
 
@@ -1251,32 +1798,41 @@ class UpsComm:
         if snmp_mib_commands[command_mib]['decode']:
             if value in snmp_mib_commands[command_mib]['decode'].keys():
                 value = snmp_mib_commands[command_mib]['decode'][value]
-        if ups.prm['ups_type'] == UpsType.eaton_pw:
-            if command_mib in (MiB.output_voltage, MiB.output_frequency):
-                value = int(value) / 10.0
-            elif command_mib == MiB.output_current:
-                value = int(value) / 10.0
-            elif command_mib in (MiB.input_voltage, MiB.input_frequency):
-                value = int(value) / 10.0
-            elif command_mib == MiB.system_temperature:
-                value = int(value) / 10.0
-        if command_mib == MiB.system_status and ups.prm['ups_type'] == UpsType.apc_ap96xx:
-            value = self.bit_str_decoder(value, self.decoders['apc_system_status'])
-        if command_mib in (MiB.time_on_battery, MiB.battery_runtime_remain):
-            # Create a minute, string tuple
+        try:
             if ups.prm['ups_type'] == UpsType.eaton_pw:
-                # Process time for eaton_pw
-                if command_mib == MiB.time_on_battery:
-                    # Measured in seconds.
-                    value = int(value)
+                if command_mib in (MiB.output_voltage, MiB.output_frequency):
+                    value = int(value) / 10.0
+                elif command_mib == MiB.output_current:
+                    value = int(value) / 10.0
+                elif command_mib in (MiB.input_voltage, MiB.input_frequency):
+                    value = int(value) / 10.0
+                elif command_mib == MiB.system_temperature:
+                    value = int(value) / 10.0
+            elif ups.prm['ups_type'] == UpsType.rfc1628:
+                # UPS-MIB frequencies and currents are in tenths.
+                if command_mib in (MiB.input_frequency, MiB.output_frequency, MiB.output_current):
+                    value = int(value) / 10.0
+            if command_mib == MiB.system_status and ups.prm['ups_type'] == UpsType.apc_ap96xx:
+                value = self.bit_str_decoder(value, self.decoders['apc_system_status'])
+            if command_mib in (MiB.time_on_battery, MiB.battery_runtime_remain):
+                # Create a minute, string tuple
+                if ups.prm['ups_type'] in (UpsType.eaton_pw, UpsType.rfc1628):
+                    # Process time for eaton_pw and UPS-MIB
+                    if command_mib == MiB.time_on_battery:
+                        # Measured in seconds.
+                        value = int(value)
+                    else:
+                        # Measured in minutes.
+                        value = int(value) * 60
+                    value = round(float(value) / 60.0, 2)
                 else:
-                    # Measured in minutes.
-                    value = int(value) * 60
-                value = round(float(value) / 60.0, 2)
-            else:
-                # Process time for APC, measured in hundredths of seconds
-                value_items = re.sub(r'\(', '', value).split(')')
-                value = round(float(value_items[0]) / 100 / 60, 2) if len(value_items) >= 2 else None
+                    # Process time for APC, measured in hundredths of seconds
+                    value_items = re.sub(r'\(', '', value).split(')')
+                    value = round(float(value_items[0]) / 100 / 60, 2) if len(value_items) >= 2 else None
+        except (TypeError, ValueError) as error:
+            # No value or a non-numeric value, such as No Such Object, is an invalid response.
+            LOGGER.debug('    Invalid value for %s: %s', command_mib, error)
+            value = None
         if display:
             if command_mib == MiB.output_current and ups.prm['ups_type'] == UpsType.eaton_pw:
                 print('{}: {} - raw, uncorrected value.'.format(snmp_mib_commands[command_mib]['name'], value))
@@ -1285,6 +1841,90 @@ class UpsComm:
         LOGGER.debug('    Value: %s', value)
         return value
 
+    def read_snmp_table(self, command_mib: MiB, ups: UpsItem,
+                        display: bool = False) -> Union[Dict[int, Dict[str, float]], str, None]:
+        """ Read a per-phase table of the specified UPS with one GETBULK walk.
+
+        :param command_mib:  The table to be read from the target UPS
+        :param ups:  The target ups item
+        :param display: If true the results will be printed
+        :return:  Dict of phase number to dict of column values, None if no response or empty
+        """
+        table = ups.prm.mib_tables.get(command_mib)
+        if not table:
+            return 'No data'
+        if not ups.breaker.allow():
+            return None
+        snmp_output = self.snmp_walk(ups, table['iso'])
+        if snmp_output is None:
+            LOGGER.debug('Error executing snmp %s walk [%s] to %s at %s.',
+                         command_mib, table['iso'], ups.prm.display_name, ups.ups_ip())
+            if self.snmp_walk_command: self.record_response(ups, False)
+            return None
+        self.record_response(ups, True)
+
+        prefix = '.1{}.'.format(table['iso'][3:])
+        phases: Dict[int, Dict[str, float]] = {}
+        for line in snmp_output:
+            oid, _, raw_value = line.partition(' = ')
+            if not oid.startswith(prefix) or not re.match(UT_CONST.PATTERNS['SNMP_VALUE'], line): continue
+            column, _, row = oid[len(prefix):].partition('.')
+            try:
+                name, scale = table['columns'][int(column)]
+                value = float(re.sub(r'\"', '', raw_value.split(':', 1)[1]).split()[0])
+                phases.setdefault(int(row), {})[name] = round(value * scale, 2)
+            except (KeyError, ValueError, IndexError):
+                continue
+        if ups.prm['ups_type'] == UpsType.eaton_pw:
+            for values in phases.values():
+                # Correct PowerWalker NMC current from 230V, as for the output current.
+                if values.get('current') is not None and values.get('voltage'):
+                    values['current'] = round((230 / values['voltage']) * values['current'], 1)
+        if display:
+            print('{}: {}'.format(table['name'], self.phase_text(phases)))
+        LOGGER.debug('    Value: %s', phases)
+        return phases or None
+
+    @staticmethod
+    def phase_text(phases: Union[Dict[int, Dict[str, float]], str, None]) -> str:
+        """ Format per-phase values for display.
+
+        :param phases: Dict of phase number to dict of column values.
+        :return: String with one group of values per phase
+        """
+        if not isinstance(phases, dict): return str(phases)
+        return ', '.join('L{}: {}'.format(phase, ' '.join('{}={}'.format(name, value) for name, value in values.items()))
+                         for phase, values in sorted(phases.items(), key=lambda item: int(item[0])))
+
+    @staticmethod
+    def record_response(ups: UpsItem, success: bool) -> None:
+        """ Record the outcome of a request in the breaker of the UPS and update its state.
+
+        :param ups:  The target ups item
+        :param success:  True if the UPS responded.
+        """
+        ups.breaker.record(success)
+        ups.prm['comm_state'] = ups.breaker.state.name
+        if ups.prm['responsive'] == ups.breaker.is_closed(): return
+        ups.prm['responsive'] = ups.breaker.is_closed()
+        UT_CONST.process_message('[{}] UPS {} {}'.format(
+            UT_CONST.now(ltz=UT_CONST.use_ltz, as_string=True), ups.prm.display_name,
+            'responding again' if ups.breaker.is_closed() else 'not responding: {}'.format(ups.breaker)),
+            verbose=True)
+        if ups.prm['responsive'] and ups.auto_type:
+            # A UPS unresponsive when it was added has no detected type, so detect it now.
+            ups.ups_comm.redetect_ups_type(ups)
+
+    @staticmethod
+    def clear_values(cmd_group: MibGroup, ups: UpsItem) -> None:
+        """ Clear the values of the given group, so stale readings of an unresponsive UPS are not used.
+
+        :param cmd_group:  The group of mib commands not read.
+        :param ups:  The target ups item
+        """
+        for cmd in UpsComm.all_mib_cmd_names[cmd_group]:
+            if cmd not in ups.skip_list: ups.prm[cmd] = None
+
     @staticmethod
     def bit_str_decoder(value: str, decode_key: tuple) -> str:
         """ Bit string decoder
@@ -1340,4 +1980,76 @@ class UpsComm:
                 print('    Decoder:')
                 for decoder_name, decoder_list in mib_dict['decode'].items():
                     print('        {}: {}{}{}'.format(decoder_name, color_code, decoder_list, reset_code))
+        for mib_name, table in self.mib_tables.items():
+            print('{}{}{}:'.format(mib_color_code, mib_name.name, reset_code))
+            print('    Table: {}{}{}'.format(color_code, table['iso'], reset_code))
+            print('    Description: {}{}{}'.format(color_code, table['name'], reset_code))
+            print('    Columns: {}{}{}'.format(color_code, ', '.join(
+                '{}: {}'.format(column, name) for column, (name, _) in table['columns'].items()), reset_code))
         print('')
+
+
+class ServiceComm:
+    """ Replacement for UpsComm which reads values from the poller service instead of the UPS."""
+    all_mib_cmd_names = UpsComm.all_mib_cmd_names
+    all_mib_cmds = UpsComm.all_mib_cmds
+    all_mib_tables = UpsComm.all_mib_tables
+
+    def __init__(self, ups_item: UpsItem, service: ServiceClient):
+        self.service: ServiceClient = service
+        self.daemon: bool = ups_item.prm.daemon
+        self.ups_type = ups_item.prm['ups_type']
+        self.mib_commands = self.all_mib_cmds.get(self.ups_type, {})
+        self.mib_tables = self.all_mib_tables.get(self.ups_type, {})
+
+    def _values(self, ups: UpsItem) -> Dict[str, Union[str, int, float, None]]:
+        """ Get the latest values for the UPS from the service.
+
+        :param ups: The target ups item
+        :return: Dictionary of values by MiB name, empty if not available.
+        """
+        try:
+            values = self.service.snapshot().get(ups.prm.display_name, {})
+        except (OSError, ValueError) as error:
+            LOGGER.debug('UPS service error for %s: %s', ups.prm.display_name, error)
+            values = {}
+        ups.prm['responsive'] = bool(values.get('responsive'))
+        ups.prm['comm_state'] = values.get('comm_state', ups.prm['comm_state'])
+        return values
+
+    def read_ups_list_items(self, cmd_group: MibGroup, ups: UpsItem, display: bool = False) -> bool:
+        """ Read the specified group of mib commands for specified UPS from the service.
+
+        :param cmd_group:  A list of mib commands to be read from the specified UPS.
+        :param ups:  The target ups item
+        :param display: Flag to indicate if parameters should be displayed as read.
+        :return:  True on success
+        """
+        values = self._values(ups)
+        if not values: return False
+        for cmd in UpsComm.all_mib_cmd_names[cmd_group]:
+            ups.prm[cmd] = values.get(cmd.name, '---')
+            if display and cmd in self.mib_commands:
+                print('{}: {}'.format(self.mib_commands[cmd]['name'], ups.prm[cmd]))
+        return True
+
+    def send_snmp_command(self, command_mib: MiB, ups: UpsItem,
+                          display: bool = False) -> Union[str, int, float, None]:
+        """ Read the latest value of the specified mib command for the specified UPS from the service.
+
+        :param command_mib:  A command to be read from the target UPS
+        :param ups:  The target ups item
+        :param display: If true the results will be printed
+        :return:  The value, could be str, int or float
+        """
+        values = self._values(ups)
+        if not values.get('responsive'):
+            return None
+        value = values.get(command_mib.name, 'No data')
+        if display and command_mib in self.mib_commands:
+            print('{}: {}'.format(self.mib_commands[command_mib]['name'], value))
+        return value
+
+    def print_snmp_commands(self) -> None:
+        """ Print all supported mib commands for the UPS. """
+        UpsComm.print_snmp_commands(self)
@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+""" UPSnut  -  NUT compatible network server backed by the poller service
+
+    Serves the latest values of all UPSs to Network UPS Tools clients, such as
+    upsmon, upsc, and monitoring plugins, using the upsd text protocol on TCP.
+    MiB values are mapped to the standard NUT variable names and the variable
+    lists are rendered once after each poll of the service, so clients never
+    cause snmp traffic.  All connections are handled by one event loop thread,
+    so hundreds of persistent client connections are cheap.
+
+    Supported commands:
+        VER, NETVER, HELP, STARTTLS, USERNAME, PASSWORD, LOGIN, LOGOUT,
+        MASTER, PRIMARY, FSD, LIST UPS, LIST VAR, LIST RW, LIST CMD,
+        LIST ENUM, LIST RANGE, LIST CLIENT, GET VAR, GET TYPE, GET DESC,
+        GET UPSDESC, GET NUMLOGINS
+
+    Values are read only.  PRIMARY/MASTER and FSD require the configured
+    password and are refused if no password is configured.  As in upsd, FSD
+    is latched until the server is restarted.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import re
+import shlex
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Tuple, Set, Optional, Iterable, Any
+from UPSmodules import __version__
+from UPSmodules.UPSKeys import MiB, UpsType
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+NETVER = '1.3'
+VERSION = 'Network UPS Tools upsd compatible ups-utils {}'.format(__version__)
+
+# MiBs mapped to NUT variable names: variable name, scale, description
+NUT_VARS: Dict[MiB, Tuple[str, float, str]] = {
+    MiB.battery_capacity: ('battery.charge', 1.0, 'Battery charge (percent of full)'),
+    MiB.battery_runtime_remain: ('battery.runtime', 60.0, 'Battery runtime (seconds)'),
+    MiB.battery_temperature: ('battery.temperature', 1.0, 'Battery temperature (degrees C)'),
+    MiB.ups_env_temp: ('ambient.temperature', 1.0, 'Ambient temperature (degrees C)'),
+    MiB.system_temperature: ('ups.temperature', 1.0, 'UPS temperature (degrees C)'),
+    MiB.input_voltage: ('input.voltage', 1.0, 'Input voltage (V)'),
+    MiB.input_frequency: ('input.frequency', 1.0, 'Input line frequency (Hz)'),
+    MiB.output_voltage: ('output.voltage', 1.0, 'Output voltage (V)'),
+    MiB.output_frequency: ('output.frequency', 1.0, 'Output frequency (Hz)'),
+    MiB.output_current: ('output.current', 1.0, 'Output current (A)'),
+    MiB.output_load: ('ups.load', 1.0, 'Load on UPS (percent of full)'),
+    MiB.output_power: ('ups.realpower', 1.0, 'Current value of real power (W)'),
+    MiB.ups_model: ('ups.model', 0.0, 'UPS model'),
+    MiB.ups_name: ('ups.id', 0.0, 'UPS system identifier'),
+    MiB.ups_location: ('device.location', 0.0, 'Device physical location'),
+    MiB.ups_contact: ('device.contact', 0.0, 'Device administrator name'),
+    MiB.bios_serial_number: ('ups.serial', 0.0, 'UPS serial number'),
+    MiB.firmware_revision: ('ups.firmware', 0.0, 'UPS firmware'),
+    MiB.ups_manufacture_date: ('ups.mfr.date', 0.0, 'UPS manufacturing date'),
+    MiB.last_self_test_result: ('ups.test.result', 0.0, 'Results of last self test'),
+    MiB.last_self_test_date: ('ups.test.date', 0.0, 'Date of last self test'),
+    MiB.reason_for_last_transfer: ('input.transfer.reason', 0.0, 'Reason for last transfer to battery')}
+
+MANUFACTURERS: Dict[UpsType, str] = {UpsType.apc_ap96xx: 'APC', UpsType.eaton_pw: 'EATON'}
+
+FIXED_DESCRIPTIONS: Dict[str, str] = {
+    'ups.status': 'UPS status',
+    'ups.mfr': 'UPS manufacturer',
+    'device.mfr': 'Device manufacturer',
+    'device.model': 'Device model',
+    'device.type': 'Device type (ups, pdu, scd, psu, ats)',
+    'driver.name': 'Driver name',
+    'driver.version': 'Driver version - NUT release'}
+
+DESCRIPTIONS: Dict[str, str] = {**{name: desc for name, _, desc in NUT_VARS.values()}, **FIXED_DESCRIPTIONS}
+
+NUMBER_VARS: Set[str] = {name for name, scale, _ in NUT_VARS.values() if scale}
+
+HELP = 'Commands: HELP VER GET LIST SET INSTCMD LOGIN LOGOUT USERNAME PASSWORD STARTTLS'
+
+
+def nut_name(display_name: str) -> str:
+    """ Convert a display name to a valid NUT UPS name.
+
+    :param display_name: The display name of the UPS.
+    :return: Name with characters not allowed by NUT replaced by underscore.
+    """
+    return re.sub(r'[^A-Za-z0-9_.-]', '_', display_name.strip()) or 'ups'
+
+
+def _quote(value: Any) -> str:
+    return '"{}"'.format(str(value).replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def _number(value: Any, scale: float) -> Optional[str]:
+    try:
+        value = float(value) * scale
+    except (TypeError, ValueError):
+        return None
+    return str(int(value)) if value.is_integer() else str(round(value, 2))
+
+
+def ups_status(prm: Any) -> str:
+    """ Build the NUT ups.status value from the system status, battery status, and time on battery.
+
+    :param prm: UpsItem parameters.
+    :return: Space separated NUT status flags.
+    """
+    system_status = str(prm.get(MiB.system_status) or '')
+    flags = set(system_status.split('-'))
+    on_battery = bool(flags & {'OnBattery', 'Battery'})
+    if not on_battery and not flags & {'OnLine', 'Line', 'Power On', 'ECO', 'Converter'}:
+        on_battery = (_number(prm.get(MiB.time_on_battery), 1.0) or '0') != '0'
+    status = ['OB' if on_battery else 'OL']
+    battery_status = str(prm.get(MiB.battery_status) or '')
+    if 'LowBattery' in flags or battery_status in {'Battery Low', 'Battery Depleted'}:
+        status.append('LB')
+    elif not on_battery and (_number(prm.get(MiB.battery_capacity), 1.0) or '100') != '100':
+        status.append('CHRG')
+    if on_battery: status.append('DISCHRG')
+    if flags & {'ReplaceBattery'} or prm.get(MiB.battery_replace) == 'Replacement Required' or \
+            battery_status in {'Battery in Fault Condition', 'Battery Failure'}:
+        status.append('RB')
+    if 'OverLoad' in flags: status.append('OVER')
+    if flags & {'AVR_Boost'}: status.append('BOOST')
+    if flags & {'AVR_Trim'}: status.append('TRIM')
+    if flags & {'Bypass', 'ManualBypass', 'SoftwareBypass'}: status.append('BYPASS')
+    if flags & {'SelfTestInProgress', 'Battery Test'}: status.append('CAL')
+    return ' '.join(status)
+
+
+def ups_variables(prm: Any) -> Dict[str, str]:
+    """ Map the values of a UPS to NUT variables.
+
+    :param prm: UpsItem parameters.
+    :return: Dictionary of NUT variable values by NUT variable name.
+    """
+    ups_type = prm.get('ups_type')
+    manufacturer = MANUFACTURERS.get(ups_type, 'unknown')
+    if ups_type == UpsType.rfc1628 and prm.get(MiB.ups_manufacturer) not in {None, '', '---', 'No data'}:
+        # The UPS-MIB identifies the manufacturer of the UPS.
+        manufacturer = str(prm.get(MiB.ups_manufacturer))
+    variables = {'device.type': 'ups', 'device.mfr': manufacturer, 'ups.mfr': manufacturer,
+                 'driver.name': 'ups-utils', 'driver.version': __version__,
+                 'ups.status': ups_status(prm)}
+    for mib, (name, scale, _) in NUT_VARS.items():
+        value = prm.get(mib)
+        if value in {None, '', '---', 'No data', 'Invalid UPS'}: continue
+        value = _number(value, scale) if scale else str(value).strip()
+        if value is not None: variables[name] = value
+    if 'ups.model' in variables: variables['device.model'] = variables['ups.model']
+    return variables
+
+
+class NutServer:
+    """ upsd protocol server of the latest values published by the poller service.
+    """
+    def __init__(self, address: str = '127.0.0.1:3493', password: Optional[str] = None):
+        """
+        :param address: Listen address as [HOST:]PORT.  The default host is localhost.
+        :param password: Password required for PRIMARY/MASTER and FSD, refused if None.
+        """
+        host, _, port = address.rpartition(':')
+        self.address: Tuple[str, int] = (host.strip('[]') or '127.0.0.1', int(port))
+        self.password: Optional[str] = password
+        self._variables: Dict[str, Dict[str, str]] = {}
+        self._responses: Dict[Optional[str], bytes] = {None: self._render_ups_list({})}
+        self._descriptions: Dict[str, str] = {}
+        self._stale: Set[str] = set()
+        self._fsd: Set[str] = set()
+        # Serializes state changes of the poll thread and the event loop thread.  Readers use
+        # the published dicts without the lock, since they are replaced and never changed.
+        self._lock = threading.Lock()
+        self._clients: Dict[str, Dict[int, str]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def __repr__(self) -> str:
+        return 'NutServer: {}:{}'.format(*self.address)
+
+    @staticmethod
+    def _render_ups_list(descriptions: Dict[str, str]) -> bytes:
+        lines = ['BEGIN LIST UPS']
+        lines.extend('UPS {} {}'.format(name, _quote(desc)) for name, desc in descriptions.items())
+        lines.append('END LIST UPS')
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _render_var_list(name: str, variables: Dict[str, str]) -> bytes:
+        lines = ['BEGIN LIST VAR {}'.format(name)]
+        lines.extend('VAR {} {} {}'.format(name, var, _quote(value)) for var, value in sorted(variables.items()))
+        lines.append('END LIST VAR {}'.format(name))
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def update(self, upss: Iterable[Any], stats: Dict[str, float]) -> None:  # pylint: disable=unused-argument
+        """ Map and render the variables of the latest values.
+
+        :param upss: Iterable of UpsItem objects.
+        :param stats: Poll statistics of the service.
+        """
+        variables: Dict[str, Dict[str, str]] = {}
+        descriptions: Dict[str, str] = {}
+        stale: Set[str] = set()
+        for ups in upss:
+            prm = ups.prm
+            name = nut_name(prm.display_name)
+            descriptions[name] = '{} {}'.format(prm.display_name, prm.get('ups_IP') or '').strip()
+            if not prm.get('responsive'):
+                stale.add(name)
+            variables[name] = ups_variables(prm)
+        with self._lock:
+            # Forced shutdown is latched, as in upsd, until the server is restarted.
+            for name in self._fsd & variables.keys():
+                variables[name]['ups.status'] = 'FSD ' + variables[name]['ups.status']
+            responses: Dict[Optional[str], bytes] = {None: self._render_ups_list(descriptions)}
+            for name, values in variables.items():
+                responses[name] = self._render_var_list(name, values)
+            self._variables, self._descriptions, self._stale, self._responses = \
+                variables, descriptions, stale, responses
+
+    def start(self) -> None:
+        """ Start serving in a background thread.
+
+        :raises OSError: If the address can not be bound.
+        """
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, *self.address))
+        except OSError:
+            self._loop.close()
+            self._loop = None
+            raise
+        self.address = self._server.sockets[0].getsockname()[:2]
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        LOGGER.debug('Started %s', self)
+
+    def stop(self) -> None:
+        """ Stop serving and close all connections.
+        """
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Handle requests from one client connection until it closes or logs out.
+        """
+        peer = writer.get_extra_info('peername')
+        session: Dict[str, Any] = {'peer': peer[0] if peer else 'unknown', 'username': None,
+                                   'password': None, 'ups': None, 'primary': False}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line: break
+                response, close = self.respond(line.decode('utf-8', errors='replace'), session)
+                if response:
+                    writer.write(response)
+                    await writer.drain()
+                if close: break
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError) as error:
+            LOGGER.debug('nut client %s: %s', session['peer'], error)
+        finally:
+            if session['ups']:
+                self._clients.get(session['ups'], {}).pop(id(session), None)
+            writer.close()
+
+    def respond(self, line: str, session: Dict[str, Any]) -> Tuple[bytes, bool]:
+        """ Get the response to a request line.
+
+        :param line: Request line.
+        :param session: State of the client connection.
+        :return: Tuple of the encoded response and True if the connection should be closed.
+        """
+        try:
+            args = shlex.split(line)
+        except ValueError:
+            return b'ERR INVALID-ARGUMENT\n', False
+        if not args: return b'', False
+        command = args[0].upper()
+        if command == 'LOGOUT':
+            return b'OK Goodbye\n', True
+        if command in {'LIST', 'GET'}:
+            response = self._query(command, [args[1].upper()] + args[2:] if len(args) > 1 else [])
+        elif command == 'VER':
+            response = VERSION
+        elif command == 'NETVER':
+            response = NETVER
+        elif command == 'HELP':
+            response = HELP
+        elif command == 'STARTTLS':
+            response = 'ERR FEATURE-NOT-CONFIGURED'
+        elif command in {'SET', 'INSTCMD'}:
+            response = 'ERR CMD-NOT-SUPPORTED'
+        else:
+            response = self._session_command(command, args[1:], session)
+        return response if isinstance(response, bytes) else (response + '\n').encode('utf-8'), False
+
+    def _session_command(self, command: str, args: List[str], session: Dict[str, Any]) -> str:
+        """ Handle the authentication and attachment commands.
+        """
+        if command in {'USERNAME', 'PASSWORD'}:
+            if len(args) != 1: return 'ERR INVALID-ARGUMENT'
+            key = command.lower()
+            if session[key] is not None: return 'ERR ALREADY-SET-{}'.format(command)
+            session[key] = args[0]
+            return 'OK'
+        if command not in {'LOGIN', 'MASTER', 'PRIMARY', 'FSD'}:
+            return 'ERR UNKNOWN-COMMAND'
+        if len(args) != 1: return 'ERR INVALID-ARGUMENT'
+        name = args[0]
+        if name not in self._variables: return 'ERR UNKNOWN-UPS'
+        if session['username'] is None: return 'ERR USERNAME-REQUIRED'
+        if session['password'] is None: return 'ERR PASSWORD-REQUIRED'
+        if command == 'LOGIN':
+            if session['ups']: return 'ERR ALREADY-LOGGED-IN'
+            session['ups'] = name
+            self._clients.setdefault(name, {})[id(session)] = session['peer']
+            return 'OK'
+        if self.password is None or session['password'] != self.password:
+            return 'ERR ACCESS-DENIED'
+        if command in {'MASTER', 'PRIMARY'}:
+            session['primary'] = True
+            return 'OK {}-GRANTED'.format(command)
+        if not session['primary']: return 'ERR ACCESS-DENIED'
+        with self._lock:
+            self._fsd.add(name)
+            variables = self._variables.get(name)
+            if variables is not None and not variables['ups.status'].startswith('FSD'):
+                # Copy on write, so the dicts published by update are never changed.
+                variables = {**variables, 'ups.status': 'FSD ' + variables['ups.status']}
+                self._variables = {**self._variables, name: variables}
+                self._responses = {**self._responses, name: self._render_var_list(name, variables)}
+        LOGGER.debug('FSD set on %s by %s', name, session['peer'])
+        return 'OK FSD-SET'
+
+    def _query(self, command: str, args: List[str]) -> Any:
+        """ Handle LIST and GET requests.
+        """
+        if not args: return 'ERR INVALID-ARGUMENT'
+        sub_command = args[0]
+        if command == 'LIST' and sub_command == 'UPS':
+            return self._responses[None]
+        if len(args) < 2: return 'ERR INVALID-ARGUMENT'
+        name = args[1]
+        variables = self._variables.get(name)
+        if variables is None: return 'ERR UNKNOWN-UPS'
+        if command == 'LIST':
+            if sub_command == 'VAR':
+                if name in self._stale: return 'ERR DATA-STALE'
+                return self._responses[name]
+            if sub_command in {'RW', 'CMD', 'CLIENT'}:
+                items = ['CLIENT {} {}'.format(name, peer) for peer in self._clients.get(name, {}).values()] \
+                    if sub_command == 'CLIENT' else []
+                return '\n'.join(['BEGIN LIST {} {}'.format(sub_command, name), *items,
+                                  'END LIST {} {}'.format(sub_command, name)])
+            if sub_command in {'ENUM', 'RANGE'}:
+                if len(args) < 3: return 'ERR INVALID-ARGUMENT'
+                return 'BEGIN LIST {0} {1} {2}\nEND LIST {0} {1} {2}'.format(sub_command, name, args[2])
+            return 'ERR INVALID-ARGUMENT'
+        if sub_command == 'UPSDESC':
+            return 'UPSDESC {} {}'.format(name, _quote(self._descriptions.get(name, 'Unavailable')))
+        if sub_command == 'NUMLOGINS':
+            return 'NUMLOGINS {} {}'.format(name, len(self._clients.get(name, {})))
+        if len(args) < 3 or sub_command not in {'VAR', 'TYPE', 'DESC'}: return 'ERR INVALID-ARGUMENT'
+        var = args[2]
+        if sub_command == 'DESC':
+            return 'DESC {} {} {}'.format(name, var, _quote(DESCRIPTIONS.get(var, 'Description unavailable')))
+        if var not in variables: return 'ERR VAR-NOT-SUPPORTED'
+        if sub_command == 'TYPE':
+            return 'TYPE {} {} {}'.format(name, var, 'NUMBER' if var in NUMBER_VARS else
+                                          'STRING:{}'.format(max(len(variables[var]), 1)))
+        if name in self._stale: return 'ERR DATA-STALE'
+        return 'VAR {} {} {}'.format(name, var, _quote(variables[var]))
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+""" UPSpath  -  hedged snmp requests over the management addresses of a UPS
+
+    A UPS with dual network management cards, or more than one reachable
+    management address, has a path for each address, given as a list in the
+    ups_IP value of ups-config.json.  Each path tracks its own health: an
+    adaptive timeout from its round trip time, a circuit breaker, and its
+    recent response times.  A request is sent on the first path, and if
+    there is no reply within the 95th percentile response time of that path,
+    the request is also sent on the next path, if the rate limit of that card
+    allows it at once.  The first valid answer wins and the other requests
+    are stopped.  A path which fails is followed by the next one immediately,
+    and a path which loses the race after its own hedge delay counts as a
+    failure of that path.  Open paths are probed first when their probe is
+    due, so a card which recovers is used again.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import logging
+import selectors
+import subprocess
+from collections import deque
+from time import monotonic
+from typing import Callable, Deque, Dict, List, Tuple, Optional, Iterable, Union
+from UPSmodules.UPSrto import RtoEstimator
+from UPSmodules.UPSbreaker import CircuitBreaker
+from UPSmodules.UPSrate import TokenBucket
+from UPSmodules.UPSdns import DNS_CACHE, snmp_target
+from UPSmodules.UPSsnmpv3 import EngineState
+
+LOGGER = logging.getLogger('ups-utils')
+
+# Options of the net-snmp tools followed by a secret.
+SECRET_OPTIONS = frozenset(('-c', '-A', '-X', '-3k', '-3K', '-3m', '-3M'))
+
+
+def redact(args: List[str]) -> List[str]:
+    """ Get command arguments with the values of secret options replaced, so they can be logged.
+
+    :param args: Command arguments.
+    :return: Arguments safe to log.
+    """
+    return ['***' if index and args[index - 1] in SECRET_OPTIONS else arg for index, arg in enumerate(args)]
+
+
+def address_list(ups_ip: Union[str, Iterable[str], None]) -> List[str]:
+    """ Get the list of management addresses from an ups_IP value.
+
+    :param ups_ip: An address, a list of addresses, or a comma separated string of addresses.
+    :return: List of addresses, primary first.
+    """
+    if not ups_ip: return []
+    items = ups_ip.split(',') if isinstance(ups_ip, str) else ups_ip
+    return [str(item).strip() for item in items if str(item).strip()]
+
+
+class NmcPath:
+    """ One management address of a UPS and the health of requests sent to it.
+    """
+    history_size: int = 64
+    min_samples: int = 10
+    # Longest wait before the request is also sent on the next path.
+    max_hedge_delay: float = 1.0
+
+    def __init__(self, address: str, ups_name: str = 'ups', bucket: Optional[TokenBucket] = None):
+        """
+        :param address: IP address or FQDN of the network management card.
+        :param ups_name: Name of the UPS, used in messages.
+        :param bucket: Rate limit of requests to the card, default limit if None.
+        """
+        self.address: str = address
+        self.bucket: TokenBucket = bucket or TokenBucket()
+        self.rto: RtoEstimator = RtoEstimator()
+        self.breaker: CircuitBreaker = CircuitBreaker('{} at {}'.format(ups_name, address))
+        self.latencies: Deque[float] = deque(maxlen=self.history_size)
+        self.hedged: int = 0
+        self.wins: int = 0
+        # SNMPv3 engine of the card, discovered on the first SNMPv3 request.
+        self.engine: Optional[EngineState] = None
+
+    def __repr__(self) -> str:
+        return 'NmcPath {}: {}, p95 {:.3f}s, {}'.format(self.address, self.breaker.state.name, self.p95(), self.rto)
+
+    def target(self) -> Optional[str]:
+        """ Get the agent argument of snmp requests, with the address resolved from the DNS cache.
+
+        :return: The agent argument, or None if the address does not resolve.
+        """
+        address = DNS_CACHE.resolve(self.address)
+        return snmp_target(address) if address else None
+
+    def p95(self) -> float:
+        """ Get the 95th percentile of recent response times, or the timeout before enough samples.
+
+        :return: Time in seconds.
+        """
+        if len(self.latencies) < self.min_samples: return self.rto.rto
+        ordered = sorted(self.latencies)
+        return ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)]
+
+    def hedge_delay(self) -> float:
+        """ Get the time to wait for a reply before the request is also sent on the next path.
+        """
+        return min(self.p95(), self.max_hedge_delay)
+
+    def record(self, success: bool, seconds: float, timeout: float) -> None:
+        """ Record the outcome of a request sent on this path.
+
+        :param success: True if the request was answered.
+        :param seconds: Time from start to completion of the request.
+        :param timeout: Timeout used for the request.
+        """
+        if success:
+            self.rto.sample(seconds, timeout)
+            if seconds <= timeout: self.latencies.append(seconds)
+        else:
+            self.rto.backoff()
+            # The card may have rebooted, so its SNMPv3 engine is discovered again.
+            if self.engine: self.engine.stale = True
+        self.breaker.record(success)
+
+
+def hedged_request(paths: List[NmcPath],
+                   command: Callable[[NmcPath], Tuple[List[str], float, Optional[Dict[str, str]]]],
+                   force: bool = False) -> Optional[Tuple[NmcPath, str]]:
+    """ Run a command on the paths of a UPS, hedging slow paths with the next path.
+
+    :param paths: Paths of the UPS, primary first.
+    :param command: Function giving the command arguments, timeout, and environment, or None to
+        inherit it, for a path.
+    :param force: If True, open paths are probed even if their probe is not yet due.
+    :return: Tuple of the winning path and the command output, or None if no path answered.
+    """
+    # Paths due for a probe first, then healthy paths, in configuration order.
+    pending = sorted(paths, key=lambda path: 0 if path.breaker.probe_due() else 1 if path.breaker.is_closed() else 2)
+    selector = selectors.DefaultSelector()
+    running: Dict[int, Tuple[NmcPath, subprocess.Popen, float, float, List[bytes]]] = {}
+
+    def launch(blocking: bool = True) -> Optional[NmcPath]:
+        # A hedged request is only sent if the rate limit of the card allows it now.
+        while pending:
+            path = pending.pop(0)
+            if not blocking and not path.bucket.try_acquire(): continue
+            if not path.breaker.allow(force=force): continue
+            if not path.target():
+                LOGGER.debug('%s: address not resolved', path)
+                path.breaker.record(False)
+                continue
+            if blocking: path.bucket.acquire()
+            args: List[str] = []
+            try:
+                args, timeout, env = command(path)
+                process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+            except OSError as error:
+                LOGGER.debug('Error executing %s: %s', redact(args), error)
+                path.breaker.record(False)
+                continue
+            running[process.stdout.fileno()] = (path, process, monotonic(), timeout, [])
+            selector.register(process.stdout, selectors.EVENT_READ)
+            return path
+        return None
+
+    winner: Optional[Tuple[NmcPath, str]] = None
+    path = launch()
+    hedge_time = monotonic() + path.hedge_delay() if path else 0.0
+    try:
+        while running and not winner:
+            wait = max(hedge_time - monotonic(), 0.0) if pending else None
+            events = selector.select(wait)
+            if not events:
+                # No reply within the hedge delay, so also send on the next path.
+                path = launch(blocking=False)
+                if path:
+                    path.hedged += 1
+                    hedge_time = monotonic() + path.hedge_delay()
+                continue
+            for key, _ in events:
+                data = os.read(key.fd, 65536)
+                path, process, start_time, timeout, chunks = running[key.fd]
+                if data:
+                    chunks.append(data)
+                    continue
+                selector.unregister(key.fileobj)
+                del running[key.fd]
+                process.wait()
+                key.fileobj.close()
+                success = process.returncode == 0
+                path.record(success, monotonic() - start_time, timeout)
+                if success:
+                    path.wins += 1
+                    winner = (path, b''.join(chunks).decode())
+                    break
+                if not running:
+                    # The path failed before the hedge delay, so try the next path now.
+                    path = launch()
+                    if path: hedge_time = monotonic() + path.hedge_delay()
+    finally:
+        for path, process, start_time, _, _ in running.values():
+            process.kill()
+            process.wait()
+            process.stdout.close()
+            # A path which lost the race after its own hedge delay was too slow, so consecutive
+            # losses open its breaker and the next path is tried first until it is probed.
+            if monotonic() - start_time >= path.hedge_delay() or not path.breaker.is_closed():
+                path.breaker.record(False)
+        selector.close()
+    return winner
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+""" UPSpredict  -  streaming runtime to empty predictor for ups-daemon
+
+    The runtime remaining reported by the network management card reacts
+    slowly to changes in load.  The predictor fits battery capacity against
+    the integral of load over time with an exponentially weighted regression,
+    so the discharge rate found is per unit of load and applies immediately
+    when load changes.  This estimate is combined with the reported runtime,
+    scaled for the change in load, by inverse variance weighting to give a
+    predicted time to empty with a confidence band.  Until the fit gives a
+    drain rate, the prediction is the scaled reported runtime with no band,
+    so thresholds are compared to the runtime reported by the UPS.  All state is a fixed
+    number of weighted sums, updated in constant time for each sample.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import math
+import logging
+from time import monotonic
+from typing import NamedTuple, Optional, Tuple
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+class Prediction(NamedTuple):
+    """ Predicted time to empty in minutes with the lower and upper bounds of the confidence band.
+    """
+    runtime: float
+    low: float
+    high: float
+    samples: int
+
+
+class RuntimePredictor:
+    """ Exponentially weighted regression of battery capacity on cumulative load.
+
+        The regression variable x is the integral of load over time in %-minutes, so the
+        slope is the capacity used per %-minute and the drain rate at the present load is
+        -slope * load.  Sums are kept relative to the latest sample, so old samples only need
+        to be shifted and decayed, never stored.
+    """
+    # Relative standard error assumed for the reported runtime at constant load.
+    vendor_error: float = 0.10
+    # Variance of capacity readings reported as integer percent.
+    quantization_var: float = 1.0 / 12.0
+    min_samples: int = 3
+
+    def __init__(self, time_constant: float = 120.0, sigma: float = 2.0, reserve: float = 0.0):
+        """
+        :param time_constant: Time constant in seconds of the exponential weighting.
+        :param sigma: Width of the confidence band in standard deviations.
+        :param reserve: Battery capacity in percent treated as empty.
+        """
+        self.time_constant: float = time_constant / 60.0
+        self.sigma: float = sigma
+        self.reserve: float = reserve
+        self._last_time: Optional[float] = None
+        self._last_load: float = 0.0
+        self._samples: int = 0
+        self._s0 = self._sx = self._sc = self._sxx = self._sxc = self._scc = self._sw2 = 0.0
+        self._load_fast: float = 0.0
+        self._load_slow: float = 0.0
+        self._capacity: float = 0.0
+        self._runtime: float = 0.0
+
+    def __repr__(self) -> str:
+        return 'RuntimePredictor: {} samples, time constant {}s'.format(self._samples, self.time_constant * 60.0)
+
+    def set_parameters(self, time_constant: float, sigma: float) -> None:
+        """ Change the weighting and band width, keeping the samples already fitted.
+
+        :param time_constant: Time constant in seconds of the exponential weighting.
+        :param sigma: Width of the confidence band in standard deviations.
+        """
+        self.time_constant = time_constant / 60.0
+        self.sigma = sigma
+
+    def reset(self) -> None:
+        """ Discard all state, typically when line power returns.
+        """
+        self._last_time = None
+        self._samples = 0
+        self._s0 = self._sx = self._sc = self._sxx = self._sxc = self._scc = self._sw2 = 0.0
+
+    def update(self, capacity: float, load: float, runtime: float, timestamp: Optional[float] = None) -> None:
+        """ Add one sample taken while on battery.
+
+        :param capacity: Battery capacity in percent.
+        :param load: Output load in percent.
+        :param runtime: Runtime remaining reported by the UPS in minutes.
+        :param timestamp: Monotonic time of the sample in seconds, defaults to now.
+        """
+        now = (monotonic() if timestamp is None else timestamp) / 60.0
+        if self._last_time is None:
+            self._load_fast = self._load_slow = load
+        else:
+            delta_t = max(now - self._last_time, 0.0)
+            # Shift the origin of x to the new sample, then decay the old weights.
+            delta_x = 0.5 * (load + self._last_load) * delta_t
+            self._sxx += delta_x * (delta_x * self._s0 - 2.0 * self._sx)
+            self._sxc -= delta_x * self._sc
+            self._sx -= delta_x * self._s0
+            decay = math.exp(-delta_t / self.time_constant) if self.time_constant > 0 else 0.0
+            self._s0 *= decay
+            self._sx *= decay
+            self._sc *= decay
+            self._sxx *= decay
+            self._sxc *= decay
+            self._scc *= decay
+            self._sw2 *= decay * decay
+            self._load_fast += (1.0 - decay) * (load - self._load_fast)
+            self._load_slow += (1.0 - decay ** 0.2) * (load - self._load_slow)
+        # New sample at x = 0 with unit weight
+        self._s0 += 1.0
+        self._sc += capacity
+        self._scc += capacity * capacity
+        self._sw2 += 1.0
+        self._last_time = now
+        self._last_load = load
+        self._capacity = capacity
+        self._runtime = runtime
+        self._samples += 1
+
+    def _slope_estimate(self, load: float) -> Optional[Tuple[float, float]]:
+        """ Time to empty from the fitted drain rate and its standard deviation.
+
+        :param load: Present load in percent.
+        :return: Tuple of runtime and standard deviation, or None if not enough data.
+        """
+        if self._samples < self.min_samples or self._s0 <= 0.0 or load <= 0.0: return None
+        sxx = self._sxx - self._sx * self._sx / self._s0
+        if sxx <= 0.0: return None
+        sxc = self._sxc - self._sx * self._sc / self._s0
+        slope = sxc / sxx
+        if slope >= 0.0: return None
+        intercept = (self._sc - slope * self._sx) / self._s0
+        n_eff = self._s0 * self._s0 / self._sw2
+        ssr = max(self._scc - self._sc * self._sc / self._s0 - slope * sxc, 0.0)
+        resid_var = max(ssr / (n_eff - 2.0), self.quantization_var) if n_eff > 2.0 else self.quantization_var
+        slope_sd = math.sqrt(resid_var / sxx)
+        runtime = max(intercept - self.reserve, 0.0) / (-slope * load)
+        return runtime, runtime * slope_sd / -slope
+
+    def predict(self) -> Optional[Prediction]:
+        """ Predict time to empty at the present load.
+
+        :return: Prediction or None if no samples.
+        """
+        if self._last_time is None: return None
+        load = max(self._load_fast, self._last_load)
+        # The reported runtime reflects a slowly averaged load, so scale it to the present load.
+        ratio = self._load_slow / load if load > 0.0 else 1.0
+        vendor = self._runtime * ratio
+        vendor_sd = max(vendor * (self.vendor_error + abs(1.0 - ratio)), 0.1)
+        estimates = [(vendor, vendor_sd)]
+        slope_estimate = self._slope_estimate(load)
+        if not slope_estimate or slope_estimate[1] <= 0.0:
+            # The error of the reported runtime is assumed, not measured, so it gives no band.
+            return Prediction(vendor, vendor, vendor, self._samples)
+        estimates.append(slope_estimate)
+        weights = [1.0 / (sd * sd) for _, sd in estimates]
+        runtime = sum(weight * value for weight, (value, _) in zip(weights, estimates)) / sum(weights)
+        band = self.sigma * math.sqrt(1.0 / sum(weights))
+        LOGGER.debug('Runtime estimates (min, sd): %s, fused: %.2f +/- %.2f', estimates, runtime, band)
+        return Prediction(runtime, max(runtime - band, 0.0), runtime + band, self._samples)
@@ -0,0 +1,511 @@
+#!/usr/bin/env python3
+""" UPSprofiles  -  MiB profiles of each UPS type and detection of the type of a UPS
+
+    Each UpsType has a profile of the OIDs, names, and decoders of its MiB
+    commands.  Profiles are built by their builder function on first use, so
+    only the profiles of the UPS types in use are built.  The rfc1628 profile
+    uses only the standard UPS-MIB, iso.3.6.1.2.1.33, and works for any UPS
+    whose management card implements it.
+
+    A UPS configured with a ups_type of auto, or without a ups_type, has its
+    type detected from its sysObjectID and sysDescr: the enterprise number of
+    the vendor selects a vendor profile, and a UPS which answers the UPS-MIB
+    otherwise gets the rfc1628 profile.  Detected types are cached by address
+    in the user runtime directory, so detection runs once per UPS.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import re
+import stat
+import json
+import tempfile
+import logging
+import threading
+from time import time
+from collections.abc import Mapping
+from typing import Callable, Dict, Iterator, Tuple, Optional, Pattern, Union
+from UPSmodules.UPSKeys import UpsType, MiB
+from UPSmodules.UPSshm import runtime_file
+
+LOGGER = logging.getLogger('ups-utils')
+
+Profile = Dict[MiB, Dict[str, Union[str, Dict[str, str], None]]]
+
+AUTO_TYPE = 'auto'
+SYS_DESCR_OID = 'iso.3.6.1.2.1.1.1.0'
+SYS_OBJECT_ID_OID = 'iso.3.6.1.2.1.1.2.0'
+# upsIdentManufacturer, answered by any UPS-MIB agent
+UPS_MIB_PROBE_OID = 'iso.3.6.1.2.1.33.1.1.1.0'
+
+# Vendor profiles by enterprise OID prefix of the sysObjectID, then by sysDescr
+VENDOR_OBJECT_IDS: Tuple[Tuple[str, UpsType], ...] = (
+    ('1.3.6.1.4.1.318.', UpsType.apc_ap96xx),
+    ('1.3.6.1.4.1.935.', UpsType.eaton_pw))
+VENDOR_DESCRIPTIONS: Tuple[Tuple[Pattern, UpsType], ...] = (
+    (re.compile(r'APC Web/SNMP|\bAP96\d\d\b', re.IGNORECASE), UpsType.apc_ap96xx),)
+
+
+def apc_ap96xx_profile() -> Profile:
+    """ MiBs for APC UPS with AP96xx NMC """
+    return {
+        MiB.ups_info: {'iso': 'iso.3.6.1.2.1.1.1.0',
+                       'name': 'General UPS Information',
+                       'decode': None},
+        MiB.bios_serial_number: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.3.0',
+                                 'name': 'UPS BIOS Serial Number',
+                                 'decode': None},
+        MiB.firmware_revision: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.1.0',
+                                'name': 'UPS Firmware Revision',
+                                'decode': None},
+        MiB.ups_type: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.1.1.0',
+                       'name': 'UPS Model Type',
+                       'decode': None},
+        MiB.ups_model: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.5.0',
+                        'name': 'UPS Model Number',
+                        'decode': None},
+        MiB.ups_contact: {'iso': 'iso.3.6.1.2.1.1.4.0',
+                          'name': 'UPS Contact',
+                          'decode': None},
+        MiB.ups_env_temp: {'iso': 'iso.3.6.1.4.1.318.1.1.25.1.2.1.6.1.1',
+                           'name': 'UPS Environment Temp',
+                           'decode': None},
+        MiB.ups_location: {'iso': 'iso.3.6.1.2.1.1.6.0',
+                           'name': 'UPS Location',
+                           'decode': None},
+        MiB.ups_uptime: {'iso': 'iso.3.6.1.2.1.1.3.0',
+                         'name': 'UPS Up Time',
+                         'decode': None},
+        MiB.ups_manufacture_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.2.0',
+                                   'name': 'UPS Manufacture Date',
+                                   'decode': None},
+        MiB.ups_name: {'iso': 'iso.3.6.1.2.1.33.1.1.5.0',
+                       'name': 'UPS Name',
+                       'decode': None},
+        MiB.battery_capacity: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.1.0',
+                               'name': 'Percentage of Total Capacity',
+                               'decode': None},
+        MiB.battery_temperature: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.2.0',
+                                  'name': 'Battery Temperature in C',
+                                  'decode': None},
+        MiB.system_status: {'iso': 'iso.3.6.1.4.1.318.1.1.1.11.1.1.0',
+                            'name': 'UPS System Status',
+                            'decode': None},
+        MiB.battery_status: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.1.1.0',
+                             'name': 'Battery Status',
+                             'decode': {'1': 'Unknown',
+                                        '2': 'Battery Normal',
+                                        '3': 'Battery Low',
+                                        '4': 'Battery in Fault Condition'}},
+        MiB.time_on_battery: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.1.2.0',
+                              'name': 'Time on Battery',
+                              'decode': None},
+        MiB.battery_runtime_remain: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.3.0',
+                                     'name': 'Runtime Remaining',
+                                     'decode': None},
+        MiB.battery_replace: {'iso': 'iso.3.6.1.4.1.318.1.1.1.2.2.4.0',
+                              'name': 'Battery Replacement',
+                              'decode': {'1': 'OK',
+                                         '2': 'Replacement Required'}},
+        MiB.input_voltage: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.1.0',
+                            'name': 'Input Voltage',
+                            'decode': None},
+        MiB.input_frequency: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.4.0',
+                              'name': 'Input Frequency Hz',
+                              'decode': None},
+        MiB.reason_for_last_transfer: {'iso': 'iso.3.6.1.4.1.318.1.1.1.3.2.5.0',
+                                       'name': 'Last Transfer Event',
+                                       'decode': {'1': 'No Transfer',
+                                                  '2': 'High Line Voltage',
+                                                  '3': 'Brownout',
+                                                  '4': 'Loss of Main Power',
+                                                  '5': 'Small Temp Power Drop',
+                                                  '6': 'Large Temp Power Drop',
+                                                  '7': 'Small Spike',
+                                                  '8': 'Large Spike',
+                                                  '9': 'UPS Self Test',
+                                                  '10': 'Excessive Input V Fluctuation'}},
+        MiB.output_voltage: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.1.0',
+                             'name': 'Output Voltage',
+                             'decode': None},
+        MiB.output_frequency: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.2.0',
+                               'name': 'Output Frequency Hz',
+                               'decode': None},
+        MiB.output_load: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.3.0',
+                          'name': 'Output Load as % of Capacity',
+                          'decode': None},
+        MiB.output_power: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.8.0',
+                           'name': 'Output Power in W',
+                           'decode': None},
+        MiB.output_current: {'iso': 'iso.3.6.1.4.1.318.1.1.1.4.2.4.0',
+                             'name': 'Output Current in Amps',
+                             'decode': None},
+        MiB.comms: {'iso': 'iso.3.6.1.4.1.318.1.1.1.8.1.0',
+                    'name': 'Communicating with UPS Device',
+                    'decode': {'1': 'Communication OK',
+                               '2': 'Communication Error'}},
+        MiB.last_self_test_result: {'iso': 'iso.3.6.1.4.1.318.1.1.1.7.2.3.0',
+                                    'name': 'Last Self Test Results',
+                                    'decode': {'1': 'OK',
+                                               '2': 'Failed',
+                                               '3': 'Invalid',
+                                               '4': 'In Progress'}},
+        MiB.last_self_test_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.7.2.4.0',
+                                  'name': 'Date of Last Self Test',
+                                  'decode': None}}
+
+
+def eaton_pw_profile() -> Profile:
+    """ MiBs for Eaton UPS with PowerWalker NMC """
+    return {
+        MiB.ups_info: {'iso': 'iso.3.6.1.2.1.1.1.0',
+                       'name': 'General UPS Information',
+                       'decode': None},
+        MiB.ups_manufacturer: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.1.0',
+                               'name': 'UPS Manufacturer',
+                               'decode': None},
+        MiB.firmware_revision: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.6.0',
+                                'name': 'UPS Firmware Revision',
+                                'decode': None},
+        MiB.ups_type: {'iso': 'iso.3.6.1.4.1.935.10.1.1.1.2.0',
+                       'name': 'UPS Model Type',
+                       'decode': None},
+        MiB.ups_contact: {'iso': 'iso.3.6.1.2.1.1.4.0',
+                          'name': 'UPS Contact',
+                          'decode': None},
+        MiB.ups_location: {'iso': 'iso.3.6.1.2.1.1.6.0',
+                           'name': 'UPS Location',
+                           'decode': None},
+        MiB.ups_uptime: {'iso': 'iso.3.6.1.2.1.1.3.0',
+                         'name': 'System Up Time',
+                         'decode': None},
+        MiB.ups_manufacture_date: {'iso': 'iso.3.6.1.4.1.318.1.1.1.1.2.2.0',
+                                   'name': 'UPS Manufacture Date',
+                                   'decode': None},
+        MiB.ups_name: {'iso': 'iso.3.6.1.2.1.33.1.1.5.0',
+                       'name': 'UPS Name',
+                       'decode': None},
+        MiB.battery_capacity: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.4.0',
+                               'name': 'Percentage of Total Capacity',
+                               'decode': None},
+        MiB.system_temperature: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.2.0',
+                                 'name': 'System Temperature in C',
+                                 'decode': None},
+        MiB.system_status: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.1.0',
+                            'name': 'UPS System Status',
+                            'decode': {'1': 'Power On',
+                                       '2': 'Standby',
+                                       '3': 'Bypass',
+                                       '4': 'Line',
+                                       '5': 'Battery',
+                                       '6': 'Battery Test',
+                                       '7': 'Fault',
+                                       '8': 'Converter',
+                                       '9': 'ECO',
+                                       '10': 'Shutdown',
+                                       '11': 'On Booster',
+                                       '12': 'On Reducer',
+                                       '13': 'Other'}},
+        MiB.battery_status: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.1.0',
+                             'name': 'Battery Status',
+                             'decode': {'1': 'Unknown',
+                                        '2': 'Battery Normal',
+                                        '3': 'Battery Low',
+                                        '4': 'Battery Depleted',
+                                        '5': 'Battery Discharging',
+                                        '6': 'Battery Failure'}},
+        MiB.time_on_battery: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.2.0',
+                              'name': 'Time on Battery',
+                              'decode': None},
+        MiB.battery_runtime_remain: {'iso': 'iso.3.6.1.4.1.935.10.1.1.3.3.0',
+                                     'name': 'Runtime Remaining',
+                                     'decode': None},
+        MiB.input_voltage: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.16.1.3.1',
+                            'name': 'Input Voltage V',
+                            'decode': None},
+        MiB.input_frequency: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.16.1.2.1',
+                              'name': 'Input Frequency Hz',
+                              'decode': None},
+        MiB.output_voltage: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.3.1',
+                             'name': 'Output Voltage',
+                             'decode': None},
+        MiB.output_frequency: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.2.1',
+                               'name': 'Output Frequency Hz',
+                               'decode': None},
+        MiB.output_load: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.7.1',
+                          'name': 'Output Load as % of Capacity',
+                          'decode': None},
+        MiB.output_current: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.4.1',
+                             'name': 'Output Current in Amps',
+                             'decode': None},
+        MiB.output_power: {'iso': 'iso.3.6.1.4.1.935.10.1.1.2.18.1.5.1',
+                           'name': 'Output Power in W',
+                           'decode': None},
+        MiB.last_self_test_result: {'iso': 'iso.3.6.1.4.1.935.10.1.1.7.3.0',
+                                    'name': 'Last Self Test Results',
+                                    'decode': {'1': 'Idle',
+                                               '2': 'Processing',
+                                               '3': 'No Failure',
+                                               '4': 'Failure/Warning',
+                                               '5': 'Not Possible',
+                                               '6': 'Test Cancel'}},
+        MiB.last_self_test_date: {'iso': 'iso.3.6.1.4.1.935.10.1.1.7.4.0',
+                                  'name': 'Date of Last Self Test',
+                                  'decode': None}}
+
+
+def rfc1628_profile() -> Profile:
+    """ MiBs of the standard UPS-MIB, RFC 1628, for any UPS with a compliant NMC """
+    return {
+        MiB.ups_info: {'iso': 'iso.3.6.1.2.1.1.1.0',
+                       'name': 'General UPS Information',
+                       'decode': None},
+        MiB.ups_manufacturer: {'iso': 'iso.3.6.1.2.1.33.1.1.1.0',
+                               'name': 'UPS Manufacturer',
+                               'decode': None},
+        MiB.ups_model: {'iso': 'iso.3.6.1.2.1.33.1.1.2.0',
+                        'name': 'UPS Model',
+                        'decode': None},
+        MiB.firmware_revision: {'iso': 'iso.3.6.1.2.1.33.1.1.3.0',
+                                'name': 'UPS Firmware Revision',
+                                'decode': None},
+        MiB.ups_name: {'iso': 'iso.3.6.1.2.1.33.1.1.5.0',
+                       'name': 'UPS Name',
+                       'decode': None},
+        MiB.ups_contact: {'iso': 'iso.3.6.1.2.1.1.4.0',
+                          'name': 'UPS Contact',
+                          'decode': None},
+        MiB.ups_location: {'iso': 'iso.3.6.1.2.1.1.6.0',
+                           'name': 'UPS Location',
+                           'decode': None},
+        MiB.ups_uptime: {'iso': 'iso.3.6.1.2.1.1.3.0',
+                         'name': 'UPS Up Time',
+                         'decode': None},
+        MiB.battery_status: {'iso': 'iso.3.6.1.2.1.33.1.2.1.0',
+                             'name': 'Battery Status',
+                             'decode': {'1': 'Unknown',
+                                        '2': 'Battery Normal',
+                                        '3': 'Battery Low',
+                                        '4': 'Battery Depleted'}},
+        MiB.time_on_battery: {'iso': 'iso.3.6.1.2.1.33.1.2.2.0',
+                              'name': 'Time on Battery',
+                              'decode': None},
+        MiB.battery_runtime_remain: {'iso': 'iso.3.6.1.2.1.33.1.2.3.0',
+                                     'name': 'Runtime Remaining',
+                                     'decode': None},
+        MiB.battery_capacity: {'iso': 'iso.3.6.1.2.1.33.1.2.4.0',
+                               'name': 'Percentage of Total Capacity',
+                               'decode': None},
+        MiB.battery_temperature: {'iso': 'iso.3.6.1.2.1.33.1.2.7.0',
+                                  'name': 'Battery Temperature in C',
+                                  'decode': None},
+        MiB.input_frequency: {'iso': 'iso.3.6.1.2.1.33.1.3.3.1.2.1',
+                              'name': 'Input Frequency Hz',
+                              'decode': None},
+        MiB.input_voltage: {'iso': 'iso.3.6.1.2.1.33.1.3.3.1.3.1',
+                            'name': 'Input Voltage V',
+                            'decode': None},
+        # upsOutputSource, decoded to the status flags used for APC
+        MiB.system_status: {'iso': 'iso.3.6.1.2.1.33.1.4.1.0',
+                            'name': 'UPS System Status',
+                            'decode': {'1': 'Other',
+                                       '2': 'Off',
+                                       '3': 'OnLine',
+                                       '4': 'Bypass',
+                                       '5': 'OnBattery',
+                                       '6': 'OnLine-AVR_Boost',
+                                       '7': 'OnLine-AVR_Trim'}},
+        MiB.output_frequency: {'iso': 'iso.3.6.1.2.1.33.1.4.2.0',
+                               'name': 'Output Frequency Hz',
+                               'decode': None},
+        MiB.output_voltage: {'iso': 'iso.3.6.1.2.1.33.1.4.4.1.2.1',
+                             'name': 'Output Voltage',
+                             'decode': None},
+        MiB.output_current: {'iso': 'iso.3.6.1.2.1.33.1.4.4.1.3.1',
+                             'name': 'Output Current in Amps',
+                             'decode': None},
+        MiB.output_power: {'iso': 'iso.3.6.1.2.1.33.1.4.4.1.4.1',
+                           'name': 'Output Power in W',
+                           'decode': None},
+        MiB.output_load: {'iso': 'iso.3.6.1.2.1.33.1.4.4.1.5.1',
+                          'name': 'Output Load as % of Capacity',
+                          'decode': None},
+        MiB.last_self_test_result: {'iso': 'iso.3.6.1.2.1.33.1.7.3.0',
+                                    'name': 'Last Self Test Results',
+                                    'decode': {'1': 'OK',
+                                               '2': 'Warning',
+                                               '3': 'Failed',
+                                               '4': 'Aborted',
+                                               '5': 'In Progress',
+                                               '6': 'No Test Initiated'}}}
+
+
+class ProfileMap(Mapping):
+    """ Mapping of UpsType to its profile, building each profile on first use.
+    """
+    def __init__(self, builders: Dict[UpsType, Callable[[], Profile]]):
+        """
+        :param builders: Profile builder function of each supported UpsType.
+        """
+        self._builders: Dict[UpsType, Callable[[], Profile]] = builders
+        self._profiles: Dict[UpsType, Profile] = {}
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return 'ProfileMap: built {} of {}'.format([ups_type.name for ups_type in self._profiles],
+                                                   [ups_type.name for ups_type in self._builders])
+
+    def __getitem__(self, ups_type: UpsType) -> Profile:
+        profile = self._profiles.get(ups_type)
+        if profile is None:
+            builder = self._builders[ups_type]
+            with self.lock:
+                profile = self._profiles.setdefault(ups_type, builder())
+        return profile
+
+    def __iter__(self) -> Iterator[UpsType]:
+        return iter(self._builders)
+
+    def __len__(self) -> int:
+        return len(self._builders)
+
+
+PROFILES = ProfileMap({
+    UpsType.none: dict,
+    UpsType.apc_ap96xx: apc_ap96xx_profile,
+    UpsType.eaton_pw: eaton_pw_profile,
+    UpsType.rfc1628: rfc1628_profile})
+
+
+def numeric_oid(value: Optional[str]) -> str:
+    """ Convert an OID value as output by snmpget to numeric form.
+
+    :param value: OID such as iso.3.6.1.4.1.318.1.3.27 or .1.3.6.1.4.1.318.1.3.27.
+    :return: OID such as 1.3.6.1.4.1.318.1.3.27.
+    """
+    value = (value or '').strip().strip('"').lstrip('.')
+    return re.sub(r'^iso\b', '1', value)
+
+
+def match_vendor(sys_object_id: Optional[str], sys_descr: Optional[str]) -> Optional[UpsType]:
+    """ Find the vendor profile for a UPS from its sysObjectID and sysDescr.
+
+    :param sys_object_id: The sysObjectID value.
+    :param sys_descr: The sysDescr value.
+    :return: The UpsType of the vendor profile, or None if no vendor matches.
+    """
+    object_id = numeric_oid(sys_object_id) + '.'
+    for prefix, ups_type in VENDOR_OBJECT_IDS:
+        if object_id.startswith(prefix): return ups_type
+    for pattern, ups_type in VENDOR_DESCRIPTIONS:
+        if sys_descr and pattern.search(sys_descr): return ups_type
+    return None
+
+
+class TypeCache:
+    """ Detected UPS types by management address, kept in a json file between runs.  The file is
+        only trusted if it is a regular file owned by the user which others can not write.
+    """
+    max_age: float = 7 * 24 * 3600.0
+
+    def __init__(self, path: Optional[str] = None):
+        """
+        :param path: Path of the cache file, by default in the private runtime directory.
+        """
+        self._path: Optional[str] = path
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return 'TypeCache: {}'.format(self._path or 'ups-utils-types.json')
+
+    @property
+    def path(self) -> Optional[str]:
+        """ Path of the cache file, None if the private runtime directory is not available.
+        """
+        if not self._path:
+            try:
+                self._path = runtime_file('ups-utils-types.json')
+            except OSError as error:
+                LOGGER.debug('Type cache disabled: %s', error)
+        return self._path
+
+    def _load(self) -> Dict[str, Dict[str, Union[str, float]]]:
+        if not self.path: return {}
+        try:
+            fd = os.open(self.path, os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError as error:
+            if not isinstance(error, FileNotFoundError): LOGGER.debug('Error reading %s: %s', self.path, error)
+            return {}
+        with open(fd, 'r', encoding='utf-8') as cache_file:
+            status = os.fstat(fd)
+            if not stat.S_ISREG(status.st_mode) or status.st_uid != os.geteuid() or status.st_mode & 0o022:
+                LOGGER.debug('Ignoring %s: not a private file of uid %s', self.path, os.geteuid())
+                return {}
+            try:
+                entries = json.load(cache_file)
+            except ValueError as error:
+                LOGGER.debug('Error reading %s: %s', self.path, error)
+                return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, key: str) -> Optional[UpsType]:
+        """ Get the cached type of a UPS.
+
+        :param key: The management addresses of the UPS.
+        :return: The detected UpsType, or None if not cached or expired.
+        """
+        with self.lock:
+            entry = self._load().get(key)
+        try:
+            if time() - float(entry['time']) > self.max_age: return None
+            return UpsType[entry['ups_type']]
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def put(self, key: str, ups_type: UpsType, sys_object_id: str = '') -> None:
+        """ Cache the detected type of a UPS.
+
+        :param key: The management addresses of the UPS.
+        :param ups_type: The detected UpsType.
+        :param sys_object_id: The sysObjectID of the UPS, recorded for reference.
+        """
+        if not self.path: return
+        with self.lock:
+            entries = self._load()
+            entries[key] = {'ups_type': ups_type.name, 'sys_object_id': sys_object_id, 'time': time()}
+            temp_path = None
+            try:
+                # A new file with a random name and O_EXCL, moved over the cache file, so a planted
+                # file or symlink is never written.
+                fd, temp_path = tempfile.mkstemp(prefix='.ups-utils-types-', suffix='.tmp',
+                                                 dir=os.path.dirname(os.path.abspath(self.path)))
+                with open(fd, 'w', encoding='utf-8') as cache_file:
+                    json.dump(entries, cache_file, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as error:
+                LOGGER.debug('Error writing %s: %s', self.path, error)
+                if temp_path and os.path.exists(temp_path): os.remove(temp_path)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+""" UPSrate  -  token bucket rate limit of the snmp requests to each management card
+
+    Network management cards such as the AP96xx can hang or drop their web
+    and snmp services when they receive bursts of requests.  Each card has a
+    token bucket which holds up to burst tokens and is refilled at rate
+    tokens per second.  Every request takes a token, and waits for one if
+    the bucket is empty, so a card never receives more than burst requests
+    at once or more than rate requests per second on average, however many
+    UPSs are read concurrently.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import logging
+import threading
+from time import monotonic, sleep
+from typing import Optional
+
+LOGGER = logging.getLogger('ups-utils')
+
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 10
+
+
+class TokenBucket:
+    """ Rate limit of the requests sent to one management card.
+    """
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = DEFAULT_BURST):
+        """
+        :param rate: Requests per second, 0 for no limit.
+        :param burst: Maximum number of requests sent at once.
+        :raises ValueError: If rate is negative or burst is less than 1.
+        """
+        if rate < 0 or burst < 1:
+            raise ValueError('snmp rate must be >= 0 and burst >= 1, got {} and {}'.format(rate, burst))
+        self.rate: float = float(rate)
+        self.burst: int = int(burst)
+        self.tokens: float = float(burst)
+        self.updated: float = monotonic()
+        self.waited: float = 0.0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        if not self.rate: return 'TokenBucket: no limit'
+        return 'TokenBucket: {}/s, burst {}'.format(self.rate, self.burst)
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, requests: int = 1) -> float:
+        """ Get the time needed to send the given number of requests from the present state.
+
+        :param requests: Number of requests.
+        :return: Time in seconds.
+        """
+        if not self.rate: return 0.0
+        with self.lock:
+            self._refill(monotonic())
+            return max(requests - self.tokens, 0.0) / self.rate
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """ Take a token, waiting for one if the bucket is empty.
+
+        :param blocking: If False, return at once when no token is available.
+        :return: True if a token was taken.
+        """
+        if not self.rate: return True
+        while True:
+            with self.lock:
+                now = monotonic()
+                self._refill(now)
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return True
+                if not blocking: return False
+                wait = (1.0 - self.tokens) / self.rate
+            self.waited += wait
+            sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """ Take a token only if one is available now.
+        """
+        return self.acquire(blocking=False)
+
+
+def token_bucket(rate: Optional[float], burst: Optional[int]) -> TokenBucket:
+    """ Create a token bucket from optional ups-config.json values.
+
+    :param rate: Requests per second, None for the default.
+    :param burst: Burst size, None for the default.
+    :return: The token bucket.
+    :raises ValueError: If the values are invalid.
+    """
+    return TokenBucket(DEFAULT_RATE if rate is None else float(rate), DEFAULT_BURST if burst is None else int(burst))
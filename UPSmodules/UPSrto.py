@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+""" UPSrto  -  adaptive snmp timeouts from the measured round trip time of each UPS
+
+    The round trip time of every successful snmp request is measured and
+    smoothed as in TCP retransmission timeout estimation, RFC 6298:
+
+        RTTVAR = 3/4 RTTVAR + 1/4 |SRTT - RTT|
+        SRTT   = 7/8 SRTT + 1/8 RTT
+        RTO    = SRTT + max(G, 4 RTTVAR)
+
+    The timeout of each snmpget request is the RTO, limited to a minimum and
+    maximum, so a card on the local switch is found dead in tens of
+    milliseconds while a slow card across a WAN link gets a timeout longer
+    than its normal response time.  A timeout doubles the RTO and, as in
+    Karn's algorithm, replies which may have come from a retry are not used
+    as samples but keep the RTO backed off.  A jittery link, with a variance
+    large relative to the smoothed time, is given one more retry.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import logging
+import threading
+from typing import Optional, Tuple
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+class RtoEstimator:
+    """ Smoothed round trip time of the snmp requests to one UPS and the resulting timeout.
+    """
+    alpha: float = 1 / 8
+    beta: float = 1 / 4
+    # Clock granularity, covering the start up time of the snmpget process.
+    granularity: float = 0.01
+
+    def __init__(self, initial_rto: float = 1.0, min_rto: float = 0.05, max_rto: float = 10.0):
+        """
+        :param initial_rto: Timeout in seconds before the first sample.
+        :param min_rto: Minimum timeout in seconds.
+        :param max_rto: Maximum timeout in seconds.
+        """
+        self.min_rto: float = min_rto
+        self.max_rto: float = max_rto
+        self.srtt: Optional[float] = None
+        self.rttvar: float = 0.0
+        self.rto: float = initial_rto
+        self.samples: int = 0
+        self.timeouts: int = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        if self.srtt is None:
+            return 'RtoEstimator: no samples, timeout {:.3f}s'.format(self.rto)
+        return 'RtoEstimator: srtt {:.3f}s, rttvar {:.3f}s, timeout {:.3f}s x {}'.format(
+            self.srtt, self.rttvar, self.rto, self.retries() + 1)
+
+    def retries(self) -> int:
+        """ Get the number of retries of a request.
+
+        :return: 2 before the first sample or for a jittery link, else 1.
+        """
+        if self.srtt is None or self.rttvar > self.srtt / 2: return 2
+        return 1
+
+    def request_params(self) -> Tuple[float, int]:
+        """ Get the timeout and retries of the next request.
+
+        :return: Tuple of timeout in seconds and number of retries.
+        """
+        with self.lock:
+            return self.rto, self.retries()
+
+    def sample(self, rtt: float, timeout: Optional[float] = None) -> None:
+        """ Update the estimate with the measured time of a successful request.
+
+        :param rtt: Measured time in seconds.
+        :param timeout: Timeout used for the request.  A time longer than this means a retry
+            answered, so it is not used as a sample and the timeout is backed off.
+        """
+        with self.lock:
+            if timeout is not None and rtt > timeout:
+                # Answered by a retry, so keep the backed off timeout until a clean sample.
+                self.rto = min(self.rto * 2, self.max_rto)
+                return
+            if self.srtt is None:
+                self.srtt, self.rttvar = rtt, rtt / 2
+            else:
+                self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+                self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+            self.samples += 1
+            self.rto = min(max(self.srtt + max(self.granularity, 4 * self.rttvar), self.min_rto), self.max_rto)
+
+    def backoff(self) -> None:
+        """ Double the timeout after a request timed out.
+        """
+        with self.lock:
+            self.timeouts += 1
+            self.rto = min(self.rto * 2, self.max_rto)
+            LOGGER.debug('%s after timeout', self)
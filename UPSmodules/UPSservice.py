@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+""" UPSservice  -  shared UPS poller with a local UNIX socket query API
+
+    A single process, normally ups-daemon with the *--service* option, polls
+    all UPSs and keeps the latest decoded values.  Other utilities connect to
+    the socket and read the snapshot instead of sending their own snmp
+    commands, so any number of viewers put only one poller's load on the
+    network management cards.
+
+    The protocol is line based.  Each request is a single line of the form
+    COMMAND [ARGUMENT] and each response is a single line of JSON.  A client
+    may send any number of requests on one connection.
+
+        PING              {"ok": true, "version": N, "time": T}
+        LIST              {"ok": true, "upss": {name: {configuration and status}}}
+        SNAPSHOT [name]   {"ok": true, "version": N, "time": T, "upss": {name: {mib: value}}}
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import json
+import socket
+import logging
+import threading
+import socketserver
+from enum import Enum
+from time import time, monotonic
+from typing import Dict, Any, Optional, Iterable
+from UPSmodules.env import UT_CONST
+from UPSmodules.UPSKeys import MiB, MibGroup
+from UPSmodules.UPSshm import SnapshotWriter, runtime_file
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+# Keys of UpsItem.prm sent with the LIST response
+SERVICE_LIST_KEYS = ('uuid', 'ups_IP', 'display_name', 'ups_type', 'ups_model', 'ups_nmc_model', 'daemon',
+                     'feed', 'valid', 'compatible', 'accessible', 'responsive')
+
+
+def default_socket_path() -> str:
+    """ Get the default socket path, in the user runtime directory if available.
+
+    :return: Path of the service socket.
+    """
+    return runtime_file('ups-utils.sock')
+
+
+def _json_value(value: Any) -> Any:
+    """ Convert a UpsItem parameter value to a JSON compatible value.
+    """
+    if isinstance(value, Enum): return value.name
+    return value
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """ Handle requests from one client connection until it closes.
+    """
+    server: '_ServiceServer'
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            # The argument, a UPS display name, may contain spaces.
+            request = line.decode('utf-8', errors='replace').strip().split(None, 1)
+            if not request: continue
+            response = self.server.service.respond(request[0].upper(), request[1] if len(request) > 1 else None)
+            try:
+                self.wfile.write(response)
+                self.wfile.flush()
+            except OSError:
+                return
+
+
+class _ServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Threading UNIX stream server with a reference to the owning service.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: 'PollerService'):
+        self.service = service
+        super().__init__(socket_path, _RequestHandler)
+
+
+class PollerService:
+    """ Poll all UPSs of a UpsList in a background thread and serve the latest values.
+
+        Responses are encoded once per poll cycle and the encoded bytes are shared by all
+        clients, so the cost of serving a request does not depend on the number of clients.
+        Values are also published to a memory mapped snapshot file for readers which do not
+        need the socket.
+    """
+    def __init__(self, ups_list: Any, socket_path: Optional[str] = None, interval: float = 10.0,
+                 snapshot_path: Optional[str] = None, listeners: Iterable[Any] = ()):
+        """
+        :param ups_list: UpsList to be polled.
+        :param socket_path: Path of the UNIX socket, defaults to default_socket_path().
+        :param interval: Seconds between polls of dynamic values.
+        :param snapshot_path: Path of the snapshot file, defaults to default_snapshot_path().
+        :param listeners: Objects with an update(upss, stats) method, such as MetricsExporter
+            and NutServer, called after each poll.
+        """
+        self.ups_list = ups_list
+        self.socket_path: str = socket_path or default_socket_path()
+        self.interval: float = interval
+        self.version: int = 0
+        self.read_time: float = 0.0
+        self._responses: Dict[Optional[str], bytes] = {}
+        self._list_response: bytes = b''
+        self._quit = threading.Event()
+        self._server: Optional[_ServiceServer] = None
+        self._threads: list = []
+        self.snapshot: SnapshotWriter = SnapshotWriter(snapshot_path)
+        self.listeners: list = list(listeners)
+        self.stats: Dict[str, float] = {'polls': 0, 'poll_errors': 0, 'poll_seconds': 0.0, 'poll_time': 0.0,
+                                        'publish_errors': 0}
+
+    def __repr__(self) -> str:
+        return 'PollerService: {} version {}'.format(self.socket_path, self.version)
+
+    def start(self) -> None:
+        """ Read all UPS values, then open the socket and start the poll and server threads.
+        """
+        if os.path.exists(self.socket_path):
+            # Remove only a stale socket, never one in use by another service.
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(self.socket_path)
+                raise OSError('Error: UPS service already running at [{}]'.format(self.socket_path))
+            except ConnectionRefusedError:
+                os.remove(self.socket_path)
+        self._read(MibGroup.all)
+        self._publish()
+        self._server = _ServiceServer(self.socket_path, self)
+        os.chmod(self.socket_path, 0o660)
+        for target in (self._server.serve_forever, self._poll):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        LOGGER.debug('Started %s', self)
+
+    def stop(self) -> None:
+        """ Stop polling, close the socket and remove the socket file.
+        """
+        self._quit.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.remove(self.socket_path)
+            except FileNotFoundError:
+                pass
+            # A poll in progress completes before the snapshot it publishes to is closed.
+            for thread in self._threads:
+                if thread is not threading.current_thread(): thread.join(timeout=30.0)
+            self.snapshot.close(remove=True)
+        LOGGER.debug('Stopped %s', self)
+
+    def _poll(self) -> None:
+        """ Poll loop run in background thread.
+        """
+        next_time = monotonic()
+        while not self._quit.is_set():
+            next_time += self.interval
+            self._quit.wait(max(next_time - monotonic(), 0.0))
+            if self._quit.is_set(): break
+            if not self._read(MibGroup.dynamic): continue
+            try:
+                self._publish()
+            except Exception as error:  # pylint: disable=broad-except
+                # Polling continues, so the daemon never decides on frozen values.
+                UT_CONST.process_message('Error: UPS service publish failed: {!r}'.format(error), verbose=True)
+                self.stats['publish_errors'] += 1
+
+    def _read(self, cmd_group: MibGroup) -> bool:
+        """ Read the given group for all UPSs and update poll statistics.
+
+        :param cmd_group: Group of MiBs to be read.
+        :return: True on success.
+        """
+        start_time = monotonic()
+        try:
+            self.ups_list.read_all_ups_list_items(cmd_group, errups=False, display=False)
+        except (OSError, ValueError, TypeError) as error:
+            LOGGER.debug('Poll error: %s', error)
+            self.stats['poll_errors'] += 1
+            return False
+        except Exception as error:  # pylint: disable=broad-except
+            # Polling continues, so the socket and snapshot do not serve stale values.
+            UT_CONST.process_message('Error: UPS service poll failed: {!r}'.format(error), verbose=True)
+            LOGGER.debug('Poll error', exc_info=True)
+            self.stats['poll_errors'] += 1
+            return False
+        finally:
+            self.stats['poll_seconds'] = monotonic() - start_time
+        self.stats['polls'] += 1
+        self.stats['poll_time'] = time()
+        return True
+
+    @staticmethod
+    def _encode(message: Dict[str, Any]) -> bytes:
+        return (json.dumps(message, separators=(',', ':')) + '\n').encode('utf-8')
+
+    def _publish(self) -> None:
+        """ Build and encode responses for the latest values.  Responses are replaced as a
+            whole, so a client never sees values from two different poll cycles.
+        """
+        self.read_time = time()
+        self.version += 1
+        upss: Dict[str, Dict[str, Any]] = {}
+        details: Dict[str, Dict[str, Any]] = {}
+        for ups in self.ups_list.upss():
+            name = ups.prm.display_name
+            details[name] = {key: _json_value(ups.prm[key]) for key in SERVICE_LIST_KEYS}
+            upss[name] = {mib.name: _json_value(ups.prm[mib]) for mib in MiB if mib in ups.prm}
+            upss[name]['responsive'] = ups.prm.responsive
+            upss[name]['comm_state'] = ups.prm.comm_state
+        header = {'ok': True, 'version': self.version, 'time': self.read_time}
+        responses = {None: self._encode({**header, 'upss': upss})}
+        for name, values in upss.items():
+            responses[name] = self._encode({**header, 'upss': {name: values}})
+        self._list_response = self._encode({'ok': True, 'upss': details})
+        self._responses = responses
+        self.snapshot.publish(self.ups_list.upss())
+        for listener in self.listeners:
+            # A failing listener must not stop the others or the poll thread.
+            try:
+                listener.update(self.ups_list.upss(), self.stats)
+            except Exception as error:  # pylint: disable=broad-except
+                UT_CONST.process_message('Error: {} update failed: {!r}'.format(listener, error), verbose=True)
+                self.stats['publish_errors'] += 1
+
+    def respond(self, command: str, argument: Optional[str] = None) -> bytes:
+        """ Get the encoded response to a request.
+
+        :param command: Request command.
+        :param argument: Optional request argument.
+        :return: Encoded JSON response line.
+        """
+        if command == 'PING':
+            return self._encode({'ok': True, 'version': self.version, 'time': self.read_time})
+        if command == 'LIST':
+            return self._list_response
+        if command == 'SNAPSHOT':
+            response = self._responses.get(argument)
+            if response: return response
+            return self._encode({'ok': False, 'error': 'Unknown UPS: {}'.format(argument)})
+        return self._encode({'ok': False, 'error': 'Unknown command: {}'.format(command)})
+
+
+class ServiceClient:
+    """ Client of the UPS poller service.  The connection is opened on first use and kept open.
+    """
+    def __init__(self, socket_path: Optional[str] = None, timeout: float = 5.0):
+        """
+        :param socket_path: Path of the UNIX socket, defaults to default_socket_path().
+        :param timeout: Socket timeout in seconds.
+        """
+        self.socket_path: str = socket_path or default_socket_path()
+        self.timeout: float = timeout
+        self._socket: Optional[socket.socket] = None
+        self._file = None
+        self._snapshot: Dict[str, Any] = {}
+        self._snapshot_time: float = 0.0
+        # The client is shared by the concurrent read threads of a UpsList.
+        self._lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return 'ServiceClient: {}'.format(self.socket_path)
+
+    def _connect(self) -> None:
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.settimeout(self.timeout)
+        self._socket.connect(self.socket_path)
+        self._file = self._socket.makefile('rwb')
+
+    def close(self) -> None:
+        """ Close the connection.
+        """
+        with self._lock:
+            if self._socket:
+                self._file.close()
+                self._socket.close()
+            self._socket = self._file = None
+
+    def request(self, command: str, argument: Optional[str] = None) -> Dict[str, Any]:
+        """ Send a request and wait for the response.  A broken connection is reopened once.
+
+        :param command: Request command.
+        :param argument: Optional request argument.
+        :return: Decoded response.
+        :raises OSError: If the service can not be reached.
+        """
+        line = ('{} {}\n'.format(command, argument) if argument else '{}\n'.format(command)).encode('utf-8')
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if not self._socket: self._connect()
+                    self._file.write(line)
+                    self._file.flush()
+                    response = self._file.readline()
+                    if not response:
+                        raise ConnectionResetError('UPS service closed connection')
+                    return json.loads(response)
+                except (ConnectionError, BrokenPipeError):
+                    self.close()
+                    if attempt: raise
+        return {'ok': False}
+
+    def snapshot(self, max_age: float = 1.0) -> Dict[str, Any]:
+        """ Get values of all UPSs, reusing the last response if it is less than max_age seconds old.
+
+        :param max_age: Maximum age in seconds of a reused response.
+        :return: Dictionary of values by MiB name by UPS display name.
+        """
+        with self._lock:
+            # Threads waiting for the lock reuse the response of the thread which held it.
+            if monotonic() - self._snapshot_time > max_age:
+                response = self.request('SNAPSHOT')
+                if response.get('ok'):
+                    self._snapshot = response['upss']
+                    self._snapshot_time = monotonic()
+            return self._snapshot
+
+    def ups_details(self) -> Iterable[Dict[str, Any]]:
+        """ Get the configuration and status of all UPSs known to the service.
+
+        :return: Iterable of UPS detail dictionaries.
+        """
+        response = self.request('LIST')
+        if not response.get('ok'):
+            raise OSError('Error: UPS service error: {}'.format(response.get('error')))
+        return response['upss'].values()
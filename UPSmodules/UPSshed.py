@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+""" UPSshed  -  tiered load shedding for ups-daemon
+
+    Each tier sheds a set of non-critical loads when its trigger crosses the
+    shed level and restores them when the trigger crosses back past a separate
+    resume level, so a tier does not oscillate around a single threshold.
+    Triggers are time on battery, runtime remaining, battery capacity, or
+    output load.  Runtime remaining is the low end of the predicted runtime
+    while on battery.  Shedding load early extends the runtime of the
+    critical hosts for the rest of the outage.
+
+    Tier actions are commands or tcp://HOST:PORT targets as used by the
+    shutdown waves, sent "SHED <ups name>" or "RESTORE <ups name>".  All
+    actions of a tier run concurrently in a background thread, so the daemon
+    loop is never blocked by a slow target.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import re
+import logging
+import threading
+from typing import Dict, List, Tuple, Optional, Iterable, Any
+from UPSmodules.env import UT_CONST
+from UPSmodules.UPSshutdown import ShutdownPlan, ShutdownTarget, parse_target
+
+LOGGER = logging.getLogger('ups-utils')
+
+# Trigger names and whether the tier sheds at high or at low values
+TRIGGERS: Dict[str, str] = {'time_on_battery': 'high', 'runtime_remaining': 'low', 'capacity': 'low', 'load': 'high'}
+SECTION_PREFIX = 'SheddingTier'
+DEFAULT_TIMEOUT = 30.0
+
+
+class SheddingTier:
+    """ A set of loads shed and restored together, with hysteresis between the shed and resume levels.
+    """
+    def __init__(self, name: str, trigger: str, level: float, resume_level: float,
+                 shed_actions: Iterable[str], restore_actions: Iterable[str] = (), timeout: float = DEFAULT_TIMEOUT):
+        """
+        :param name: Name of the tier.
+        :param trigger: One of TRIGGERS.
+        :param level: Trigger value at which the tier is shed.
+        :param resume_level: Trigger value at which the tier is restored.
+        :param shed_actions: Commands or tcp://HOST:PORT targets run to shed.
+        :param restore_actions: Commands or tcp://HOST:PORT targets run to restore.
+        :param timeout: Timeout in seconds of each action.
+        :raises ValueError: If the parameters are invalid.
+        """
+        if trigger not in TRIGGERS:
+            raise ValueError('invalid trigger [{}], expected one of {}'.format(trigger, list(TRIGGERS)))
+        self.high: bool = TRIGGERS[trigger] == 'high'
+        if (resume_level >= level) if self.high else (resume_level <= level):
+            raise ValueError('resume level {} must be {} than shed level {}'.format(
+                resume_level, 'lower' if self.high else 'higher', level))
+        self.name: str = name
+        self.trigger: str = trigger
+        self.level: float = level
+        self.resume_level: float = resume_level
+        self.timeout: float = timeout
+        self.shed_targets: List[ShutdownTarget] = self._targets('shed', shed_actions)
+        self.restore_targets: List[ShutdownTarget] = self._targets('restore', restore_actions)
+        if not self.shed_targets:
+            raise ValueError('no shed actions')
+        self.shed: bool = False
+        self.lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return 'SheddingTier {}: {} {} {}, resume {}, {}'.format(
+            self.name, self.trigger, '>=' if self.high else '<=', self.level, self.resume_level,
+            'shed' if self.shed else 'normal')
+
+    def _targets(self, action: str, commands: Iterable[str]) -> List[ShutdownTarget]:
+        return [parse_target('{}-{}{}'.format(self.name, action, index), '0, {}, {}'.format(self.timeout, command))
+                for index, command in enumerate(commands)]
+
+    def transition(self, value: Optional[float]) -> Optional[str]:
+        """ Update the tier state for the latest trigger value.
+
+        :param value: Latest value of the trigger, None if not available.
+        :return: 'shed' or 'restore' if the state changed, else None.
+        """
+        if value is None: return None
+        if not self.shed and ((value >= self.level) if self.high else (value <= self.level)):
+            self.shed = True
+            return 'shed'
+        if self.shed and ((value <= self.resume_level) if self.high else (value >= self.resume_level)):
+            self.shed = False
+            return 'restore'
+        return None
+
+
+def parse_tier(section_name: str, config: Dict[str, str]) -> SheddingTier:
+    """ Create a tier from a SheddingTier config section.
+
+    :param section_name: Section name of the form: SheddingTier name
+    :param config: The config section.
+    :return: The tier.
+    :raises ValueError: If the section is invalid.
+    """
+    name = section_name[len(SECTION_PREFIX):].strip() or 'tier'
+    if not re.search(UT_CONST.PATTERNS['INI'], config.get('level', '')):
+        raise ValueError('level must be (shed_level,resume_level)')
+    level, resume_level = (int(item) for item in re.sub(r'[\s()]+', '', config['level']).split(','))
+    return SheddingTier(name, config.get('trigger', '').strip(), level, resume_level,
+                        [line.strip() for line in config.get('shed', '').splitlines() if line.strip()],
+                        [line.strip() for line in config.get('restore', '').splitlines() if line.strip()],
+                        float(config.get('timeout', DEFAULT_TIMEOUT)))
+
+
+class LoadShedder:
+    """ Evaluate all shedding tiers for each daemon reading and run the actions of tier changes.
+    """
+    def __init__(self, tiers: Iterable[SheddingTier]):
+        """
+        :param tiers: Shedding tiers.
+        """
+        self.tiers: List[SheddingTier] = list(tiers)
+
+    def __repr__(self) -> str:
+        return 'LoadShedder: {}'.format(', '.join(repr(tier) for tier in self.tiers))
+
+    def adopt(self, previous: Optional['LoadShedder']) -> None:
+        """ Keep the state of tiers with the same name from a previous configuration.
+
+        :param previous: The load shedder replaced by this one.
+        """
+        if not previous: return
+        states = {tier.name: tier.shed for tier in previous.tiers}
+        for tier in self.tiers:
+            tier.shed = states.get(tier.name, tier.shed)
+
+    def shed_tiers(self) -> List[str]:
+        """ Get the names of tiers presently shed.
+        """
+        return [tier.name for tier in self.tiers if tier.shed]
+
+    def update(self, values: Dict[str, Optional[float]], ups_name: str = 'ups') -> List[Tuple[str, str]]:
+        """ Evaluate all tiers and start the actions of any tier changes.
+
+        :param values: Latest values by trigger name.
+        :param ups_name: Name of the UPS sent to TCP targets.
+        :return: List of tier name and change started.
+        """
+        changes = []
+        for tier in self.tiers:
+            change = tier.transition(values.get(tier.trigger))
+            if not change: continue
+            changes.append((tier.name, change))
+            targets = tier.shed_targets if change == 'shed' else tier.restore_targets
+            if targets:
+                threading.Thread(target=self._run, args=(tier, change, targets, ups_name), daemon=True).start()
+        return changes
+
+    @staticmethod
+    def _run(tier: SheddingTier, change: str, targets: List[ShutdownTarget], ups_name: str) -> None:
+        """ Run the actions of a tier change.  Changes of one tier run in order.
+        """
+        with tier.lock:
+            for result in ShutdownPlan(targets, ups_name, change.upper()).run():
+                message = '[{}] Tier {} {} {}: {} in {:.2f}s {}'.format(
+                    UT_CONST.now(ltz=UT_CONST.use_ltz, as_string=True), tier.name, change, result.name,
+                    'acknowledged' if result.acknowledged else 'FAILED', result.seconds, result.message).strip()
+                if result.acknowledged:
+                    print(message)
+                    LOGGER.debug(message)
+                else:
+                    UT_CONST.process_message(message, verbose=True)
+
+
+def tier_values(time_on_battery: float, runtime_remaining: float, capacity: float, load: float,
+                predicted_low: Optional[float] = None) -> Dict[str, Any]:
+    """ Get trigger values from the daemon readings.
+
+    :param time_on_battery: Time on battery in minutes.
+    :param runtime_remaining: Runtime remaining reported by the UPS in minutes.
+    :param capacity: Battery capacity in percent.
+    :param load: Output load in percent.
+    :param predicted_low: Low end of the predicted runtime in minutes, if on battery.
+    :return: Dictionary of values by trigger name.
+    """
+    if predicted_low is not None:
+        runtime_remaining = min(runtime_remaining, predicted_low)
+    return {'time_on_battery': time_on_battery, 'runtime_remaining': runtime_remaining,
+            'capacity': capacity, 'load': load}
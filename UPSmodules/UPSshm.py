@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+""" UPSshm  -  memory mapped snapshot of the latest values of all UPSs
+
+    The poller service publishes the values of all UPSs into a file with a
+    fixed binary layout.  Readers map the file and copy a consistent snapshot
+    without locks, using a sequence counter in the header: the writer makes
+    the counter odd before changing records and even after, and a reader
+    retries if the counter was odd or changed during its copy.  The writer
+    always creates a new file, and readers map it again when the inode at the
+    path changes.  Default paths are in a runtime directory private to the
+    user, so other local users can not redirect the writes of a root daemon.
+
+    Layout, little endian:
+        header   magic 8s, sequence Q, write time d, number of UPSs I, record size I
+        records  one per UPS: flags I, then string fields as fixed width utf-8,
+                 then numeric fields as float64 with NaN for missing values
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import stat
+import math
+import mmap
+import struct
+import logging
+import tempfile
+from time import time, sleep
+from typing import Dict, List, Tuple, Union, Optional, Iterable, Any
+from UPSmodules.UPSKeys import MiB
+from UPSmodules.UPShistory import UpsHistory
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+MAGIC = b'UPSSHM01'
+HEADER = struct.Struct('<8sQdII')
+SEQUENCE = struct.Struct('<Q')
+SEQUENCE_OFFSET = 8
+
+# Status flags of UpsItem.prm packed as bits of the record flags field
+FLAG_NAMES: Tuple[str, ...] = ('daemon', 'valid', 'compatible', 'accessible', 'responsive')
+
+# String fields and their widths in bytes
+STRING_FIELDS: Tuple[Tuple[Union[str, MiB], int], ...] = (
+    ('display_name', 32), ('ups_IP', 64), ('ups_type', 16), ('ups_nmc_model', 16),
+    (MiB.ups_model, 32), (MiB.ups_name, 32), (MiB.ups_location, 48),
+    (MiB.system_status, 64), (MiB.battery_status, 32))
+
+NUMERIC_FIELDS: Tuple[MiB, ...] = UpsHistory.history_mibs
+
+RECORD = struct.Struct('<I' + ''.join('{}s'.format(width) for _, width in STRING_FIELDS) +
+                       '{}d'.format(len(NUMERIC_FIELDS)))
+
+
+def runtime_dir() -> str:
+    """ Get the private directory for runtime files: the user runtime directory, else
+        /run/ups-utils for root, else /tmp/ups-utils-UID.  The directory is created with mode
+        0700 if needed, and must be a directory owned by the user that others can not write,
+        so other users can not plant files or symlinks in it.
+
+    :return: Path of the directory.
+    :raises PermissionError: If the directory is not private to the user.
+    """
+    xdg_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if xdg_dir and os.path.isdir(xdg_dir): return xdg_dir
+    uid = os.geteuid()
+    path = '/run/ups-utils' if uid == 0 and os.path.isdir('/run') else '/tmp/ups-utils-{}'.format(uid)
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    status = os.lstat(path)
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != uid or status.st_mode & 0o022:
+        raise PermissionError('Error: runtime directory [{}] is not a private directory of uid {}'.format(path, uid))
+    return path
+
+
+def runtime_file(name: str) -> str:
+    """ Get the path of a file in the private runtime directory.
+
+    :param name: Base name of the file.
+    :return: Path of the file.
+    :raises PermissionError: If the runtime directory is not private to the user.
+    """
+    return os.path.join(runtime_dir(), name)
+
+
+def default_snapshot_path() -> str:
+    """ Get the default path of the snapshot file.
+
+    :return: Path of the snapshot file.
+    """
+    return runtime_file('ups-utils.snapshot')
+
+
+def _pack_string(value: Any, width: int) -> bytes:
+    if value is None: return b''
+    if hasattr(value, 'name') and not isinstance(value, str): value = value.name
+    return str(value).encode('utf-8')[:width]
+
+
+def _pack_float(value: Any) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+class SnapshotWriter:
+    """ Publish the values of a list of UPSs to the snapshot file.
+    """
+    def __init__(self, file_name: Optional[str] = None):
+        """
+        :param file_name: Path of the snapshot file, defaults to default_snapshot_path().
+        """
+        self.file_name: str = file_name or default_snapshot_path()
+        self._fd: int = self._create()
+        self._map: Optional[mmap.mmap] = None
+        self._sequence: int = 0
+        self._resize(0)
+
+    def __repr__(self) -> str:
+        return 'SnapshotWriter: {} sequence {}'.format(self.file_name, self._sequence)
+
+    def _create(self) -> int:
+        """ Create a new snapshot file and move it over any existing file.  The file is created
+            with a random name and O_EXCL, and the rename replaces a symlink at the path instead
+            of following it, so a planted file or symlink is never written.  Readers of an old
+            file see the new inode and map it.
+
+        :return: File descriptor of the new file.
+        :raises OSError: If the file can not be created, or is not owned by the user.
+        """
+        directory = os.path.dirname(os.path.abspath(self.file_name))
+        fd, tmp_path = tempfile.mkstemp(prefix='.ups-utils-', suffix='.tmp', dir=directory)
+        try:
+            status = os.fstat(fd)
+            if status.st_uid != os.geteuid() or not stat.S_ISREG(status.st_mode):
+                raise PermissionError('Error: snapshot file [{}] is not owned by uid {}'.format(
+                    tmp_path, os.geteuid()))
+            os.fchmod(fd, 0o644)
+            os.replace(tmp_path, self.file_name)
+        except OSError:
+            os.close(fd)
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return fd
+
+    def _resize(self, num_ups: int) -> None:
+        """ Set the file size for the given number of UPSs.  The file only grows, so
+            existing reader mappings always remain valid.
+        """
+        size = HEADER.size + num_ups * RECORD.size
+        if self._map is not None and len(self._map) >= size: return
+        os.ftruncate(self._fd, max(size, os.fstat(self._fd).st_size, mmap.PAGESIZE))
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_WRITE)
+        if self._map[:8] != MAGIC:
+            HEADER.pack_into(self._map, 0, MAGIC, 0, 0.0, 0, RECORD.size)
+        self._sequence = SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0] & ~1
+
+    def publish(self, upss: Iterable[Any]) -> None:
+        """ Write the values of all UPSs as a single consistent snapshot.
+
+        :param upss: Iterable of UpsItem objects.
+        """
+        records = []
+        for ups in upss:
+            prm = ups.prm
+            flags = sum(1 << index for index, name in enumerate(FLAG_NAMES) if prm.get(name))
+            records.append(RECORD.pack(flags, *(_pack_string(prm.get(key), width) for key, width in STRING_FIELDS),
+                                       *(_pack_float(prm.get(mib)) for mib in NUMERIC_FIELDS)))
+        payload = b''.join(records)
+        self._resize(len(records))
+        self._sequence += 1
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, self._sequence)
+        self._map[HEADER.size:HEADER.size + len(payload)] = payload
+        HEADER.pack_into(self._map, 0, MAGIC, self._sequence, time(), len(records), RECORD.size)
+        self._sequence += 1
+        SEQUENCE.pack_into(self._map, SEQUENCE_OFFSET, self._sequence)
+
+    def close(self, remove: bool = False) -> None:
+        """ Close the snapshot file.
+
+        :param remove: Also remove the file if True.
+        """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+            os.close(self._fd)
+        if remove:
+            try:
+                os.remove(self.file_name)
+            except FileNotFoundError:
+                pass
+
+
+class SnapshotReader:
+    """ Read consistent snapshots from the snapshot file.
+    """
+    retries: int = 1000
+
+    def __init__(self, file_name: Optional[str] = None):
+        """
+        :param file_name: Path of the snapshot file, defaults to default_snapshot_path().
+        :raises OSError: If the file can not be opened or is not a snapshot file.
+        """
+        self.file_name: str = file_name or default_snapshot_path()
+        self._inode: int = 0
+        self._map: mmap.mmap = self._open()
+
+    def __repr__(self) -> str:
+        return 'SnapshotReader: {}'.format(self.file_name)
+
+    def _open(self) -> mmap.mmap:
+        """ Map the current snapshot file.
+
+        :return: Read-only mmap of the file.
+        :raises OSError: If the file can not be opened or is not a snapshot file.
+        """
+        with open(self.file_name, 'rb') as snapshot_file:
+            snapshot_map = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._inode = os.fstat(snapshot_file.fileno()).st_ino
+        magic, _, _, _, record_size = HEADER.unpack_from(snapshot_map, 0)
+        if magic != MAGIC or record_size != RECORD.size:
+            snapshot_map.close()
+            raise OSError('Error: [{}] is not a compatible UPS snapshot file'.format(self.file_name))
+        return snapshot_map
+
+    def _remap(self) -> None:
+        self._map.close()
+        self._map = self._open()
+
+    def _check_file(self) -> None:
+        """ Map the file again if the writer has replaced it.  If the file is missing, the old
+            snapshot is kept, and its age shows it is not updated.
+        """
+        try:
+            inode = os.stat(self.file_name).st_ino
+        except FileNotFoundError:
+            return
+        if inode != self._inode:
+            LOGGER.debug('Snapshot file [%s] replaced, mapping new file', self.file_name)
+            self._remap()
+
+    def read_raw(self) -> Tuple[float, bytes]:
+        """ Copy the records of a consistent snapshot.
+
+        :return: Tuple of write time and packed records.
+        :raises TimeoutError: If no consistent snapshot could be read.
+        """
+        self._check_file()
+        for attempt in range(self.retries):
+            _, sequence, write_time, num_ups, _ = HEADER.unpack_from(self._map, 0)
+            if sequence & 1:
+                if attempt > 10: sleep(0)
+                continue
+            end = HEADER.size + num_ups * RECORD.size
+            if end > len(self._map):
+                self._remap()
+                continue
+            payload = self._map[HEADER.size:end]
+            if SEQUENCE.unpack_from(self._map, SEQUENCE_OFFSET)[0] == sequence:
+                return write_time, payload
+        raise TimeoutError('Error: could not read consistent snapshot from [{}]'.format(self.file_name))
+
+    def read(self) -> Tuple[float, List[Dict[Union[str, MiB], Any]]]:
+        """ Read a consistent snapshot and decode the values of all UPSs.
+
+        :return: Tuple of write time and list of dictionaries of values for each UPS.
+        """
+        write_time, payload = self.read_raw()
+        upss = []
+        num_strings = len(STRING_FIELDS)
+        for record in RECORD.iter_unpack(payload):
+            values: Dict[Union[str, MiB], Any] = {name: bool(record[0] & (1 << index))
+                                                  for index, name in enumerate(FLAG_NAMES)}
+            for (key, _), value in zip(STRING_FIELDS, record[1:1 + num_strings]):
+                value = value.rstrip(b'\0').decode('utf-8', errors='replace')
+                values[key] = value if value else None
+            for mib, value in zip(NUMERIC_FIELDS, record[1 + num_strings:]):
+                values[mib] = None if math.isnan(value) else int(value) if value.is_integer() else value
+            upss.append(values)
+        return write_time, upss
+
+    def age(self) -> float:
+        """ Get the age of the latest snapshot.
+
+        :return: Seconds since the snapshot was written.
+        """
+        return time() - HEADER.unpack_from(self._map, 0)[2]
+
+    def close(self) -> None:
+        """ Unmap the snapshot file.
+        """
+        self._map.close()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" UPSshutdown  -  shutdown orchestration of protected hosts in waves
+
+    Targets are grouped in waves by priority, for example compute nodes in
+    wave 1 and storage in wave 2.  All targets of a wave are started at the
+    same time.  The next wave starts when every target of the wave has
+    acknowledged or its timeout has passed, so the wave deadline is the
+    longest timeout of its targets.  A target is either a command, which
+    acknowledges by exiting with status 0, or a TCP endpoint given as
+    tcp://HOST:PORT, which is sent the line "SHUTDOWN <ups name>" and
+    acknowledges by answering a line starting with "OK".  A plan can be
+    cancelled from another thread, and waves which have not started are then
+    skipped.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import re
+import shlex
+import asyncio
+import logging
+import threading
+from time import monotonic
+from itertools import groupby
+from typing import Callable, Dict, List, NamedTuple, Iterable, Optional
+from UPSmodules.UPSboinc import parse_host
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+class ShutdownTarget(NamedTuple):
+    """ A protected host or service to be shut down.
+    """
+    name: str
+    wave: int
+    timeout: float
+    action: str
+
+
+class TargetResult(NamedTuple):
+    """ Outcome of the shutdown action of one target.
+    """
+    name: str
+    wave: int
+    acknowledged: bool
+    seconds: float
+    message: str
+
+
+def parse_target(name: str, value: str) -> ShutdownTarget:
+    """ Parse a target definition of the form: wave, timeout_seconds, command or tcp://HOST:PORT
+
+    :param name: Name of the target.
+    :param value: Target definition.
+    :return: The target.
+    :raises ValueError: If the definition is invalid.
+    """
+    items = [item.strip() for item in value.split(',', 2)]
+    if len(items) != 3 or not items[2]:
+        raise ValueError('expected: wave, timeout_seconds, command or tcp://HOST:PORT')
+    wave, timeout = int(items[0]), float(items[1])
+    if wave < 0 or timeout <= 0:
+        raise ValueError('wave must be >= 0 and timeout > 0')
+    if items[2].startswith('tcp://'):
+        parse_host(items[2][6:])
+    else:
+        shlex.split(items[2])
+    return ShutdownTarget(name, wave, timeout, items[2])
+
+
+class ShutdownPlan:
+    """ Ordered waves of shutdown targets, with concurrent actions within each wave.
+    """
+    def __init__(self, targets: Iterable[ShutdownTarget], ups_name: str = 'ups', request: str = 'SHUTDOWN'):
+        """
+        :param targets: Shutdown targets.
+        :param ups_name: Name of the UPS sent to TCP targets.
+        :param request: Request word sent to TCP targets.
+        """
+        self.targets: List[ShutdownTarget] = sorted(targets, key=lambda target: (target.wave, target.name))
+        self.ups_name: str = re.sub(r'\s+', '_', ups_name)
+        self.request: str = request
+        self.cancelled = threading.Event()
+
+    def __repr__(self) -> str:
+        return 'ShutdownPlan: {} targets in {} waves'.format(len(self.targets), len(self.waves()))
+
+    def waves(self) -> Dict[int, List[ShutdownTarget]]:
+        """ Get the targets grouped by wave.
+
+        :return: Dictionary of target lists by wave, in wave order.
+        """
+        return {wave: list(targets) for wave, targets in groupby(self.targets, key=lambda target: target.wave)}
+
+    async def _command(self, target: ShutdownTarget) -> str:
+        process = await asyncio.create_subprocess_exec(*shlex.split(target.action), stdin=asyncio.subprocess.DEVNULL,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT)
+        try:
+            output = (await process.communicate())[0]
+        except asyncio.CancelledError:
+            process.kill()
+            await process.wait()
+            raise
+        message = output.decode('utf-8', errors='replace').strip()
+        if process.returncode:
+            raise ChildProcessError('exit status {} {}'.format(process.returncode, message).strip())
+        return message
+
+    async def _tcp(self, target: ShutdownTarget) -> str:
+        reader, writer = await asyncio.open_connection(*parse_host(target.action[6:]))
+        try:
+            writer.write('{} {}\n'.format(self.request, self.ups_name).encode('utf-8'))
+            await writer.drain()
+            reply = (await reader.readline()).decode('utf-8', errors='replace').strip()
+        finally:
+            writer.close()
+        if not reply.startswith('OK'):
+            raise ConnectionError('no acknowledgement: [{}]'.format(reply))
+        return reply
+
+    async def _run_target(self, target: ShutdownTarget) -> TargetResult:
+        start_time = monotonic()
+        action = self._tcp if target.action.startswith('tcp://') else self._command
+        try:
+            message = await asyncio.wait_for(action(target), target.timeout)
+            acknowledged = True
+        except asyncio.TimeoutError:
+            acknowledged, message = False, 'timeout after {}s'.format(target.timeout)
+        except (OSError, ChildProcessError, ValueError) as error:
+            acknowledged, message = False, '{}: {}'.format(type(error).__name__, error)
+        return TargetResult(target.name, target.wave, acknowledged, monotonic() - start_time, message)
+
+    async def _run(self, report: Optional[Callable[[TargetResult], None]]) -> List[TargetResult]:
+        results: List[TargetResult] = []
+        for wave, targets in self.waves().items():
+            if self.cancelled.is_set():
+                LOGGER.debug('Shutdown cancelled before wave %s', wave)
+                break
+            LOGGER.debug('Shutdown wave %s: %s', wave, [target.name for target in targets])
+            wave_results = await asyncio.gather(*(self._run_target(target) for target in targets))
+            if report:
+                for result in wave_results: report(result)
+            results.extend(wave_results)
+        return results
+
+    def run(self, report: Optional[Callable[[TargetResult], None]] = None) -> List[TargetResult]:
+        """ Run all waves in order and wait for the last one to complete, or for the wave in
+            progress when the plan is cancelled.
+
+        :param report: Function called with the result of each target as its wave completes.
+        :return: Results of all targets run, in wave order.
+        """
+        return asyncio.run(self._run(report))
+
+    def new_run(self) -> 'ShutdownPlan':
+        """ Get a copy of the plan with its own cancel flag, for one run of the shutdown.
+
+        :return: The new plan.
+        """
+        return ShutdownPlan(self.targets, self.ups_name, self.request)
+
+    def cancel(self) -> None:
+        """ Skip the waves which have not started.  Targets of the wave in progress complete.
+        """
+        self.cancelled.set()
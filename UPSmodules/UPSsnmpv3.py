@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+""" UPSsnmpv3  -  SNMPv3 user based security for snmp requests to UPSs
+
+    With SNMPv3, each net-snmp command would normally convert the passwords
+    to keys, hashing one megabyte of the repeated password as in RFC 3414,
+    and discover the engine ID, boots, and time of the agent with an extra
+    round trip before the request.  Here, the master keys are computed once
+    per password, and localized once per engine ID and cached.  The engine
+    ID, boots, and time of each management card are discovered once with a
+    single discovery request, and the engine time is maintained locally.
+    Each request is then given the engine parameters and localized keys, so
+    it costs the same single round trip as an SNMPv2c request.  After a
+    failed request, the engine is discovered again, in case the card has
+    rebooted.  Passwords and keys are not given on the command line, where
+    other users could read them, but in a snmp.conf file in a private
+    directory, which net-snmp reads from SNMPCONFPATH.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import atexit
+import shutil
+import socket
+import random
+import logging
+import tempfile
+import threading
+from time import monotonic
+from typing import Dict, List, Tuple, Optional, Any
+from UPSmodules.UPSshm import runtime_dir
+
+LOGGER = logging.getLogger('ups-utils')
+
+# net-snmp protocol names and their hash functions
+AUTH_PROTOCOLS: Dict[str, str] = {'MD5': 'md5', 'SHA': 'sha1', 'SHA-224': 'sha224', 'SHA-256': 'sha256',
+                                  'SHA-384': 'sha384', 'SHA-512': 'sha512'}
+PRIV_PROTOCOLS: Tuple[str, ...] = ('DES', 'AES')
+SNMP_PORT = 161
+# Length of the repeated password hashed to a master key, RFC 3414 A.2
+PASSWORD_EXPANSION = 1048576
+
+_key_lock = threading.Lock()
+_master_keys: Dict[Tuple[str, str], bytes] = {}
+_localized_keys: Dict[Tuple[str, str, bytes], bytes] = {}
+
+
+def master_key(password: str, hash_name: str) -> bytes:
+    """ Convert a password to a master key, computed once per password.
+
+    :param password: Authentication or privacy password.
+    :param hash_name: Name of the hashlib hash of the authentication protocol.
+    :return: The master key.
+    """
+    with _key_lock:
+        key = _master_keys.get((hash_name, password))
+    if key is None:
+        # Only SNMPv3 needs hashlib, so it is not imported by SNMPv2c commands.
+        import hashlib
+        data = password.encode('utf-8')
+        repeated = data * (PASSWORD_EXPANSION // len(data) + 1)
+        key = hashlib.new(hash_name, repeated[:PASSWORD_EXPANSION]).digest()
+        with _key_lock:
+            _master_keys[(hash_name, password)] = key
+    return key
+
+
+def localized_key(password: str, hash_name: str, engine_id: bytes) -> bytes:
+    """ Get a key localized to an engine ID, computed once per engine ID.
+
+    :param password: Authentication or privacy password.
+    :param hash_name: Name of the hashlib hash of the authentication protocol.
+    :param engine_id: Authoritative engine ID of the agent.
+    :return: The localized key.
+    """
+    with _key_lock:
+        key = _localized_keys.get((hash_name, password, engine_id))
+    if key is None:
+        import hashlib
+        master = master_key(password, hash_name)
+        key = hashlib.new(hash_name, master + engine_id + master).digest()
+        with _key_lock:
+            _localized_keys[(hash_name, password, engine_id)] = key
+    return key
+
+
+def _encode(tag: int, value: bytes) -> bytes:
+    """ Encode a BER type, length, and value. """
+    length = len(value)
+    if length < 0x80: return bytes((tag, length)) + value
+    length_bytes = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes((tag, 0x80 | len(length_bytes))) + length_bytes + value
+
+
+def _integer(value: int) -> bytes:
+    return _encode(0x02, value.to_bytes(value.bit_length() // 8 + 1, 'big', signed=True))
+
+
+def _decode(data: bytes, offset: int = 0) -> Tuple[int, bytes, int]:
+    """ Decode one BER type, length, and value.
+
+    :return: Tuple of the tag, the value, and the offset after the value.
+    :raises ValueError: If the data is truncated.
+    """
+    tag, length = data[offset], data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        length = int.from_bytes(data[offset:offset + count], 'big')
+        offset += count
+    if offset + length > len(data): raise ValueError('truncated BER value')
+    return tag, data[offset:offset + length], offset + length
+
+
+def _children(data: bytes) -> List[Tuple[int, bytes]]:
+    """ Decode the members of a BER sequence. """
+    members, offset = [], 0
+    while offset < len(data):
+        tag, value, offset = _decode(data, offset)
+        members.append((tag, value))
+    return members
+
+
+def discovery_message(message_id: int) -> bytes:
+    """ Build the unauthenticated request which makes an agent report its engine ID, boots, and time. """
+    header = _encode(0x30, _integer(message_id) + _integer(65507) + _encode(0x04, b'\x04') + _integer(3))
+    usm = _encode(0x04, _encode(0x30, _encode(0x04, b'') + _integer(0) + _integer(0) +
+                                _encode(0x04, b'') + _encode(0x04, b'') + _encode(0x04, b'')))
+    pdu = _encode(0xa0, _integer(message_id) + _integer(0) + _integer(0) + _encode(0x30, b''))
+    scoped_pdu = _encode(0x30, _encode(0x04, b'') + _encode(0x04, b'') + pdu)
+    return _encode(0x30, _integer(3) + header + usm + scoped_pdu)
+
+
+class EngineState:
+    """ Engine ID, boots, and time of the agent of one management card.
+    """
+    def __init__(self, engine_id: bytes, boots: int, engine_time: int):
+        """
+        :param engine_id: Authoritative engine ID.
+        :param boots: Engine boots.
+        :param engine_time: Engine time in seconds when discovered.
+        """
+        self.engine_id: bytes = engine_id
+        self.boots: int = boots
+        self.time: int = engine_time
+        self.discovered: float = monotonic()
+        self.stale: bool = False
+
+    def __repr__(self) -> str:
+        return 'EngineState: {} boots {} time {}'.format(self.engine_id.hex(), self.boots, self.engine_time())
+
+    def engine_time(self) -> int:
+        """ Get the present engine time, maintained from the discovered time. """
+        return self.time + int(monotonic() - self.discovered)
+
+    @classmethod
+    def parse(cls, response: bytes) -> Optional['EngineState']:
+        """ Get the engine state from the report of an agent to a discovery request.
+
+        :param response: The response datagram.
+        :return: The engine state, or None if the response is not a valid SNMPv3 report.
+        """
+        try:
+            _, message, _ = _decode(response)
+            version, _, (_, security) = _children(message)[:3]
+            if int.from_bytes(version[1], 'big') != 3: return None
+            _, usm, _ = _decode(security)
+            engine_id, boots, engine_time = (value for _, value in _children(usm)[:3])
+        except (ValueError, IndexError, TypeError):
+            return None
+        if not engine_id: return None
+        return cls(engine_id, int.from_bytes(boots, 'big'), int.from_bytes(engine_time, 'big'))
+
+
+def discover_engine(address: str, port: int = SNMP_PORT, timeout: float = 1.0, retries: int = 1) -> Optional[EngineState]:
+    """ Discover the engine ID, boots, and time of an agent with one request.
+
+    :param address: IP address of the agent.
+    :param port: UDP port of the agent.
+    :param timeout: Timeout in seconds of each attempt.
+    :param retries: Number of retries.
+    :return: The engine state, or None if the agent does not answer.
+    """
+    address = address.strip('[]')
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    message_id = random.randint(1, 0x7fffffff)
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        for _ in range(retries + 1):
+            try:
+                sock.sendto(discovery_message(message_id), (address, port))
+                response, _ = sock.recvfrom(65535)
+            except OSError as error:
+                LOGGER.debug('SNMPv3 discovery of %s: %s', address, error)
+                continue
+            engine = EngineState.parse(response)
+            if engine:
+                LOGGER.debug('SNMPv3 discovery of %s: %s', address, engine)
+                return engine
+    return None
+
+
+class UsmCredentials:
+    """ SNMPv3 user and keys of a UPS, and the net-snmp options of its requests.
+    """
+    def __init__(self, user: str, auth_protocol: Optional[str] = None, auth_password: Optional[str] = None,
+                 priv_protocol: Optional[str] = None, priv_password: Optional[str] = None):
+        """
+        :param user: Security name.
+        :param auth_protocol: Authentication protocol, SHA if an authentication password is given.
+        :param auth_password: Authentication password, no authentication if None.
+        :param priv_protocol: Privacy protocol, AES if a privacy password is given.
+        :param priv_password: Privacy password, no privacy if None.
+        :raises ValueError: If the parameters are invalid.
+        """
+        if not user: raise ValueError('snmp_user is required for SNMPv3')
+        self.user: str = user
+        self.auth_protocol: Optional[str] = (auth_protocol or 'SHA').upper() if auth_password else None
+        self.priv_protocol: Optional[str] = (priv_protocol or 'AES').upper() if priv_password else None
+        if self.auth_protocol and self.auth_protocol not in AUTH_PROTOCOLS:
+            raise ValueError('snmp_auth_protocol must be one of {}'.format(list(AUTH_PROTOCOLS)))
+        if self.priv_protocol and self.priv_protocol not in PRIV_PROTOCOLS:
+            raise ValueError('snmp_priv_protocol must be one of {}'.format(list(PRIV_PROTOCOLS)))
+        if self.priv_protocol and not self.auth_protocol:
+            raise ValueError('snmp_priv_password requires snmp_auth_password')
+        for password in (auth_password, priv_password):
+            if password is not None and len(password) < 8:
+                raise ValueError('SNMPv3 passwords must have at least 8 characters')
+            if password is not None and '\n' in password:
+                raise ValueError('SNMPv3 passwords must be on one line')
+        self.auth_password: Optional[str] = auth_password
+        self.priv_password: Optional[str] = priv_password
+        # Private config directories by engine ID, b'' for passwords without an engine.
+        self._config_dirs: Dict[bytes, str] = {}
+        self._config_lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return 'UsmCredentials: {} {}'.format(self.user, self.security_level())
+
+    @classmethod
+    def from_prm(cls, prm: Dict[str, Any]) -> Optional['UsmCredentials']:
+        """ Create the credentials from the ups-config.json values of a UPS.
+
+        :param prm: UpsItem parameters.
+        :return: The credentials, or None for SNMPv2c.
+        :raises ValueError: If the parameters are invalid.
+        """
+        if str(prm.get('snmp_version') or '2c') not in {'3', 'v3'}: return None
+        return cls(prm.get('snmp_user'), prm.get('snmp_auth_protocol'), prm.get('snmp_auth_password'),
+                   prm.get('snmp_priv_protocol'), prm.get('snmp_priv_password'))
+
+    def security_level(self) -> str:
+        """ Get the security level name. """
+        if self.priv_protocol: return 'authPriv'
+        return 'authNoPriv' if self.auth_protocol else 'noAuthNoPriv'
+
+    def args(self, engine: Optional[EngineState]) -> List[str]:
+        """ Get the net-snmp security options of a request.  The passwords or keys are read from
+            the config file of config_path.
+
+        :param engine: Engine state of the agent, or None to let net-snmp discover it.
+        :return: List of options.
+        """
+        args = ['-v3', '-l', self.security_level(), '-u', self.user]
+        if self.auth_protocol: args += ['-a', self.auth_protocol]
+        if self.priv_protocol: args += ['-x', self.priv_protocol]
+        if engine:
+            args += ['-e', '0x' + engine.engine_id.hex(), '-Z', '{},{}'.format(engine.boots, engine.engine_time())]
+        return args
+
+    def config(self, engine: Optional[EngineState]) -> str:
+        """ Get the snmp.conf lines with the passwords, or with the keys localized to the engine.
+
+        :param engine: Engine state of the agent, or None to let net-snmp discover it.
+        :return: Content of the config file.
+        """
+        lines = []
+        if not engine:
+            for directive, password in (('defAuthPassphrase', self.auth_password if self.auth_protocol else None),
+                                        ('defPrivPassphrase', self.priv_password if self.priv_protocol else None)):
+                if password is None: continue
+                lines.append('{} "{}"'.format(directive, password.replace('\\', '\\\\').replace('"', '\\"')))
+        elif self.auth_protocol:
+            hash_name = AUTH_PROTOCOLS[self.auth_protocol]
+            lines.append('defAuthLocalizedKey 0x' + localized_key(self.auth_password, hash_name, engine.engine_id).hex())
+            if self.priv_protocol:
+                # Privacy keys are localized with the hash of the authentication protocol.
+                lines.append('defPrivLocalizedKey 0x' +
+                             localized_key(self.priv_password, hash_name, engine.engine_id).hex())
+        return ''.join(line + '\n' for line in lines)
+
+    def config_path(self, engine: Optional[EngineState]) -> Optional[str]:
+        """ Get the directory of the snmp.conf file of a request, written once per engine in a new
+            mode 0700 directory in the runtime directory, and removed at exit.
+
+        :param engine: Engine state of the agent, or None to let net-snmp discover it.
+        :return: Path of the directory for SNMPCONFPATH, or None without authentication.
+        :raises OSError: If the file can not be written.
+        """
+        if not self.auth_protocol: return None
+        key = engine.engine_id if engine else b''
+        with self._config_lock:
+            path = self._config_dirs.get(key)
+            if path: return path
+            path = tempfile.mkdtemp(prefix='ups-utils-snmpv3-', dir=runtime_dir())
+            try:
+                fd = os.open(os.path.join(path, 'snmp.conf'), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW,
+                             0o600)
+                with open(fd, 'w', encoding='utf-8') as config_file:
+                    config_file.write(self.config(engine))
+            except OSError:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+            if not self._config_dirs: atexit.register(self.remove_config)
+            self._config_dirs[key] = path
+        return path
+
+    def remove_config(self) -> None:
+        """ Remove the config files with the passwords and keys.
+        """
+        with self._config_lock:
+            for path in self._config_dirs.values():
+                shutil.rmtree(path, ignore_errors=True)
+            self._config_dirs.clear()
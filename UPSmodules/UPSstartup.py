@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+""" UPSstartup  -  import time benchmark of the ups-utils commands
+
+    ups-ls is run every few seconds by health checks, so its start up cost is
+    paid thousands of times a day.  Each command is run with python -X
+    importtime and --help, which exits as soon as the imports of the command
+    are done, and its import time, less the import time of the interpreter
+    start up, is compared to the budget of the command.  A warm up run writes
+    the bytecode cache to a scratch directory, as an installed package has
+    one, and the fastest of several runs is used, so other load on the host
+    does not fail the benchmark.
+
+    Usage: python3 -m UPSmodules.UPSstartup [--runs N] [--scale X] [--top N] [command ...]
+
+    The exit status is 1 if any command is over its budget.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List, Tuple, NamedTuple, Optional
+
+# Import time budgets in milliseconds, for a typical desktop.  Use --scale for slower hosts.
+BUDGETS: Dict[str, float] = {'ups-ls': 90.0, 'ups-mon': 100.0, 'ups-daemon': 200.0}
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+
+
+class ImportTime(NamedTuple):
+    """ One line of python -X importtime output.
+    """
+    self_us: int
+    cumulative_us: int
+    depth: int
+    name: str
+
+
+def parse_import_times(output: str) -> List[ImportTime]:
+    """ Parse the output of python -X importtime.
+
+    :param output: The stderr of the python process.
+    :return: List of imports in completion order.
+    """
+    times = []
+    for line in output.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            times.append(ImportTime(int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2,
+                                    match.group(4)))
+    return times
+
+
+def total_ms(times: List[ImportTime]) -> float:
+    """ Get the total import time from the imports at the top level.
+
+    :param times: Parsed import times.
+    :return: Time in milliseconds.
+    """
+    return sum(item.cumulative_us for item in times if item.depth == 0) / 1000.0
+
+
+def command_path(command: str) -> Optional[str]:
+    """ Get the path of a command, from the repository if run there, else from PATH.
+
+    :param command: Command name.
+    :return: Path of the command, or None if not found.
+    """
+    repository_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', command)
+    if os.path.isfile(repository_path): return repository_path
+    return shutil.which(command)
+
+
+class ImportBenchmark:
+    """ Import time measurement of commands, with a private bytecode cache.
+    """
+    def __init__(self, runs: int = 5):
+        """
+        :param runs: Number of measured runs of each command, the fastest is used.
+        """
+        self.runs: int = runs
+        self.cache_dir = tempfile.TemporaryDirectory(prefix='ups-utils-pycache-')
+        self.env: Dict[str, str] = {key: value for key, value in os.environ.items()
+                                    if key != 'PYTHONDONTWRITEBYTECODE'}
+        self.baseline: List[ImportTime] = self.measure([sys.executable, '-c', 'pass'])
+
+    def __repr__(self) -> str:
+        return 'ImportBenchmark: {} runs, start up {:.1f}ms'.format(self.runs, total_ms(self.baseline))
+
+    def _run(self, args: List[str]) -> List[ImportTime]:
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-X', 'pycache_prefix={}'.format(
+            self.cache_dir.name), *args[1:]], env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                check=False, text=True, timeout=60)
+        return parse_import_times(result.stderr)
+
+    def measure(self, args: List[str]) -> List[ImportTime]:
+        """ Measure the imports of a python command line.
+
+        :param args: Command line, starting with the python executable.
+        :return: Import times of the fastest run.
+        """
+        self._run(args)
+        return min((self._run(args) for _ in range(self.runs)), key=total_ms)
+
+    def command(self, command: str) -> Tuple[float, List[ImportTime]]:
+        """ Measure the imports of a ups-utils command, less the imports of the interpreter start up.
+
+        :param command: Command name.
+        :return: Tuple of the import time in milliseconds and the import times of the command.
+        :raises FileNotFoundError: If the command is not found.
+        """
+        path = command_path(command)
+        if not path: raise FileNotFoundError('command not found: {}'.format(command))
+        startup = {item.name for item in self.baseline}
+        times = [item for item in self.measure([sys.executable, path, '--help']) if item.name not in startup]
+        return total_ms(times), times
+
+    def close(self) -> None:
+        """ Remove the bytecode cache.
+        """
+        self.cache_dir.cleanup()
+
+
+def main() -> int:
+    """ Run the benchmark and report the commands over budget.
+
+    :return: Exit status, 1 if any command is over its budget.
+    """
+    parser = argparse.ArgumentParser(prog='python3 -m UPSmodules.UPSstartup')
+    parser.add_argument('commands', nargs='*', default=list(BUDGETS), help='Commands to measure')
+    parser.add_argument('--runs', help='Measured runs of each command', type=int, default=5)
+    parser.add_argument('--scale', help='Multiply the budgets, for slower hosts', type=float, default=1.0)
+    parser.add_argument('--top', help='Show the N slowest top level imports of each command', type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark = ImportBenchmark(max(args.runs, 1))
+    status = 0
+    try:
+        print('Interpreter start up: {:.1f}ms'.format(total_ms(benchmark.baseline)))
+        for command in args.commands:
+            try:
+                import_ms, times = benchmark.command(command)
+            except (OSError, subprocess.SubprocessError) as error:
+                print('{:<12} error: {}'.format(command, error))
+                status = 1
+                continue
+            budget = BUDGETS.get(command, 0.0) * args.scale
+            over = bool(budget) and import_ms > budget
+            if over: status = 1
+            print('{:<12} {:7.1f}ms  budget {:7.1f}ms  {}'.format(
+                command, import_ms, budget, 'OVER' if over else 'ok' if budget else 'no budget'))
+            top_level = sorted((item for item in times if item.depth == 0), key=lambda item: item.cumulative_us,
+                               reverse=True)
+            for item in top_level[:args.top]:
+                print('    {:7.1f}ms  {}'.format(item.cumulative_us / 1000.0, item.name))
+    finally:
+        benchmark.close()
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
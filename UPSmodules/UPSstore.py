@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+""" UPSstore  -  on-disk time series store for long term UPS history
+
+    Readings are stored in a directory tree with one file per UPS, metric and
+    resolution:
+
+        <store_path>/<ups name>/<resolution>/<metric>.ts
+
+    Each file has a 16 byte header followed by fixed width little endian
+    records in time order.  Raw records are (time, value) and roll-up records
+    are (bucket time, min, max, mean, count), all as doubles.  Since records
+    are fixed width and sorted, the file itself is the time index and range
+    queries are a binary search over a read-only mmap of the file.  Files are
+    only ever appended to, except when retention trims old records.  Only the
+    most recently used files are kept open, so the number of file descriptors
+    does not grow with the number of UPSs.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import re
+import math
+import mmap
+import struct
+import logging
+from array import array
+from collections import OrderedDict
+from time import time
+from typing import Dict, List, Tuple, Optional, Mapping, Any
+from UPSmodules.UPSKeys import MiB
+from UPSmodules.UPShistory import UpsHistory
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+
+class TsFile:
+    """ A single append-only file of fixed width records of doubles, the first being the time.
+    """
+    MAGIC: bytes = b'UPSTS001'
+    _header = struct.Struct('<8sII')
+
+    def __init__(self, path: str, num_fields: int):
+        """ Open or create the file.
+
+        :param path: Path of the file.
+        :param num_fields: Number of double fields in each record, including time.
+        """
+        self.path: str = path
+        self.num_fields: int = num_fields
+        self.record = struct.Struct('<{}d'.format(num_fields))
+        self.header_size: int = self._header.size
+        self._mmap: Optional[mmap.mmap] = None
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._fd: int = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o640)
+        size = os.fstat(self._fd).st_size
+        if size < self.header_size:
+            os.ftruncate(self._fd, 0)
+            os.write(self._fd, self._header.pack(self.MAGIC, self.record.size, 0))
+        else:
+            magic, record_size, _ = self._header.unpack(os.pread(self._fd, self.header_size, 0))
+            if magic != self.MAGIC or record_size != self.record.size:
+                os.close(self._fd)
+                raise ValueError('Error: [{}] is not a compatible time series file'.format(path))
+            # Drop any partial record left by an interrupted write.
+            extra = (size - self.header_size) % self.record.size
+            if extra:
+                os.ftruncate(self._fd, size - extra)
+
+    def __len__(self) -> int:
+        return (os.fstat(self._fd).st_size - self.header_size) // self.record.size
+
+    def close(self) -> None:
+        """ Release the mmap and file descriptor.
+        """
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        os.close(self._fd)
+
+    def append(self, *fields: float) -> None:
+        """ Append a single record.
+
+        :param fields: Values of all fields of the record, starting with time.
+        """
+        os.write(self._fd, self.record.pack(*fields))
+
+    def _map(self) -> Optional[mmap.mmap]:
+        """ Get a read-only mmap of the current file contents, remapping if the file has grown.
+
+        :return: mmap object or None if the file has no records.
+        """
+        size = os.fstat(self._fd).st_size
+        if self._mmap is not None and len(self._mmap) == size:
+            return self._mmap
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if size <= self.header_size:
+            return None
+        self._mmap = mmap.mmap(self._fd, size, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _time_at(self, mem: mmap.mmap, index: int) -> float:
+        """ Read the time field of the record at the given index.
+        """
+        return struct.unpack_from('<d', mem, self.header_size + index * self.record.size)[0]
+
+    def bisect(self, timestamp: float) -> int:
+        """ Find the index of the first record with time >= timestamp.
+
+        :param timestamp: Target time.
+        :return: Record index.
+        """
+        mem = self._map()
+        if mem is None: return 0
+        low, high = 0, (len(mem) - self.header_size) // self.record.size
+        while low < high:
+            mid = (low + high) // 2
+            if self._time_at(mem, mid) < timestamp:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def last(self) -> Optional[Tuple[float, ...]]:
+        """ Get the last record in the file.
+
+        :return: Tuple of fields or None if empty.
+        """
+        mem = self._map()
+        if mem is None: return None
+        return self.record.unpack_from(mem, len(mem) - self.record.size)
+
+    def read_range(self, start: float, end: float) -> array:
+        """ Read all records with start <= time < end.
+
+        :param start: Start time.
+        :param end: End time.
+        :return: Flat array of doubles with num_fields values per record.
+        """
+        result = array('d')
+        mem = self._map()
+        if mem is None: return result
+        first = self.bisect(start)
+        last = self.bisect(end)
+        if last > first:
+            result.frombytes(mem[self.header_size + first * self.record.size:
+                                 self.header_size + last * self.record.size])
+        return result
+
+    def trim_before(self, timestamp: float) -> int:
+        """ Remove all records older than timestamp by atomically rewriting the file.
+
+        :param timestamp: Cutoff time.
+        :return: Number of records removed.
+        """
+        first = self.bisect(timestamp)
+        if not first: return 0
+        mem = self._map()
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'wb') as tmp_file:
+            tmp_file.write(mem[:self.header_size])
+            tmp_file.write(mem[self.header_size + first * self.record.size:])
+        self._mmap.close()
+        self._mmap = None
+        os.close(self._fd)
+        os.replace(tmp_path, self.path)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+        return first
+
+
+class Rollup:
+    """ Accumulator for min, max and mean of samples within a fixed time bucket.
+    """
+    __slots__ = ('bucket', 'minimum', 'maximum', 'total', 'count')
+
+    def __init__(self, bucket: float):
+        self.bucket: float = bucket
+        self.minimum: float = math.inf
+        self.maximum: float = -math.inf
+        self.total: float = 0.0
+        self.count: int = 0
+
+    def add(self, value: float) -> None:
+        """ Add a value to the bucket """
+        if value < self.minimum: self.minimum = value
+        if value > self.maximum: self.maximum = value
+        self.total += value
+        self.count += 1
+
+    def fields(self) -> Tuple[float, float, float, float, float]:
+        """ Return the fields of the roll-up record """
+        return self.bucket, self.minimum, self.maximum, self.total / self.count, float(self.count)
+
+
+class TimeSeriesStore:
+    """ Store of raw and rolled-up readings for all UPSs and metrics.
+    """
+    RAW: str = 'raw'
+    # Resolution name: (bucket size in seconds, number of fields)
+    resolutions: Dict[str, Tuple[int, int]] = {RAW: (0, 2), '1m': (60, 5), '1h': (3600, 5)}
+    default_retention: Dict[str, int] = {RAW: 7 * 86400, '1m': 90 * 86400, '1h': 5 * 365 * 86400}
+    retention_interval: int = 3600
+    # Most files open at once, least recently used files are closed first.  By default, the
+    # RLIMIT_NOFILE limit less reserved_files, so the series of all UPSs usually stay open.
+    max_open_files: Optional[int] = None
+    # Descriptors left for sockets, pipes of snmp requests, and log files.
+    reserved_files: int = 256
+    metrics: Tuple[MiB, ...] = UpsHistory.history_mibs
+
+    def __init__(self, store_path: str, retention: Optional[Dict[str, int]] = None):
+        """ Open a store at the given path, creating it if needed.
+
+        :param store_path: Root directory of the store.
+        :param retention: Seconds of data to keep for each resolution.
+        """
+        self.store_path: str = os.path.abspath(os.path.expanduser(store_path))
+        self.retention: Dict[str, int] = self.default_retention.copy()
+        if retention: self.retention.update(retention)
+        self._files: 'OrderedDict[Tuple[str, str, MiB], TsFile]' = OrderedDict()
+        self._rollups: Dict[Tuple[str, str, MiB], Rollup] = {}
+        self._last_retention: float = 0.0
+        self.max_open_files: int = self.open_file_limit()
+        os.makedirs(self.store_path, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return 'TimeSeriesStore: {} ({}/{} open files)'.format(self.store_path, len(self._files),
+                                                               self.max_open_files)
+
+    @classmethod
+    def open_file_limit(cls) -> int:
+        """ Get the number of series files kept open.  Each UPS has a file per metric and
+            resolution, so the soft RLIMIT_NOFILE limit is raised to the hard limit, at most
+            65536, and all but reserved_files descriptors are used for the store.
+
+        :return: Maximum number of open files.
+        """
+        if cls.max_open_files: return cls.max_open_files
+        limit = 1024
+        try:
+            import resource
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            limit = 65536 if hard == resource.RLIM_INFINITY else min(hard, 65536)
+            if soft == resource.RLIM_INFINITY or soft >= limit:
+                limit = 65536 if soft == resource.RLIM_INFINITY else soft
+            else:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+        except (ImportError, ValueError, OSError) as error:
+            LOGGER.debug('RLIMIT_NOFILE not raised: %s', error)
+        return max(limit - cls.reserved_files, 64)
+
+    @staticmethod
+    def ups_key(ups_name: str) -> str:
+        """ Convert a UPS display name into a directory name.
+
+        :param ups_name: UPS display name.
+        :return: A file system safe name.
+        """
+        return re.sub(r'[^\w.-]', '_', ups_name)
+
+    def ups_names(self) -> List[str]:
+        """ Get the UPS keys present in the store.
+
+        :return: List of UPS keys
+        """
+        return sorted(entry for entry in os.listdir(self.store_path)
+                      if os.path.isdir(os.path.join(self.store_path, entry)))
+
+    def _file(self, ups_key: str, resolution: str, metric: MiB) -> TsFile:
+        """ Get the open TsFile object for the given series, opening it if needed.  The least
+            recently used file is closed when more than max_open_files are open.
+        """
+        key = (ups_key, resolution, metric)
+        ts_file = self._files.get(key)
+        if ts_file is not None:
+            self._files.move_to_end(key)
+            return ts_file
+        while len(self._files) >= self.max_open_files:
+            _, lru_file = self._files.popitem(last=False)
+            lru_file.close()
+        path = os.path.join(self.store_path, ups_key, resolution, '{}.ts'.format(metric.name))
+        ts_file = self._files[key] = TsFile(path, self.resolutions[resolution][1])
+        return ts_file
+
+    def close(self) -> None:
+        """ Write out partial roll-ups and close all files.
+        """
+        for key, rollup in self._rollups.items():
+            if rollup.count:
+                self._file(*key).append(*rollup.fields())
+        self._rollups.clear()
+        for ts_file in self._files.values():
+            ts_file.close()
+        self._files.clear()
+
+    def record(self, ups_name: str, readings: Mapping[Any, Any], timestamp: Optional[float] = None) -> None:
+        """ Record one set of readings for a UPS.
+
+        :param ups_name: UPS display name.
+        :param readings: Mapping of MiB to value, typically UpsItem.prm.
+        :param timestamp: Epoch time of the readings, defaults to now.
+        """
+        if timestamp is None: timestamp = time()
+        ups_key = self.ups_key(ups_name)
+        for metric in self.metrics:
+            try:
+                value = float(readings.get(metric))
+            except (TypeError, ValueError):
+                continue
+            if math.isnan(value): continue
+            self._file(ups_key, self.RAW, metric).append(timestamp, value)
+            for resolution, (bucket_size, _) in self.resolutions.items():
+                if not bucket_size: continue
+                self._add_rollup((ups_key, resolution, metric), bucket_size, timestamp, value)
+        if timestamp - self._last_retention > self.retention_interval:
+            self.apply_retention(timestamp)
+
+    def _add_rollup(self, key: Tuple[str, str, MiB], bucket_size: int, timestamp: float, value: float) -> None:
+        """ Add a value to the roll-up for the series, writing the previous bucket when a new one starts.
+        """
+        bucket = timestamp - timestamp % bucket_size
+        rollup = self._rollups.get(key)
+        if rollup is None:
+            # Do not rewrite a bucket already written before a restart.
+            last = self._file(*key).last()
+            if last and last[0] >= bucket: return
+            rollup = self._rollups[key] = Rollup(bucket)
+        elif rollup.bucket != bucket:
+            if bucket < rollup.bucket: return
+            if rollup.count:
+                self._file(*key).append(*rollup.fields())
+            rollup = self._rollups[key] = Rollup(bucket)
+        rollup.add(value)
+
+    def apply_retention(self, now: Optional[float] = None) -> int:
+        """ Trim records older than the retention period of their resolution from every series.
+
+        :param now: Reference time, defaults to now.
+        :return: Number of records removed.
+        """
+        if now is None: now = time()
+        self._last_retention = now
+        removed = 0
+        for ups_key in self.ups_names():
+            for resolution in self.resolutions:
+                res_path = os.path.join(self.store_path, ups_key, resolution)
+                if not os.path.isdir(res_path): continue
+                for file_name in os.listdir(res_path):
+                    metric_name, ext = os.path.splitext(file_name)
+                    if ext != '.ts' or metric_name not in MiB.__members__: continue
+                    ts_file = self._file(ups_key, resolution, MiB[metric_name])
+                    removed += ts_file.trim_before(now - self.retention[resolution])
+        if removed:
+            LOGGER.debug('Retention removed %s records from %s', removed, self.store_path)
+        return removed
+
+    def select_resolution(self, start: float, now: Optional[float] = None) -> str:
+        """ Select the finest resolution whose retention covers the given start time.
+
+        :param start: Start time of a query.
+        :param now: Reference time, defaults to now.
+        :return: Resolution name
+        """
+        if now is None: now = time()
+        for resolution in self.resolutions:
+            if now - self.retention[resolution] <= start:
+                return resolution
+        return list(self.resolutions)[-1]
+
+    def query(self, ups_name: str, metric: MiB, start: float, end: Optional[float] = None,
+              resolution: Optional[str] = None) -> Tuple[array, array]:
+        """ Get time and value arrays for a series over a time range.  For roll-up resolutions,
+            the value is the bucket mean.
+
+        :param ups_name: UPS display name.
+        :param metric: Target metric.
+        :param start: Start epoch time, inclusive.
+        :param end: End epoch time, exclusive.  Defaults to now.
+        :param resolution: One of raw, 1m, 1h.  Default selects based on retention.
+        :return: Tuple of time array and value array
+        """
+        if end is None: end = time()
+        if resolution is None: resolution = self.select_resolution(start)
+        records = self.query_records(ups_name, metric, start, end, resolution)
+        num_fields = self.resolutions[resolution][1]
+        value_field = 1 if num_fields == 2 else 3
+        return records[0::num_fields], records[value_field::num_fields]
+
+    def query_records(self, ups_name: str, metric: MiB, start: float, end: float, resolution: str) -> array:
+        """ Get all fields of the records for a series over a time range.
+
+        :param ups_name: UPS display name.
+        :param metric: Target metric.
+        :param start: Start epoch time, inclusive.
+        :param end: End epoch time, exclusive.
+        :param resolution: One of raw, 1m, 1h.
+        :return: Flat array of record fields.
+        """
+        if resolution not in self.resolutions:
+            raise KeyError('KeyError: invalid resolution: {}'.format(resolution))
+        ups_key = self.ups_key(ups_name)
+        path = os.path.join(self.store_path, ups_key, resolution, '{}.ts'.format(metric.name))
+        if (ups_key, resolution, metric) not in self._files and not os.path.isfile(path):
+            return array('d')
+        return self._file(ups_key, resolution, metric).read_range(start, end)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+""" UPSwatch  -  change detection of configuration files by polling their status
+
+    The status of the watched file is checked once per poll cycle, which
+    costs a single stat call, instead of with an inotify thread.  The file is
+    reported as changed when its inode, size, or modification times differ
+    from the last version reported.  A file modified within the settle time
+    is not reported until the next check, so a file which is still being
+    written by an editor is not read half written.  A file which is missing,
+    as during an editor's rename, is reported once it is back.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import os
+import logging
+from time import time
+from typing import Optional, Tuple
+
+LOGGER = logging.getLogger('ups-utils')
+
+FileSignature = Tuple[int, int, int, int]
+
+
+class FileWatcher:
+    """ Detect changes of one file from its status.
+    """
+    def __init__(self, path: str, settle: float = 1.0):
+        """
+        :param path: Path of the watched file.
+        :param settle: Seconds since the last modification before a change is reported.
+        """
+        self.path: str = path
+        self.settle: float = settle
+        self.signature: Optional[FileSignature] = self._signature()
+        self.changes: int = 0
+
+    def __repr__(self) -> str:
+        return 'FileWatcher: {}, {} changes'.format(self.path, self.changes)
+
+    def _signature(self) -> Optional[FileSignature]:
+        try:
+            status = os.stat(self.path)
+        except OSError:
+            return None
+        return status.st_ino, status.st_size, status.st_mtime_ns, status.st_ctime_ns
+
+    def changed(self) -> bool:
+        """ Check if the file has changed since the last change reported.
+
+        :return: True if the file has changed and settled.
+        """
+        signature = self._signature()
+        if signature == self.signature: return False
+        if signature is None:
+            # Removed, or being replaced.  Report the file when it is back.
+            self.signature = None
+            return False
+        if time() - signature[2] / 1e9 < self.settle:
+            LOGGER.debug('%s: modified, waiting to settle', self)
+            return False
+        self.signature = signature
+        self.changes += 1
+        LOGGER.debug('%s: changed', self)
+        return True
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+""" UPSweb  -  web dashboard pushed by Server-Sent Events from the poller service
+
+    Serves a static dashboard page with the monitor table of all UPSs.  After
+    each poll of the service, the table cells are formatted once, compared with
+    the previous poll, and only the changed cells are pushed to all connected
+    browsers as a single Server-Sent Event.  A newly connected browser first
+    receives the full table.  Browsers never cause snmp traffic and updates
+    arrive as soon as the poll completes.  All connections are handled by one
+    event loop thread.
+
+    Copyright (C) 2023  RicksLab
+
+    This program is free software: you can redistribute it and/or modify it
+    under the terms of the GNU General Public License as published by the Free
+    Software Foundation, either version 3 of the License, or (at your option)
+    any later version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+    FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+    more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+__author__ = 'RicksLab'
+__copyright__ = 'Copyright (C) 2023 RicksLab'
+__license__ = 'GNU General Public License'
+__program_name__ = 'ups-utils'
+__maintainer__ = 'RicksLab'
+__docformat__ = 'reStructuredText'
+
+# pylint: disable=multiple-statements
+# pylint: disable=line-too-long
+# pylint: disable=consider-using-f-string
+
+import re
+import json
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Tuple, Set, Optional, Iterable, Any
+from UPSmodules.UPSKeys import MiB
+from UPSmodules.env import UT_CONST
+from UPSmodules.UPSmodule import UpsItem
+from UPSmodules.UPSbreaker import BreakerState
+
+
+LOGGER = logging.getLogger('ups-utils')
+
+KEEPALIVE_SECONDS = 15.0
+# Clients with more unsent bytes than this are disconnected instead of buffering without limit.
+MAX_CLIENT_BUFFER = 1 << 20
+
+DASHBOARD_PAGE = b'''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>ups-utils</title>
+<style>
+body { font-family: sans-serif; background: #202020; color: #e0e0e0; }
+table { border-collapse: collapse; }
+th, td { border: 1px solid #505050; padding: 2px 10px; text-align: center; }
+th { color: #00c0c0; }
+td.label { text-align: left; color: #00c0c0; }
+.ok { color: #00e000; } .error, .crit { color: #ff3030; font-weight: bold; }
+.warn { color: #ffc000; font-weight: bold; } .stale { opacity: 0.5; }
+#status { font-size: small; color: #909090; }
+</style></head>
+<body><table id="table"></table><p id="status">Connecting...</p>
+<script>
+const table = document.getElementById('table');
+const status = document.getElementById('status');
+const cells = {};
+function full(data) {
+  table.textContent = '';
+  const head = table.insertRow();
+  head.appendChild(document.createElement('th')).textContent = 'UPS Parameters';
+  for (const ups of data.upss) head.appendChild(document.createElement('th')).textContent = ups;
+  for (const [param, label] of data.params) {
+    const row = table.insertRow();
+    const cell = row.insertCell();
+    cell.textContent = label;
+    cell.className = 'label';
+    for (const ups of data.upss) cells[ups + '\\t' + param] = row.insertCell();
+  }
+  delta(data);
+}
+function delta(data) {
+  for (const [ups, param, text, style] of data.cells) {
+    const cell = cells[ups + '\\t' + param];
+    if (cell) { cell.textContent = text; cell.className = style; }
+  }
+  status.textContent = 'Updated ' + new Date(data.time * 1000).toLocaleString();
+}
+const source = new EventSource('events');
+source.addEventListener('full', event => full(JSON.parse(event.data)));
+source.addEventListener('delta', event => delta(JSON.parse(event.data)));
+source.onerror = () => { status.textContent = 'Disconnected, retrying...'; };
+</script></body></html>
+'''
+
+
+def cell_style(param_name: Any, value: Any, daemon: Optional[Any] = None) -> str:
+    """ Get the style class of a table cell, using the same rules as the ups-mon table.
+
+    :param param_name: Table parameter name.
+    :param value: Parameter value.
+    :param daemon: UpsDaemon used for threshold formatting, if available.
+    :return: Style class name.
+    """
+    if value is None: return ''
+    if param_name == MiB.system_status:
+        return 'ok' if re.match(UT_CONST.PATTERNS['ONLINE'], str(value)) else 'error'
+    if param_name == MiB.battery_status:
+        return 'ok' if re.match(UT_CONST.PATTERNS['NORMAL'], str(value)) else 'error'
+    if param_name == 'comm_state':
+        return 'ok' if value == BreakerState.closed.name else 'error'
+    if daemon and param_name in daemon.daemon_param_dict:
+        style = daemon.daemon_format(param_name, value)
+        return '' if style == 'none' else style
+    return ''
+
+
+class DashboardServer:
+    """ HTTP server of the dashboard page and its event stream, updated by the poller service after each poll.
+    """
+    def __init__(self, address: str = '127.0.0.1:8163', daemon: Optional[Any] = None):
+        """
+        :param address: Listen address as [HOST:]PORT.  The default host is localhost.
+        :param daemon: UpsDaemon used for threshold formatting.
+        """
+        host, _, port = address.rpartition(':')
+        self.address: Tuple[str, int] = (host.strip('[]') or '127.0.0.1', int(port))
+        self.daemon = daemon
+        self.version: int = 0
+        self._cells: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        self._full_event: bytes = b''
+        self._clients: Set[asyncio.StreamWriter] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def __repr__(self) -> str:
+        return 'DashboardServer: http://{}:{}/'.format(*self.address)
+
+    def _event(self, event: str, data: Dict[str, Any]) -> bytes:
+        return 'event: {}\nid: {}\ndata: {}\n\n'.format(event, self.version,
+                                                       json.dumps(data, separators=(',', ':'))).encode('utf-8')
+
+    def update(self, upss: Iterable[Any], stats: Dict[str, float]) -> None:
+        """ Format the table cells of the latest values and push the changed cells to all browsers.
+
+        :param upss: Iterable of UpsItem objects.
+        :param stats: Poll statistics of the service.
+        """
+        params = [param for param in UpsItem.ordered_table_items
+                  if param != 'display_name' and param in UpsItem.table_list]
+        cells: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        names: List[str] = []
+        for ups in upss:
+            prm = ups.prm
+            names.append(prm.display_name)
+            stale = '' if prm.get('responsive') else ' stale'
+            for param in params:
+                value = prm.get(param)
+                cells[(prm.display_name, str(param))] = ('---' if value is None else str(value),
+                                                         cell_style(param, value, self.daemon) + stale)
+        self.version += 1
+        header = {'time': stats.get('poll_time', 0.0)}
+        layout_changed = cells.keys() != self._cells.keys()
+        self._full_event = self._event('full', {
+            **header, 'upss': names, 'params': [[str(param), UpsItem.param_labels[param]] for param in params],
+            'cells': [[ups, param, text, style] for (ups, param), (text, style) in cells.items()]})
+        changed = [[ups, param, text, style] for (ups, param), (text, style) in cells.items()
+                   if self._cells.get((ups, param)) != (text, style)]
+        self._cells = cells
+        if layout_changed:
+            payload = self._full_event
+        else:
+            payload = self._event('delta', {**header, 'cells': changed})
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._broadcast, payload)
+
+    def _broadcast(self, payload: bytes) -> None:
+        """ Write an event to all connected browsers.  Run in the event loop thread.
+        """
+        for writer in list(self._clients):
+            if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                LOGGER.debug('dashboard client too slow, disconnecting')
+                self._clients.discard(writer)
+                writer.close()
+                continue
+            writer.write(payload)
+
+    def start(self) -> None:
+        """ Start serving in a background thread.
+
+        :raises OSError: If the address can not be bound.
+        """
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, *self.address))
+        except OSError:
+            self._loop.close()
+            self._loop = None
+            raise
+        self.address = self._server.sockets[0].getsockname()[:2]
+        self._loop.call_later(KEEPALIVE_SECONDS, self._keepalive)
+        threading.Thread(target=self._loop.run_forever, daemon=True).start()
+        LOGGER.debug('Started %s', self)
+
+    def stop(self) -> None:
+        """ Stop serving and close all connections.
+        """
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._loop = self._server = None
+
+    def _keepalive(self) -> None:
+        """ Send a comment line so proxies do not close idle event streams.
+        """
+        self._broadcast(b': keepalive\n\n')
+        if self._loop:
+            self._loop.call_later(KEEPALIVE_SECONDS, self._keepalive)
+
+    @staticmethod
+    def _response(writer: asyncio.StreamWriter, status: str, content_type: str, body: bytes) -> None:
+        writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            status, content_type, len(body)).encode('latin-1') + body)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Handle one HTTP request.  An event stream request keeps the connection open.
+        """
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout=10.0)
+            method, path = (request.split(b'\r\n', 1)[0].decode('latin-1').split(' ') + ['', ''])[:2]
+            path = path.split('?', 1)[0]
+            if method != 'GET':
+                self._response(writer, '405 Method Not Allowed', 'text/plain; charset=utf-8', b'Method Not Allowed\n')
+            elif path in {'/', '/index.html'}:
+                self._response(writer, '200 OK', 'text/html; charset=utf-8', DASHBOARD_PAGE)
+            elif path == '/events':
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                             b'Connection: keep-alive\r\n\r\nretry: 2000\n\n' + self._full_event)
+                self._clients.add(writer)
+                # The browser never sends more data, so wait until it disconnects.
+                while await reader.read(1024): pass
+                return
+            else:
+                self._response(writer, '404 Not Found', 'text/plain; charset=utf-8', b'Not Found\n')
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError) as error:
+            LOGGER.debug('dashboard client: %s', error)
+        finally:
+            self._clients.discard(writer)
+            writer.close()
@@ -33,13 +33,10 @@ import sys
 import os
 import grp
 import re
-import inspect
 import logging
-from pathlib import Path
 import shutil
-from datetime import datetime
-from typing import Dict, Union, TextIO, Set, Optional
-import pytz
+from datetime import datetime, timezone
+from typing import Dict, Union, Set, Optional, Any
 from UPSmodules import __version__, __status__, __credits__, __required_pversion__, __required_kversion__
 from UPSmodules.UPSKeys import MarkUpCodes
 
@@ -137,14 +134,14 @@ class UtConst:
 
     # Private items
     # Utility Repository Path Definitions
-    _repository_module_path: str = os.path.dirname(str(Path(__file__).resolve()))
+    _repository_module_path: str = os.path.dirname(os.path.realpath(__file__))
     _repository_path: str = os.path.join(_repository_module_path, '..')
     _local_icon_list: Dict[str, str] = {'repository': os.path.join(_repository_path, 'icons'),
                                         'debian': '/usr/share/rickslab-ups-utils/icons',
-                                        'pypi-linux': '{}/.local/share/rickslab-ups-utils/icons'.format(str(Path.home()))}
+                                        'pypi-linux': '{}/.local/share/rickslab-ups-utils/icons'.format(os.path.expanduser('~'))}
     _local_config_list: Dict[str, str] = {'repository': _repository_path,
                                           'debian': '/usr/share/rickslab-ups-utils/config',
-                                          'pypi-linux': '{}/.local/share/rickslab-ups-utils/config'.format(str(Path.home()))}
+                                          'pypi-linux': '{}/.local/share/rickslab-ups-utils/config'.format(os.path.expanduser('~'))}
     _icons: Dict[str, str] = {'ups-mon': 'ups-utils-monitor.icon.png'}
     _config_file_names: Dict[str, str] = {'json': 'ups-config.json', 'ini': 'ups-utils.ini'}
     _all_args: Set[str] = {'debug', 'show_unresponsive', 'log', 'no_markup', 'ltz', 'verbose', 'sleep'}
@@ -163,7 +160,7 @@ class UtConst:
         self.ups_json_file: Optional[str] = None
         self.ups_config_ini: Optional[str] = None
         self.install_type: Optional[str] = None
-        self.package_path: str = inspect.getfile(inspect.currentframe())
+        self.package_path: str = __file__
         # Flags used by signals
         self.quit: bool = False
         self.refresh_daemon: bool = False
@@ -174,7 +171,25 @@ class UtConst:
         self._icon_path: str = self._local_icon_list[self.install_type]
         self.icon_file: str = ''
 
-        # Set config Path
+        # Utility Execution Flags
+        self.debug: bool = False
+        self.show_unresponsive: bool = False
+        self.log: bool = False
+        self.no_markup: bool = False
+        self.log_file: Optional[str] = None
+        self.log_writer: Optional[Any] = None
+        self.use_ltz: bool = False
+        self.ltz = datetime.utcnow().astimezone().tzinfo
+        self.verbose = False
+        self.sleep: int = 30
+
+    def find_config_files(self, required: bool = True) -> bool:
+        """ Find and check the configuration files.  This is done by set_env_args instead of
+            at import, so importing the modules has no file system side effects.
+
+        :param required: If True, exit when a configuration file is missing or mis-configured.
+        :return: True if both configuration files were found.
+        """
         config_list = {self.install_type: self._local_config_list[self.install_type]}
         for try_config_path in config_list.values():
             if os.path.isdir(try_config_path):
@@ -186,7 +201,10 @@ class UtConst:
                                 self.config_files[config_type] = None
             if None not in self.config_files.values():
                 break
+        self.ups_json_file = self.config_files['json']
+        self.ups_config_ini = self.config_files['ini']
         if None in self.config_files.values():
+            if not required: return False
             reset = UtConst.mark_up_codes[MarkUpCodes.reset]
             color = '{}{}'.format(UtConst.mark_up_codes[MarkUpCodes.red],
                                   UtConst.mark_up_codes[MarkUpCodes.bold])
@@ -197,24 +215,11 @@ class UtConst:
             print('    Configuration file templates are located at:\n       [{}]'.format(
                 self._local_config_list[self.install_type]))
             sys.exit(-1)
-
-        self.ups_json_file = self.config_files['json']
-        self.ups_config_ini = self.config_files['ini']
-
-        # Utility Execution Flags
-        self.debug: bool = False
-        self.show_unresponsive: bool = False
-        self.log: bool = False
-        self.no_markup: bool = False
-        self.log_file_ptr: Optional[TextIO] = None
-        self.use_ltz: bool = False
-        self.ltz = datetime.utcnow().astimezone().tzinfo
-        self.verbose = False
-        self.sleep: int = 30
+        return True
 
     def set_env_args(self, args: argparse.Namespace, program_name: str = None) -> None:
         """
-        Set arguments for the give args object.
+        Set arguments for the give args object and find the configuration files.
 
         :param args: The object return by args parser.
         :param program_name: Name of calling program.
@@ -224,6 +229,7 @@ class UtConst:
             # though I removed it from setup.py
             print('The ups-monitor executable no longer valid.  Use ups-mon instead.')
             sys.exit(-1)
+        self.find_config_files()
         self.calling_program = program_name
         self.args = args
         if not self.ups_config_ini and program_name == 'ups-daemon':
@@ -255,7 +261,7 @@ class UtConst:
         LOGGER.debug('Calling program: %s', program_name)
         LOGGER.debug('Command line arguments:\n  %s', args)
         LOGGER.debug('Local TZ: %s', self.ltz)
-        LOGGER.debug('Module directory: %s', inspect.getfile(inspect.currentframe()))
+        LOGGER.debug('Module directory: %s', self.package_path)
         LOGGER.debug('Icon path set to: %s', self._icon_path)
         LOGGER.debug('Config file set to: %s', self.ups_config_ini)
         LOGGER.debug('Json file set to: %s', self.ups_config_ini)
@@ -296,7 +302,7 @@ class UtConst:
         :param as_string:  Set to True to time as a string
         :return:  Returns current time as datetime object or formatted string
         """
-        now_time = datetime.now(tz=self.ltz) if ltz else datetime.now(tz=pytz.UTC)
+        now_time = datetime.now(tz=self.ltz) if ltz else datetime.now(tz=timezone.utc)
         if as_string:
             tz_str = self.ltz if ltz else 'UTC'
             return '{} {}'.format(now_time.strftime(self.TIME_FORMAT), tz_str)
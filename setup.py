@@ -67,7 +67,8 @@ setup(name='rickslab-ups-utils',
                    'Topic :: System :: Power (UPS)',
                    'Topic :: System :: Monitoring',
                    'License :: OSI Approved :: GNU General Public License v3 (GPLv3)'],
-      install_requires=['pytz>=2019.3'],
+      install_requires=[],
+      extras_require={'analysis': ['numpy>=1.17']},
       data_files=[('share/rickslab-ups-utils/icons', ['icons/ups-utils-monitor.icon.png']),
                   ('share/rickslab-ups-utils/doc', ['README.md', 'LICENSE']),
                   ('share/rickslab-ups-utils/config', ['ups-utils.ini.template',